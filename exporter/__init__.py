@@ -0,0 +1,4 @@
+# This file makes the exporter directory a Python package
+#
+# Shared building blocks used by main.py and by the modules in the
+# `metrics` and `mcps` directories.
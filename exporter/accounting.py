@@ -0,0 +1,241 @@
+import gc
+import os
+import re
+import sys
+import threading
+import time
+
+from prometheus_client import Gauge
+
+from .collectors import module_collectors
+
+# Per-module resource accounting. Plugins share one interpreter, so memory
+# is attributed by what each module retains: the size of every object
+# reachable from the module's namespace, not following other modules,
+# classes or functions' globals. That is where leaks live (cached payloads,
+# unbounded label sets), and walking it periodically costs nothing between
+# passes, unlike tracing every allocation.
+#
+# Limits are "name=soft:hard" lists, `default` applying to modules without
+# their own entry, e.g. "default=256M:1G,zstack_inventory_metrics=1G:2G".
+# Crossing a soft limit logs a warning; crossing a hard limit disables the
+# module until its file changes.
+
+# Seconds between accounting passes (0 disables accounting and limits)
+MODULE_ACCOUNTING_INTERVAL = float(os.environ.get('MODULE_ACCOUNTING_INTERVAL', 60))
+MODULE_MEMORY_LIMITS = os.environ.get('MODULE_MEMORY_LIMITS', '')
+MODULE_SERIES_LIMITS = os.environ.get('MODULE_SERIES_LIMITS', '')
+
+module_memory = Gauge('exporter_module_memory_bytes', 'Memory retained by objects reachable from a loaded module', ['module', 'kind'])
+module_series = Gauge('exporter_module_series', 'Series exposed by a loaded metric module', ['module'])
+module_memory_limit = Gauge('exporter_module_memory_limit_bytes', 'Memory limit of a module', ['module', 'kind', 'limit'])
+module_series_limit = Gauge('exporter_module_series_limit', 'Series limit of a metric module', ['module', 'limit'])
+module_disabled = Gauge('exporter_module_disabled', 'Modules disabled for exceeding a hard limit', ['module', 'kind', 'resource'])
+accounting_duration = Gauge('exporter_module_accounting_seconds', 'Duration of the last module accounting pass')
+
+# (kind, name) -> (resource, reason) of modules disabled by a hard limit
+disabled = {}
+_disabled_lock = threading.Lock()
+
+_SIZE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*$', re.I)
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(value):
+    """Parse a byte size such as 512M, 1.5GiB or 1048576"""
+    match = _SIZE.match(value)
+    if not match:
+        raise ValueError(f"Invalid size: {value!r}")
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+
+def parse_limits(value, parse=int):
+    """Parse "name=soft:hard,..." into {name: (soft, hard)}, either may be None"""
+    limits = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        name, _, bounds = item.partition('=')
+        soft, _, hard = bounds.partition(':')
+        limits[name.strip()] = (parse(soft) if soft.strip() else None, parse(hard) if hard.strip() else None)
+    return limits
+
+
+def _boundaries(plugin_packages=('metrics', 'mcps')):
+    """ids of the objects a module walk must not enter
+
+    Every module and its namespace, and the globals of modules that aren't
+    plugins: those are shared, like the MCP server or the Prometheus
+    registry, and would otherwise be counted for each plugin importing them.
+    """
+    stop = set()
+    for name, module in list(sys.modules.items()):
+        stop.add(id(module))
+        namespace = getattr(module, '__dict__', None)
+        if namespace is None:
+            continue
+        stop.add(id(namespace))
+        if name.partition('.')[0] not in plugin_packages or '.' not in name:
+            stop.update(id(value) for value in list(namespace.values()))
+    return stop
+
+
+def retained_size(module, stop=None):
+    """Approximate bytes retained by the objects reachable from a module
+
+    Classes are shared and not counted. Objects referenced by several
+    modules are counted in each of them.
+    """
+    seen = set(_boundaries() if stop is None else stop)
+    namespace = getattr(module, '__dict__', None)
+    if isinstance(module, type(sys)):
+        # The module's own namespace is a boundary for the walk, not for the count
+        size = sys.getsizeof(namespace)
+        pending = list(namespace.values())
+    else:
+        size = 0
+        pending = [module]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return size
+
+
+def series_count(module):
+    """Number of samples a metric module currently exposes"""
+    count = 0
+    for collector in module_collectors(module):
+        for family in collector.collect():
+            count += sum(1 for sample in family.samples if not sample.name.endswith('_created'))
+    return count
+
+
+class Accountant:
+    """Measures loaded modules and enforces their limits
+
+    `get_modules()` returns [(kind, name, module)] for the loaded modules,
+    kind being "metrics" or "mcp"; `disable(kind, name)` unloads a module
+    that crossed a hard limit. It stays disabled until enable() is called.
+    """
+
+    def __init__(self, get_modules, disable, memory_limits=None, series_limits=None):
+        self.get_modules = get_modules
+        self.disable = disable
+        self.memory_limits = parse_limits(MODULE_MEMORY_LIMITS, parse_size) if memory_limits is None else memory_limits
+        self.series_limits = parse_limits(MODULE_SERIES_LIMITS) if series_limits is None else series_limits
+        # (kind, name, resource) currently over their soft limit, warned about once
+        self.over_soft = set()
+        self.measured = set()
+
+    def limits(self, limits, name):
+        return limits.get(name, limits.get('default', (None, None)))
+
+    def check(self, kind, name, resource, value, limits):
+        """Warn above the soft limit; return a reason to disable the module above the hard one"""
+        soft, hard = limits
+        if hard is not None and value > hard:
+            return f"{resource} {value} over the hard limit of {hard}"
+        key = (kind, name, resource)
+        if soft is not None and value > soft:
+            if key not in self.over_soft:
+                self.over_soft.add(key)
+                print(f"Module {name} is over its soft {resource} limit: {value} > {soft}")
+        else:
+            self.over_soft.discard(key)
+        return None
+
+    def account(self):
+        """Measure every loaded module once and apply the limits"""
+        start = time.time()
+        stop = _boundaries()
+        measured = set()
+        for kind, name, module in self.get_modules():
+            if module is None:
+                continue  # MCP modules indexed but not imported yet
+            measured.add((kind, name))
+            memory = retained_size(module, stop)
+            module_memory.labels(module=name, kind=kind).set(memory)
+            memory_limits = self.limits(self.memory_limits, name)
+            for limit, value in zip(('soft', 'hard'), memory_limits):
+                if value is not None:
+                    module_memory_limit.labels(module=name, kind=kind, limit=limit).set(value)
+            reason = self.check(kind, name, 'memory', memory, memory_limits)
+            resource = 'memory'
+
+            if reason is None and kind == 'metrics':
+                series = series_count(module)
+                module_series.labels(module=name).set(series)
+                series_limits = self.limits(self.series_limits, name)
+                for limit, value in zip(('soft', 'hard'), series_limits):
+                    if value is not None:
+                        module_series_limit.labels(module=name, limit=limit).set(value)
+                reason = self.check(kind, name, 'series', series, series_limits)
+                resource = 'series'
+
+            if reason is not None:
+                print(f"Disabling module {name}: {reason}")
+                with _disabled_lock:
+                    disabled[(kind, name)] = (resource, reason)
+                module_disabled.labels(module=name, kind=kind, resource=resource).set(1)
+                self.disable(kind, name)
+                measured.discard((kind, name))
+
+        # Drop the series of modules that were unloaded since the last pass
+        for kind, name in self.measured - measured:
+            self.forget(kind, name)
+        self.measured = measured
+        accounting_duration.set(time.time() - start)
+
+    def forget(self, kind, name):
+        _remove(module_memory, name, kind)
+        _remove(module_series, name)
+        for limit in ('soft', 'hard'):
+            _remove(module_memory_limit, name, kind, limit)
+            _remove(module_series_limit, name, limit)
+        for resource in ('memory', 'series'):
+            self.over_soft.discard((kind, name, resource))
+
+
+def _remove(gauge, *labels):
+    try:
+        gauge.remove(*labels)
+    except KeyError:
+        pass
+
+
+def is_disabled(kind, name):
+    with _disabled_lock:
+        return (kind, name) in disabled
+
+
+def enable(kind, name):
+    """Allow a disabled module to be loaded again, e.g. once its file changed"""
+    with _disabled_lock:
+        resource = disabled.pop((kind, name), (None,))[0]
+    if resource is not None:
+        _remove(module_disabled, name, kind, resource)
+        print(f"Module {name} re-enabled")
+
+
+def start_accounting(get_modules, disable):
+    """Account modules every MODULE_ACCOUNTING_INTERVAL seconds in a background thread"""
+    accountant = Accountant(get_modules, disable)
+    if MODULE_ACCOUNTING_INTERVAL <= 0:
+        return accountant
+
+    def accounting_loop():
+        while True:
+            try:
+                accountant.account()
+            except Exception as e:
+                print(f"Error accounting modules: {e}")
+            time.sleep(MODULE_ACCOUNTING_INTERVAL)
+
+    thread = threading.Thread(target=accounting_loop, name='module-accounting')
+    thread.daemon = True
+    thread.start()
+    return accountant
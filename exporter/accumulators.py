@@ -0,0 +1,231 @@
+import bisect
+import math
+import threading
+
+from prometheus_client import REGISTRY
+from prometheus_client.core import CounterMetricFamily, HistogramMetricFamily
+from prometheus_client.metrics import Histogram
+from prometheus_client.utils import floatToGoString
+
+# Sharded accumulators for modules observing events at high rates, e.g. from
+# log or message stream readers. prometheus_client takes a per-child lock on
+# every inc()/observe(); here every writer thread adds into its own shard
+# without any lock, and the shards are only merged when the metric is
+# collected (scrape, push or update diff).
+#
+#     requests = ShardedCounter('access_log_requests', 'Requests seen in the access log', ['status'])
+#     latency = ShardedHistogram('access_log_latency_seconds', 'Request latency from the access log')
+#
+#     requests.labels('200').inc()
+#     latency.observe(0.042)
+#
+# An accumulator is only written by its own thread, so no update is lost;
+# a concurrent merge may just miss the latest increments.
+
+
+class _Shards:
+    """The per-thread accumulators of one metric
+
+    An accumulator is a list of floats owned by one (thread, label values)
+    pair; merging adds the lists of all threads element-wise.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        # [(thread, label values, accumulator)] of every thread that has written
+        self.shards = []
+        # Totals of threads that have exited
+        self.retired = {}
+        self.lock = threading.Lock()
+
+    def new(self, key):
+        accumulator = [0.0] * self.size
+        with self.lock:
+            self.shards.append((threading.current_thread(), key, accumulator))
+        return accumulator
+
+    def merged(self):
+        """Return {label values: merged accumulator} across all threads"""
+        with self.lock:
+            live = []
+            for shard in self.shards:
+                thread, key, accumulator = shard
+                if thread.is_alive():
+                    live.append(shard)
+                else:
+                    self.retired[key] = _add(self.retired.get(key), accumulator)
+            self.shards = live
+            total = {key: list(accumulator) for key, accumulator in self.retired.items()}
+        # The owners may keep writing meanwhile, each element is read atomically
+        for _, key, accumulator in live:
+            total[key] = _add(total.get(key), accumulator)
+        return total
+
+
+def _add(total, accumulator):
+    if total is None:
+        return list(accumulator)
+    return [a + b for a, b in zip(total, accumulator)]
+
+
+class _Metric:
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._children_lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *labelvalues, **labelkwargs):
+        """Return the child for the given label values, to keep and reuse on hot paths"""
+        if labelkwargs:
+            if labelvalues:
+                raise ValueError("Can't pass both positional and keyword label values")
+            labelvalues = tuple(labelkwargs[name] for name in self.labelnames)
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes label values for {self.labelnames}")
+        key = tuple(str(value) for value in labelvalues)
+        child = self._children.get(key)
+        if child is None:
+            with self._children_lock:
+                child = self._children.setdefault(key, self._child(key))
+        return child
+
+    def _unlabelled(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} has labels, use labels() first")
+        return self.labels()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+
+class _CounterChild:
+    __slots__ = ('shards', 'key', 'local')
+
+    def __init__(self, shards, key):
+        self.shards = shards
+        self.key = key
+        # This thread's [total]
+        self.local = threading.local()
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError("Counters can only be incremented by non-negative amounts")
+        try:
+            self.local.accumulator[0] += amount
+        except AttributeError:
+            self.local.accumulator = self.shards.new(self.key)
+            self.local.accumulator[0] += amount
+
+
+class ShardedCounter(_Metric):
+    """A counter whose increments are accumulated per thread"""
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self._shards = _Shards(1)
+        super().__init__(name[:-len('_total')] if name.endswith('_total') else name, documentation, labelnames, registry)
+
+    def _child(self, key):
+        return _CounterChild(self._shards, key)
+
+    def inc(self, amount=1):
+        self._unlabelled().inc(amount)
+
+    def restore(self, samples):
+        """Start from totals restored from a snapshot, given as (name, labels dict, value)"""
+        with self._shards.lock:
+            for name, labels, value in samples:
+                if name == self.name + '_total':
+                    self._shards.retired[self._key(labels)] = [value]
+
+    def describe(self):
+        yield CounterMetricFamily(self.name, self.documentation, labels=self.labelnames)
+
+    def collect(self):
+        family = CounterMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        merged = self._shards.merged()
+        if not self.labelnames:
+            merged.setdefault((), [0.0])
+        for key, (value,) in merged.items():
+            family.add_metric(key, value)
+        yield family
+
+
+class _HistogramChild:
+    __slots__ = ('shards', 'key', 'bounds', 'local')
+
+    def __init__(self, shards, key, bounds):
+        self.shards = shards
+        self.key = key
+        self.bounds = bounds
+        # This thread's [count per bucket..., sum]
+        self.local = threading.local()
+
+    def observe(self, amount):
+        try:
+            accumulator = self.local.accumulator
+        except AttributeError:
+            accumulator = self.local.accumulator = self.shards.new(self.key)
+        accumulator[bisect.bisect_left(self.bounds, amount)] += 1
+        accumulator[-1] += amount
+
+
+class ShardedHistogram(_Metric):
+    """A histogram whose observations are accumulated per thread"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS, registry=REGISTRY):
+        bounds = sorted(float(bound) for bound in buckets)
+        if not bounds or bounds[-1] != math.inf:
+            bounds.append(math.inf)
+        self.bounds = bounds
+        self._shards = _Shards(len(bounds) + 1)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _child(self, key):
+        return _HistogramChild(self._shards, key, self.bounds)
+
+    def observe(self, amount):
+        self._unlabelled().observe(amount)
+
+    def restore(self, samples):
+        """Start from buckets restored from a snapshot, given as (name, labels dict, value)"""
+        cumulative = {}
+        sums = {}
+        for name, labels, value in samples:
+            if name == self.name + '_bucket':
+                labels = dict(labels)
+                bound = float(labels.pop('le', 'nan'))
+                cumulative.setdefault(self._key(labels), {})[bound] = value
+            elif name == self.name + '_sum':
+                sums[self._key(labels)] = value
+        with self._shards.lock:
+            for key, buckets in cumulative.items():
+                # Buckets changed since the snapshot was taken, the old counts don't fit
+                if sorted(buckets) != self.bounds:
+                    continue
+                counts = []
+                previous = 0.0
+                for bound in self.bounds:
+                    counts.append(buckets[bound] - previous)
+                    previous = buckets[bound]
+                self._shards.retired[key] = counts + [sums.get(key, 0.0)]
+
+    def describe(self):
+        yield HistogramMetricFamily(self.name, self.documentation, labels=self.labelnames)
+
+    def collect(self):
+        family = HistogramMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        merged = self._shards.merged()
+        if not self.labelnames:
+            merged.setdefault((), [0.0] * (len(self.bounds) + 1))
+        for key, counts in merged.items():
+            buckets = []
+            cumulative = 0.0
+            for bound, count in zip(self.bounds, counts):
+                cumulative += count
+                buckets.append((floatToGoString(bound), cumulative))
+            family.add_metric(key, buckets, counts[-1])
+        yield family
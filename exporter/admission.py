@@ -0,0 +1,178 @@
+import asyncio
+import collections
+import json
+import os
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Admission control for /mcp. At most MCP_MAX_INFLIGHT requests are
+# handled at once; up to MCP_MAX_QUEUE more wait for a slot, in arrival
+# order, for at most MCP_QUEUE_TIMEOUT seconds. Anything beyond that is
+# rejected at once with HTTP 429 and a JSON-RPC error carrying
+# retry_after, before its body is parsed by the MCP server.
+#
+# Scrapes have priority: they are never queued or rejected, and while one
+# is running no queued MCP request is started, so a burst of agent
+# traffic can't delay /metrics. The priority is bounded: once
+# MCP_SCRAPE_PRIORITY scrapes have started while MCP requests were
+# waiting, the next queued request starts anyway, so overlapping scrapes
+# can't starve /mcp.
+
+MCP_MAX_INFLIGHT = int(os.environ.get('MCP_MAX_INFLIGHT', 64))
+MCP_MAX_QUEUE = int(os.environ.get('MCP_MAX_QUEUE', 256))
+# Seconds a request may wait in the queue before it is rejected
+MCP_QUEUE_TIMEOUT = float(os.environ.get('MCP_QUEUE_TIMEOUT', 10))
+# Seconds rejected clients are asked to wait before retrying
+MCP_RETRY_AFTER = int(os.environ.get('MCP_RETRY_AFTER', 1))
+# Scrapes started ahead of waiting MCP requests before one of them starts anyway (0: scrapes always go first)
+MCP_SCRAPE_PRIORITY = int(os.environ.get('MCP_SCRAPE_PRIORITY', 4))
+# Largest body of a rejected request read for its JSON-RPC id, in bytes
+MCP_REJECT_BODY_LIMIT = int(os.environ.get('MCP_REJECT_BODY_LIMIT', 65536))
+
+# JSON-RPC server error code used for rejected requests
+OVERLOADED = -32000
+
+mcp_inflight = Gauge('exporter_mcp_inflight_requests', 'MCP requests being handled')
+mcp_queue_depth = Gauge('exporter_mcp_queue_depth', 'MCP requests waiting for a slot')
+mcp_rejections = Counter('exporter_mcp_rejections', 'MCP requests rejected by admission control', ['reason'])
+mcp_admission_wait = Histogram('exporter_mcp_admission_wait_seconds', 'Time MCP requests waited for a slot')
+
+
+class Admission:
+    """In-flight slots for MCP requests, with a bounded FIFO queue and scrape priority"""
+
+    def __init__(self, max_inflight=MCP_MAX_INFLIGHT, max_queue=MCP_MAX_QUEUE, queue_timeout=MCP_QUEUE_TIMEOUT, scrape_priority=MCP_SCRAPE_PRIORITY):
+        self.max_inflight = max(max_inflight, 1)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.scrape_priority = scrape_priority
+        self.inflight = 0
+        self.scrapes = 0
+        # Scrapes started while MCP requests waited, since an MCP request last started
+        self.scrapes_ahead = 0
+        # Futures of queued requests, resolved when they get a slot
+        self.waiters = collections.deque()
+
+    def _can_start(self):
+        if self.inflight >= self.max_inflight:
+            return False
+        return self.scrapes == 0 or bool(self.scrape_priority) and self.scrapes_ahead >= self.scrape_priority
+
+    def _start(self):
+        self.scrapes_ahead = 0
+        self.inflight += 1
+        mcp_inflight.set(self.inflight)
+
+    def _wake(self):
+        while self.waiters and self._can_start():
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self._start()
+                waiter.set_result(True)
+        mcp_queue_depth.set(len(self.waiters))
+
+    async def acquire(self):
+        """Wait for a slot; returns None once admitted, or the reason for rejecting the request"""
+        if self._can_start() and not self.waiters:
+            self._start()
+            mcp_admission_wait.observe(0)
+            return None
+        if len(self.waiters) >= self.max_queue:
+            return 'queue_full'
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        mcp_queue_depth.set(len(self.waiters))
+        queued = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout or None)
+        except asyncio.TimeoutError:
+            return 'queue_timeout'
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+                mcp_queue_depth.set(len(self.waiters))
+        mcp_admission_wait.observe(time.perf_counter() - queued)
+        return None
+
+    def release(self):
+        self.inflight -= 1
+        mcp_inflight.set(self.inflight)
+        self._wake()
+
+    def scrape_started(self):
+        self.scrapes += 1
+        if self.waiters:
+            self.scrapes_ahead += 1
+            self._wake()
+
+    def scrape_finished(self):
+        self.scrapes -= 1
+        self._wake()
+
+
+admission = Admission()
+
+
+async def _request_id(receive):
+    """The JSON-RPC id of a request, read from its body (None for batches, invalid or oversized bodies)"""
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > MCP_REJECT_BODY_LIMIT:
+            return None
+        if not message.get('more_body'):
+            break
+    try:
+        request = json.loads(body)
+    except ValueError:
+        return None
+    return request.get('id') if isinstance(request, dict) else None
+
+
+async def _reject(reason, receive, send):
+    mcp_rejections.labels(reason=reason).inc()
+    body = json.dumps({
+        'jsonrpc': '2.0',
+        'id': await _request_id(receive),
+        'error': {
+            'code': OVERLOADED,
+            'message': 'Server overloaded, retry later',
+            'data': {'retry_after': MCP_RETRY_AFTER, 'reason': reason},
+        },
+    }).encode()
+    await send({'type': 'http.response.start', 'status': 429, 'headers': [
+        (b'content-type', b'application/json'),
+        (b'retry-after', str(MCP_RETRY_AFTER).encode()),
+        (b'content-length', str(len(body)).encode()),
+    ]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def admitted(asgi_app, gate=admission):
+    """Wrap the MCP app so every HTTP request needs a slot"""
+    async def admitted_app(scope, receive, send):
+        if scope['type'] != 'http':
+            return await asgi_app(scope, receive, send)
+        reason = await gate.acquire()
+        if reason is not None:
+            return await _reject(reason, receive, send)
+        try:
+            await asgi_app(scope, receive, send)
+        finally:
+            gate.release()
+    return admitted_app
+
+
+def prioritized(asgi_app, gate=admission):
+    """Wrap the metrics app so queued MCP requests wait while a scrape runs"""
+    async def prioritized_app(scope, receive, send):
+        if scope['type'] != 'http':
+            return await asgi_app(scope, receive, send)
+        gate.scrape_started()
+        try:
+            await asgi_app(scope, receive, send)
+        finally:
+            gate.scrape_finished()
+    return prioritized_app
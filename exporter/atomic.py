@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import namedtuple
+
+from prometheus_client import REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+# One published set of samples: {family name: {label values tuple: value}}
+Generation = namedtuple('Generation', ['number', 'values', 'published'])
+
+
+class AtomicGauges:
+    """A group of gauge families updated together with a single atomic swap
+
+    Collectors build a complete new set of samples and `publish()` it.
+    Scrapes and MCP tools read `current()`, which always returns one
+    consistent generation without taking any lock: the previous generation
+    is never modified, it is simply replaced.
+
+        capacity = AtomicGauges({
+            'zstack_totalCpuCapacity': ('Total CPU capacity in ZStack', []),
+            'zstack_availableCpuCapacity': ('Available CPU capacity in ZStack', []),
+        })
+        capacity.publish({'zstack_totalCpuCapacity': 64, 'zstack_availableCpuCapacity': 16})
+    """
+
+    def __init__(self, families, registry=REGISTRY):
+        # {name: (documentation, label names)}
+        self.families = {name: (documentation, tuple(labelnames)) for name, (documentation, labelnames) in families.items()}
+        # Like prometheus_client gauges, unlabelled families start at 0
+        initial = {name: ({} if labelnames else {(): 0.0}) for name, (_, labelnames) in self.families.items()}
+        self._generation = Generation(0, initial, 0.0)
+        # Serializes writers only, readers never take it
+        self._publish_lock = threading.Lock()
+        # Optional limit(previous values, new values) -> values applied on publish, see exporter/cardinality.py
+        self.limit = None
+        if registry is not None:
+            registry.register(self)
+
+    def publish(self, values):
+        """Atomically replace every family with the given samples
+
+        `values` maps family names to either a number (unlabelled families)
+        or a {label values tuple: number} dict. Families that are left out
+        are published empty.
+        """
+        new_values = {}
+        for name in self.families:
+            samples = values.get(name, {})
+            if not isinstance(samples, dict):
+                samples = {(): samples}
+            new_values[name] = {tuple(labels): float(value) for labels, value in samples.items()}
+        with self._publish_lock:
+            if self.limit is not None:
+                new_values = self.limit(self._generation.values, new_values)
+            self._generation = Generation(self._generation.number + 1, new_values, time.time())
+        return self._generation
+
+    def current(self):
+        """Return the latest published generation"""
+        return self._generation
+
+    def value(self, name, *labelvalues, default=0.0):
+        """Return one sample of the latest generation"""
+        return self._generation.values.get(name, {}).get(tuple(labelvalues), default)
+
+    def restore(self, samples):
+        """Publish samples restored from a snapshot, given as (name, labels dict, value)"""
+        values = {name: {} for name in self.families}
+        for name, labels, value in samples:
+            if name not in self.families:
+                continue
+            _, labelnames = self.families[name]
+            values[name][tuple(labels.get(label, '') for label in labelnames)] = value
+        self.publish(values)
+
+    def describe(self):
+        for name, (documentation, labelnames) in self.families.items():
+            yield GaugeMetricFamily(name, documentation, labels=labelnames)
+
+    def collect(self):
+        generation = self._generation
+        for name, (documentation, labelnames) in self.families.items():
+            family = GaugeMetricFamily(name, documentation, labels=labelnames)
+            for labelvalues, value in generation.values[name].items():
+                family.add_metric(labelvalues, value)
+            yield family
+
+    def unregister(self, registry=REGISTRY):
+        try:
+            registry.unregister(self)
+        except KeyError:
+            pass
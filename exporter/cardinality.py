@@ -0,0 +1,227 @@
+import os
+import threading
+
+from prometheus_client import Counter
+from prometheus_client.metrics import MetricWrapperBase
+
+from .accounting import parse_limits
+from .accumulators import _Metric
+from .atomic import AtomicGauges
+from .collectors import module_collectors
+from .compact import CompactGauges
+
+# Cardinality caps. Once a metric, or all metrics of a module together,
+# hold as many label sets as their limit allows, new label sets are folded
+# into one overflow series whose label values are all OVERFLOW_VALUE, and
+# every fold is counted in exporter_series_overflow. Existing series keep
+# updating. For gauge groups the overflow series of a publish holds the
+# number of label sets folded into it, their values being unrelated.
+# Scrape size and the memory held by label children therefore stay
+# bounded whatever a plugin feeds into its labels.
+#
+# Caps apply to the prometheus_client metrics, sharded accumulators,
+# AtomicGauges and CompactGauges found in a metric module. Other custom
+# collectors are only covered by MODULE_SERIES_LIMITS, which disables the
+# whole module.
+
+# Label sets per metric without a limit of its own (0 disables the cap)
+CARDINALITY_METRIC_LIMIT = int(os.environ.get('CARDINALITY_METRIC_LIMIT', 100000))
+# Label sets across all metrics of a module without a limit of its own (0 disables the cap)
+CARDINALITY_MODULE_LIMIT = int(os.environ.get('CARDINALITY_MODULE_LIMIT', 500000))
+# "name=limit,..." overrides for metric or module names
+CARDINALITY_LIMITS = os.environ.get('CARDINALITY_LIMITS', '')
+
+# Value of every label of the overflow series
+OVERFLOW_VALUE = '__overflow__'
+
+series_overflow = Counter('exporter_series_overflow', 'Label sets folded into the overflow series by a cardinality limit', ['module', 'metric'])
+
+
+class Guard:
+    """Cardinality limits of one module and the current size of its metrics
+
+    A module may set its own per-metric limits with a `CARDINALITY_LIMITS`
+    dict; CARDINALITY_LIMITS from the environment takes precedence.
+    """
+
+    def __init__(self, module_name, declared=None):
+        self.module_name = module_name
+        overrides = {name: soft for name, (soft, _) in parse_limits(CARDINALITY_LIMITS).items()}
+        self.limits = dict(declared or {})
+        self.limits.update(overrides)
+        self.module_limit = self.limits.get(module_name, CARDINALITY_MODULE_LIMIT)
+        # metric name -> its number of series, and their running total,
+        # updated as series are added and removed
+        self.sizes = {}
+        self.size = 0
+        self.lock = threading.Lock()
+        # Only guards the sizes, never held while taking another lock
+        self.sizes_lock = threading.Lock()
+
+    def metric_limit(self, name):
+        return self.limits.get(name, CARDINALITY_METRIC_LIMIT)
+
+    def resize(self, name, size):
+        """Record the current number of series of a metric"""
+        with self.sizes_lock:
+            self.size += size - self.sizes.get(name, 0)
+            self.sizes[name] = size
+
+    def total(self, exclude=()):
+        return self.size - sum(self.sizes.get(name, 0) for name in exclude)
+
+    def admit(self, name, current):
+        """Whether a metric holding `current` series may add one more"""
+        limit = self.metric_limit(name)
+        if limit and current >= limit:
+            return False
+        return not self.module_limit or self.size < self.module_limit
+
+    def overflowed(self, name, count=1):
+        series_overflow.labels(module=self.module_name, metric=name).inc(count)
+
+
+def _child_key(labelnames, labelvalues, labelkwargs):
+    """The label values tuple a labels() call refers to, None if the call is invalid"""
+    if labelkwargs:
+        if labelvalues or sorted(labelkwargs) != sorted(labelnames):
+            return None
+        return tuple(str(labelkwargs[name]) for name in labelnames)
+    if len(labelvalues) != len(labelnames):
+        return None
+    return tuple(str(value) for value in labelvalues)
+
+
+def _cap_labels(guard, metric, name, labelnames, children):
+    """Route labels() calls for new label sets past the limit to the overflow child"""
+    original = metric.labels
+    overflow = (OVERFLOW_VALUE,) * len(labelnames)
+
+    def labels(*labelvalues, **labelkwargs):
+        key = _child_key(labelnames, labelvalues, labelkwargs)
+        # Existing children and invalid calls take the usual path
+        if key is None or key in children():
+            return original(*labelvalues, **labelkwargs)
+        with guard.lock:
+            if key in children() or guard.admit(name, len(children())):
+                child = original(*labelvalues, **labelkwargs)
+                guard.resize(name, len(children()))
+                return child
+        guard.overflowed(name)
+        child = original(*overflow)
+        guard.resize(name, len(children()))
+        return child
+
+    labels.__doc__ = original.__doc__
+    metric.labels = labels
+    # Removed children no longer count
+    for removal in ('remove', 'remove_by_labels', 'clear'):
+        if hasattr(metric, removal):
+            setattr(metric, removal, _resized(guard, name, getattr(metric, removal), lambda: len(children())))
+
+
+def _resized(guard, name, original, size):
+    """Wrap a method that may change a metric's number of series to record its new size"""
+    def method(*args, **kwargs):
+        try:
+            return original(*args, **kwargs)
+        finally:
+            guard.resize(name, size())
+
+    method.__doc__ = original.__doc__
+    return method
+
+
+def _cap_gauges(guard, gauges):
+    """Fold the label sets of each published generation that exceed the limits"""
+    names = set(gauges.families)
+    for name in names:
+        guard.resize(name, len(gauges.current().values.get(name, ())))
+
+    def limit(previous, values):
+        budget = guard.module_limit - guard.total(exclude=names) if guard.module_limit else None
+        limited = {}
+        for name, samples in values.items():
+            labelnames = gauges.families[name][1]
+            allowed = guard.metric_limit(name) or len(samples)
+            if budget is not None:
+                allowed = max(min(allowed, budget), 0)
+            if not labelnames or len(samples) <= allowed:
+                limited[name] = samples
+            else:
+                # Series that already existed keep their place, new ones fill what's left
+                existing = previous.get(name, {})
+                ordered = sorted(samples, key=lambda key: key not in existing)
+                kept = {key: samples[key] for key in ordered[:allowed]}
+                folded = ordered[allowed:]
+                # The values of unrelated series don't add up, the overflow series counts them
+                kept[(OVERFLOW_VALUE,) * len(labelnames)] = float(len(folded))
+                guard.overflowed(name, len(folded))
+                limited[name] = kept
+            guard.resize(name, len(limited[name]))
+            if budget is not None:
+                budget -= len(limited[name])
+        return limited
+
+    gauges.limit = limit
+
+
+def _cap_updates(guard, gauges):
+    """Route in-place updates of new label sets past the limit to the overflow series"""
+    missing = object()
+
+    def capped(original):
+        def change(name, labelvalues, value):
+            labelnames = gauges.families[name][1]
+            key = tuple(str(label) for label in labelvalues)
+            if labelnames and gauges.value(name, *key, default=missing) is missing:
+                with guard.lock:
+                    admitted = guard.admit(name, gauges.series_count(name))
+                if not admitted:
+                    guard.overflowed(name)
+                    key = (OVERFLOW_VALUE,) * len(labelnames)
+            try:
+                return original(name, key, value)
+            finally:
+                guard.resize(name, gauges.series_count(name))
+
+        change.__doc__ = original.__doc__
+        return change
+
+    gauges.update = capped(gauges.update)
+    gauges.increment = capped(gauges.increment)
+    discard = gauges.discard
+
+    def remove(name, labelvalues):
+        try:
+            return discard(name, labelvalues)
+        finally:
+            guard.resize(name, gauges.series_count(name))
+
+    remove.__doc__ = discard.__doc__
+    gauges.discard = remove
+
+
+def _metric_name(metric):
+    return getattr(metric, '_name', None) or getattr(metric, 'name', None)
+
+
+def limit_module(module_name, module):
+    """Apply the cardinality limits to the collectors of a metric module; returns its Guard"""
+    guard = Guard(module_name, getattr(module, 'CARDINALITY_LIMITS', None))
+    for collector in module_collectors(module):
+        if isinstance(collector, AtomicGauges):
+            _cap_gauges(guard, collector)
+        elif isinstance(collector, CompactGauges):
+            _cap_gauges(guard, collector)
+            _cap_updates(guard, collector)
+        elif isinstance(collector, MetricWrapperBase) and collector._labelnames:
+            children = lambda collector=collector: collector._metrics
+            name = _metric_name(collector)
+            guard.resize(name, len(children()))
+            _cap_labels(guard, collector, name, collector._labelnames, children)
+        elif isinstance(collector, _Metric) and collector.labelnames:
+            children = lambda collector=collector: collector._children
+            guard.resize(collector.name, len(children()))
+            _cap_labels(guard, collector, collector.name, collector.labelnames, children)
+    return guard
@@ -0,0 +1,46 @@
+import inspect
+
+from prometheus_client import REGISTRY
+
+
+def is_collector(value):
+    """Return True if value is a Prometheus collector instance"""
+    return (
+        not inspect.isclass(value)
+        and not inspect.ismodule(value)
+        and callable(getattr(value, 'collect', None))
+    )
+
+
+def module_collectors(module):
+    """Return the Prometheus collectors defined at the top level of a module
+
+    A module can define a `collectors()` function to list its collectors
+    explicitly instead.
+    """
+    explicit = getattr(module, 'collectors', None)
+    if callable(explicit):
+        return list(explicit())
+    collectors = []
+    seen = set()
+    for value in vars(module).values():
+        if is_collector(value) and id(value) not in seen:
+            seen.add(id(value))
+            collectors.append(value)
+    return collectors
+
+
+def collector_names(collector):
+    """Return the metric family names exposed by a collector"""
+    describe = getattr(collector, 'describe', None)
+    families = describe() if describe else collector.collect()
+    return [family.name for family in families]
+
+
+def unregister_collectors(module, registry=REGISTRY):
+    """Unregister a module's collectors, skipping any that aren't registered"""
+    for collector in module_collectors(module):
+        try:
+            registry.unregister(collector)
+        except KeyError:
+            pass
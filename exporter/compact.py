@@ -0,0 +1,384 @@
+import sys
+import threading
+import time
+from array import array
+
+from prometheus_client import REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.samples import Sample
+
+from .atomic import Generation
+
+# Compact storage for high-cardinality gauge families. A prometheus_client
+# Gauge child is a Python object with its own lock and value wrapper, a few
+# hundred bytes per series; here each distinct label tuple is stored once,
+# in an intern table shared by all families with the same label names, and
+# every family is a column of doubles indexed by the table. Label values
+# are interned, so a VM uuid used by several families is held once.
+#
+#     vm_metrics = CompactGauges({
+#         'zstack_vm_cpuNum': ('Number of vCPUs of the VM', ['uuid', 'name']),
+#         'zstack_vm_memorySize': ('Memory size of the VM (bytes)', ['uuid', 'name']),
+#     })
+#     vm_metrics.publish({'zstack_vm_cpuNum': {('vm-1', 'web'): 4}, ...})
+#
+# CompactGauges has the publish()/current()/value()/restore() interface
+# of AtomicGauges and can replace it in a module as is; CompactGauge is a
+# single family with the labels().set() interface of a Gauge. Samples are
+# rendered from the columns while the scrape is written, never held as a
+# list.
+#
+# publish() swaps in new tables, so a generation it returns never changes.
+# update(), increment() and discard() write to the latest tables in place:
+# each write starts a new generation number, but the values of a
+# generation read before it show the write too. Readers that need a
+# stable view copy the values they read, as recording rules do.
+
+
+class _Table:
+    """Label tuples of the families sharing some label names, and one value column per family"""
+
+    __slots__ = ('index', 'keys', 'free', 'columns', 'present', 'counts')
+
+    def __init__(self, names, keys=None, index=None):
+        # row -> label values tuple, None for free rows
+        self.keys = keys if keys is not None else []
+        # label values tuple -> row
+        self.index = index if index is not None else {}
+        self.free = []
+        # Columns are allocated in one go for the given rows
+        self.columns = {name: array('d', bytes(8 * len(self.keys))) for name in names}
+        # Whether a family has a value in a row, one byte per row
+        self.present = {name: bytearray(len(self.keys)) for name in names}
+        # Number of rows present per family
+        self.counts = dict.fromkeys(names, 0)
+
+    def row(self, key):
+        """Return the row of a label tuple, adding it if needed"""
+        row = self.index.get(key)
+        if row is not None:
+            return row
+        interned = tuple(sys.intern(value) for value in key)
+        # A tuple of already interned strings is kept as given, callers may hold it too
+        if all(value is original for value, original in zip(interned, key)):
+            interned = key
+        return self.add(interned)
+
+    def add(self, key):
+        """Add a new label tuple of interned strings; returns its row"""
+        if self.free:
+            row = self.free.pop()
+            self.keys[row] = key
+        else:
+            row = len(self.keys)
+            self.keys.append(key)
+            for column in self.columns.values():
+                column.append(0.0)
+            for present in self.present.values():
+                present.append(0)
+        self.index[key] = row
+        return row
+
+    def release(self, row):
+        """Free a row once no family has a value in it"""
+        if not any(present[row] for present in self.present.values()):
+            del self.index[self.keys[row]]
+            self.keys[row] = None
+            self.free.append(row)
+
+    def count(self, name):
+        return self.counts[name]
+
+
+def _key(labelvalues):
+    """The label values tuple of a series, as stored"""
+    if type(labelvalues) is tuple and all(type(label) is str for label in labelvalues):
+        return labelvalues
+    return tuple(str(label) for label in labelvalues)
+
+
+class _Samples:
+    """The samples of one family, produced from its column while being iterated"""
+
+    __slots__ = ('name', 'labelnames', 'table')
+
+    def __init__(self, name, labelnames, table):
+        self.name = name
+        self.labelnames = labelnames
+        self.table = table
+
+    def __iter__(self):
+        name = self.name
+        labelnames = self.labelnames
+        keys = self.table.keys
+        column = self.table.columns[name]
+        present = self.table.present[name]
+        # Rows added meanwhile are left for the next scrape
+        for row in range(len(present)):
+            if present[row]:
+                key = keys[row]
+                if key is not None:
+                    yield Sample(name, dict(zip(labelnames, key)), column[row], None)
+
+    def __len__(self):
+        return self.table.count(self.name)
+
+
+class _View:
+    """Read access to a CompactGauges state shaped like an AtomicGauges generation"""
+
+    def __init__(self, gauges, state):
+        self.gauges = gauges
+        self.state = state
+
+    def get(self, name, default=None):
+        if name not in self.gauges.families:
+            return default
+        return self[name]
+
+    def __getitem__(self, name):
+        table = self.state[self.gauges.families[name][1]]
+        column = table.columns[name]
+        present = table.present[name]
+        # In-place writes may add rows meanwhile
+        with self.gauges._lock:
+            return {key: column[row] for key, row in table.index.items() if present[row]}
+
+    def __contains__(self, name):
+        return name in self.gauges.families
+
+    def __iter__(self):
+        return iter(self.gauges.families)
+
+    def items(self):
+        return ((name, self[name]) for name in self.gauges.families)
+
+
+class CompactGauges:
+    """A group of gauge families stored in intern tables and typed arrays
+
+    publish() replaces every family at once, as AtomicGauges does;
+    update(), increment() and discard() change single series in place,
+    each in a new generation.
+    """
+
+    def __init__(self, families, registry=REGISTRY):
+        # {name: (documentation, label names)}
+        self.families = {name: (documentation, tuple(labelnames)) for name, (documentation, labelnames) in families.items()}
+        # {label names: names of the families sharing one table}
+        self._groups = {}
+        for name, (_, labelnames) in self.families.items():
+            self._groups.setdefault(labelnames, []).append(name)
+        self._generation = 0
+        self._published = 0.0
+        self._state = self._empty()
+        # Like prometheus_client gauges, unlabelled families start at 0
+        for name, (_, labelnames) in self.families.items():
+            if not labelnames:
+                self._write(self._state, name, (), 0.0)
+        # Reentrant, as limit() reads the current values while publish() holds it
+        self._lock = threading.RLock()
+        # Optional limit(previous values, new values) -> values applied on publish, see exporter/cardinality.py
+        self.limit = None
+        if registry is not None:
+            registry.register(self)
+
+    def _empty(self):
+        """{label names: _Table} with a column for every family"""
+        return {labelnames: _Table(names) for labelnames, names in self._groups.items()}
+
+    def _changed(self):
+        self._generation += 1
+        self._published = time.time()
+
+    def _write(self, state, name, key, value):
+        table = state[self.families[name][1]]
+        row = table.row(key)
+        table.columns[name][row] = value
+        if not table.present[name][row]:
+            table.present[name][row] = 1
+            table.counts[name] += 1
+
+    def publish(self, values):
+        """Atomically replace every family with the given samples
+
+        `values` maps family names to either a number (unlabelled families)
+        or a {label values tuple: number} dict. Families that are left out
+        are published empty.
+        """
+        values = {
+            name: (samples if isinstance(samples, dict) else {(): samples})
+            for name, samples in ((name, values.get(name, {})) for name in self.families)
+        }
+        with self._lock:
+            if self.limit is not None:
+                values = self.limit(self.current().values, values)
+            state = {}
+            for labelnames, names in self._groups.items():
+                # First pass: the rows of the new table, reusing the label
+                # tuples of the previous state rather than interning them again
+                previous = self._state[labelnames]
+                index = {}
+                keys = []
+                for name in names:
+                    for key in values[name]:
+                        if key in index:
+                            continue
+                        known = previous.index.get(key)
+                        if known is not None:
+                            key = previous.keys[known]
+                        else:
+                            key = tuple(sys.intern(str(label)) for label in key)
+                        if key not in index:
+                            index[key] = len(keys)
+                            keys.append(key)
+                table = state[labelnames] = _Table(names, keys, index)
+                # Second pass: the values
+                for name in names:
+                    column = table.columns[name]
+                    present = table.present[name]
+                    for key, value in values[name].items():
+                        row = index.get(key)
+                        if row is None:
+                            row = index[tuple(str(label) for label in key)]
+                        column[row] = float(value)
+                        present[row] = 1
+                    table.counts[name] = present.count(1)
+            self._state = state
+            self._changed()
+        return self.current()
+
+    def update(self, name, labelvalues, value):
+        """Set one series in place"""
+        with self._lock:
+            self._write(self._state, name, _key(labelvalues), float(value))
+            self._changed()
+
+    def increment(self, name, labelvalues, amount=1):
+        """Add to one series in place"""
+        key = _key(labelvalues)
+        with self._lock:
+            self._write(self._state, name, key, self.value(name, *key) + amount)
+            self._changed()
+
+    def discard(self, name, labelvalues):
+        """Remove one series in place"""
+        with self._lock:
+            table = self._state[self.families[name][1]]
+            row = table.index.get(_key(labelvalues))
+            if row is not None and table.present[name][row]:
+                table.present[name][row] = 0
+                table.counts[name] -= 1
+                table.release(row)
+                self._changed()
+
+    def current(self):
+        """Return the latest state, with `values` readable like an AtomicGauges generation"""
+        return Generation(self._generation, _View(self, self._state), self._published)
+
+    def value(self, name, *labelvalues, default=0.0):
+        """Return one sample of the latest state"""
+        table = self._state[self.families[name][1]]
+        row = table.index.get(_key(labelvalues))
+        if row is None or not table.present[name][row]:
+            return default
+        return table.columns[name][row]
+
+    def keys(self, name):
+        """Return the label values tuples of a family's series"""
+        table = self._state[self.families[name][1]]
+        present = table.present[name]
+        with self._lock:
+            return [key for key, row in table.index.items() if present[row]]
+
+    def series_count(self, name):
+        return self._state[self.families[name][1]].count(name)
+
+    def restore(self, samples):
+        """Publish samples restored from a snapshot, given as (name, labels dict, value)"""
+        values = {name: {} for name in self.families}
+        for name, labels, value in samples:
+            if name not in self.families:
+                continue
+            _, labelnames = self.families[name]
+            values[name][tuple(labels.get(label, '') for label in labelnames)] = value
+        self.publish(values)
+
+    def describe(self):
+        for name, (documentation, labelnames) in self.families.items():
+            yield GaugeMetricFamily(name, documentation, labels=labelnames)
+
+    def collect(self):
+        state = self._state
+        for name, (documentation, labelnames) in self.families.items():
+            family = GaugeMetricFamily(name, documentation, labels=labelnames)
+            family.samples = _Samples(name, labelnames, state[labelnames])
+            yield family
+
+    def unregister(self, registry=REGISTRY):
+        try:
+            registry.unregister(self)
+        except KeyError:
+            pass
+
+
+class _Child:
+    __slots__ = ('gauge', 'key')
+
+    def __init__(self, gauge, key):
+        self.gauge = gauge
+        self.key = key
+
+    def set(self, value):
+        self.gauge.update(self.gauge.name, self.key, value)
+
+    def inc(self, amount=1):
+        self.gauge.increment(self.gauge.name, self.key, amount)
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def get(self):
+        return self.gauge.value(self.gauge.name, *self.key)
+
+
+class CompactGauge(CompactGauges):
+    """One compact gauge family with the labels().set() interface of a Gauge
+
+    labels() returns a lightweight handle, nothing is kept per series
+    besides its label tuple and value.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.labelnames = tuple(labelnames)
+        super().__init__({name: (documentation, self.labelnames)}, registry)
+
+    def labels(self, *labelvalues, **labelkwargs):
+        if labelkwargs:
+            if labelvalues:
+                raise ValueError("Can't pass both positional and keyword label values")
+            labelvalues = tuple(labelkwargs[name] for name in self.labelnames)
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes label values for {self.labelnames}")
+        return _Child(self, tuple(str(value) for value in labelvalues))
+
+    def remove(self, *labelvalues):
+        self.discard(self.name, labelvalues)
+
+    def clear(self):
+        self.publish({})
+
+    def _unlabelled(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} has labels, use labels() first")
+        return _Child(self, ())
+
+    def set(self, value):
+        self._unlabelled().set(value)
+
+    def inc(self, amount=1):
+        self._unlabelled().inc(amount)
+
+    def dec(self, amount=1):
+        self._unlabelled().dec(amount)
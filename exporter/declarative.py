@@ -0,0 +1,232 @@
+import json
+import os
+
+from prometheus_client import REGISTRY
+
+from . import upstream
+from .atomic import AtomicGauges
+
+try:
+    import yaml
+except ImportError:  # PyYAML is optional, JSON specs work without it
+    yaml = None
+
+# File suffixes in the metrics directory that are loaded as declarative collectors
+SPEC_SUFFIXES = ('.json', '.yaml', '.yml')
+
+_MISSING = object()
+
+
+def load_spec(path):
+    """Read a declarative collector spec from a JSON or YAML file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.json'):
+            spec = json.load(f)
+        elif yaml is None:
+            raise ValueError(f"PyYAML is required to load {path}")
+        else:
+            spec = yaml.safe_load(f)
+    if not isinstance(spec, dict):
+        raise ValueError(f"Collector spec {path} must be a mapping")
+    return _expand_env(spec)
+
+
+def _expand_env(value):
+    """Expand ${VAR} references in every string of a spec"""
+    if isinstance(value, str):
+        return os.path.expandvars(value)
+    if isinstance(value, list):
+        return [_expand_env(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _expand_env(item) for key, item in value.items()}
+    return value
+
+
+def compile_path(path):
+    """Compile a dotted field path such as `data.hosts.0.uuid` into a key tuple"""
+    if path in (None, '', '.'):
+        return ()
+    return tuple(int(part) if part.isdigit() else part for part in str(path).split('.'))
+
+
+def extract(data, keys):
+    """Follow a compiled path through nested dicts and lists"""
+    for key in keys:
+        try:
+            data = data[key]
+        except (KeyError, IndexError, TypeError):
+            return _MISSING
+    return data
+
+
+def to_float(value):
+    """Convert a JSON value to a sample value, or None if it isn't numeric"""
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _label_value(item, path):
+    label = extract(item, path)
+    return '' if label is _MISSING or label is None else str(label)
+
+
+class DeclarativeCollector:
+    """A metric module compiled from a declarative HTTP/JSON spec
+
+    It exposes the same interface as a Python module in the metrics
+    directory (`REFRESH_INTERVAL` and `process()`), so the server can
+    schedule it the same way. Without an `interval` it has no
+    REFRESH_INTERVAL and runs every METRICS_REFRESH_INTERVAL seconds.
+    """
+
+    def __init__(self, name, spec, registry=REGISTRY):
+        self.name = name
+        if spec.get('interval') is not None:
+            self.REFRESH_INTERVAL = int(spec['interval'])
+        self.endpoint = spec['endpoint']
+        self.params = spec.get('params') or {}
+        self.headers = dict(spec.get('headers') or {})
+        self.timeout = float(spec.get('timeout', 10))
+        self.cache_ttl = spec.get('cache_ttl')
+        self.success_path = compile_path(spec['success']) if spec.get('success') else None
+        self.auth = self._compile_auth(spec.get('auth'))
+        self.registry = registry
+        families = {}
+
+        # Extraction plan: one group per `items` path, so each list is walked once
+        # {items path: [(family name, value path, label paths, const labels, default)]}
+        self.plan = {}
+        for metric in spec.get('metrics', []):
+            label_paths = {label: compile_path(path) for label, path in (metric.get('labels') or {}).items()}
+            const_labels = dict(metric.get('const_labels') or {})
+            label_names = list(label_paths) + list(const_labels)
+            family = families.setdefault(metric['name'], (metric.get('help', metric['name']), label_names))
+            if family[1] != label_names:
+                raise ValueError(f"Metric {metric['name']} in {name} is mapped with different labels")
+            items_path = compile_path(metric.get('items')) if metric.get('items') is not None else None
+            self.plan.setdefault(items_path, []).append((
+                metric['name'],
+                compile_path(metric.get('path')),
+                tuple(label_paths.values()),
+                tuple(const_labels.values()),
+                metric.get('default'),
+            ))
+
+        # Streaming specs parse one large `items` array incrementally instead of loading the body
+        self.stream = bool(spec.get('stream'))
+        if self.stream:
+            if len(self.plan) != 1 or None in self.plan:
+                raise ValueError(f"Streaming collector {name} needs exactly one `items` path shared by all metrics")
+            if self.success_path is not None:
+                raise ValueError(f"Streaming collector {name} does not support `success`")
+
+        # All mapped series are published together, so a run replaces the previous one atomically
+        self.metrics = AtomicGauges(families, registry=registry)
+
+    def _compile_auth(self, auth):
+        if not auth:
+            return None
+        auth_type = auth.get('type', 'basic')
+        if auth_type == 'basic':
+            return auth['username'], auth['password']
+        if auth_type == 'bearer':
+            self.headers['Authorization'] = f"Bearer {auth['token']}"
+            return None
+        raise ValueError(f"Unsupported auth type in {self.name}: {auth_type}")
+
+    def fetch(self):
+        """Fetch the endpoint once, through the shared upstream cache, and return the decoded JSON"""
+        response = upstream.get(
+            self.endpoint,
+            params=self.params,
+            headers=self.headers,
+            auth=self.auth,
+            timeout=self.timeout,
+            ttl=self.cache_ttl,
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"{self.endpoint} returned HTTP {response.status_code}")
+        return response.json()
+
+    @staticmethod
+    def _item_samples(item, mappings):
+        """Yield (family name, label values, value) for one element of an `items` list"""
+        for family, value_path, label_paths, const_labels, default in mappings:
+            raw = extract(item, value_path)
+            value = default if raw is _MISSING or raw is None else to_float(raw)
+            if value is None:
+                continue
+            label_values = tuple(_label_value(item, path) for path in label_paths) + const_labels
+            yield family, label_values, value
+
+    def extract_samples(self, data):
+        """Run the extraction plan, returning [(family name, label values, value)]"""
+        samples = []
+        for items_path, mappings in self.plan.items():
+            if items_path is None:
+                items = (data,)
+            else:
+                items = extract(data, items_path)
+                if items is _MISSING or items is None:
+                    continue
+                if isinstance(items, dict):
+                    items = items.values()
+            for item in items:
+                samples.extend(self._item_samples(item, mappings))
+        return samples
+
+    def stream_samples(self):
+        """Yield samples while the `items` array is still downloading"""
+        (items_path, mappings), = self.plan.items()
+        items = upstream.stream_items(
+            self.endpoint,
+            items_path,
+            params=self.params,
+            headers=self.headers,
+            auth=self.auth,
+            timeout=self.timeout,
+        )
+        for item in items:
+            yield from self._item_samples(item, mappings)
+
+    def write(self, samples):
+        """Publish every sample as a new generation, dropping series that are no longer reported"""
+        values = {}
+        count = 0
+        for family, label_values, value in samples:
+            values.setdefault(family, {})[label_values] = value
+            count += 1
+        self.metrics.publish(values)
+        return count
+
+    def process(self):
+        """Fetch the endpoint and write every mapped series in one batch"""
+        print(f"Declarative collector {self.name} processing...")
+        if self.stream:
+            count = self.write(self.stream_samples())
+        else:
+            data = self.fetch()
+            if self.success_path is not None:
+                # A missing success field counts as a failure, like a false one
+                success = extract(data, self.success_path)
+                if success is _MISSING or not success:
+                    raise RuntimeError(f"{self.endpoint} reported failure")
+            count = self.write(self.extract_samples(data))
+        print(f"Declarative collector {self.name} updated {count} series")
+
+    def collectors(self):
+        """Return the metrics owned by this collector"""
+        return [self.metrics]
+
+    def close(self):
+        """Unregister the collector's metrics when its spec file is removed"""
+        self.metrics.unregister(self.registry)
+
+
+def load_collector(name, path):
+    """Load and compile the declarative collector spec at `path`"""
+    return DeclarativeCollector(name, load_spec(path))
@@ -0,0 +1,355 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from prometheus_client import GC_COLLECTOR, PLATFORM_COLLECTOR, PROCESS_COLLECTOR, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.metrics_core import Metric
+from prometheus_client.samples import Sample
+
+from . import upstream
+from .collectors import collector_names, module_collectors
+from .declarative import load_spec
+
+# Federation: this exporter as an aggregation tier in front of many small
+# exporters. Every downstream /metrics endpoint listed in the targets file
+# is scraped in the background over the shared upstream connection pool,
+# parsed line by line while it downloads, labelled with its `instance` and
+# merged into this exporter's own /metrics.
+#
+#     {"targets": [{"instance": "edge-1", "url": "http://edge-1:8000/metrics"},
+#                  {"instance": "edge-2", "url": "http://edge-2:8000/metrics", "timeout": 2}]}
+#
+# Each target's last good scrape is cached and served until it is older
+# than FEDERATION_STALENESS seconds. A downstream sample that already has
+# an `instance` label keeps it as `exported_instance`, as in Prometheus.
+# Families named like one of this exporter's own are dropped, since two
+# families of the same name would make the whole scrape invalid.
+
+# JSON or YAML file listing the downstream exporters (empty disables federation)
+FEDERATION_TARGETS_PATH = os.environ.get('FEDERATION_TARGETS_PATH', '')
+# Seconds between two scrapes of every target
+FEDERATION_INTERVAL = float(os.environ.get('FEDERATION_INTERVAL', 15))
+# Seconds a scrape of a target without its own timeout may take, download included
+FEDERATION_TIMEOUT = float(os.environ.get('FEDERATION_TIMEOUT', 5))
+# Seconds after its last successful scrape a target's samples are dropped
+FEDERATION_STALENESS = float(os.environ.get('FEDERATION_STALENESS', 300))
+# Targets scraped at the same time
+FEDERATION_CONCURRENCY = int(os.environ.get('FEDERATION_CONCURRENCY', 16))
+
+# Module name of the federated samples in filtered scrapes (/metrics?module[]=federation)
+FEDERATION_MODULE = 'federation'
+
+_TYPES = {'counter', 'gauge', 'histogram', 'summary', 'untyped', 'unknown', 'info', 'stateset', 'gaugehistogram'}
+# Sample name suffixes belonging to a family of each type
+_SUFFIXES = {
+    'counter': ('_total', '_created'),
+    'histogram': ('_bucket', '_count', '_sum', '_created'),
+    'gaugehistogram': ('_bucket', '_gcount', '_gsum'),
+    'summary': ('', '_count', '_sum', '_created'),
+}
+_ESCAPES = {'\\': '\\', '"': '"', 'n': '\n'}
+# Sample names a local family of each name may expose
+_LOCAL_SUFFIXES = ('', '_total', '_created', '_bucket', '_count', '_sum', '_info')
+
+
+class ParseError(ValueError):
+    pass
+
+
+def _unescape(text):
+    if '\\' not in text:
+        return text
+    return text.replace('\\\\', '\0').replace('\\n', '\n').replace('\0', '\\')
+
+
+def _parse_labels(line, start):
+    """Parse the `{...}` label set at `start`; returns (labels, index after the closing brace)"""
+    labels = {}
+    i = start + 1
+    while True:
+        while line[i] in ' ,':
+            i += 1
+        if line[i] == '}':
+            return labels, i + 1
+        equals = line.index('=', i)
+        name = line[i:equals].strip()
+        i = line.index('"', equals) + 1
+        end = line.index('"', i)
+        if '\\' not in line[i:end]:
+            labels[name] = line[i:end]
+            i = end + 1
+            continue
+        # Escaped value, read it character by character
+        value = []
+        while line[i] != '"':
+            if line[i] == '\\':
+                i += 1
+                value.append(_ESCAPES.get(line[i], '\\' + line[i]))
+            else:
+                value.append(line[i])
+            i += 1
+        labels[name] = ''.join(value)
+        i += 1
+
+
+def parse_sample(line, extra_labels=None):
+    """Parse one text exposition sample line into a Sample, adding `extra_labels`"""
+    brace = line.find('{')
+    space = line.find(' ')
+    if brace != -1 and (space == -1 or brace < space):
+        name = line[:brace]
+        labels, end = _parse_labels(line, brace)
+        rest = line[end:].split()
+    elif space == -1:
+        raise ParseError(f"No value in {line!r}")
+    else:
+        name = line[:space]
+        labels = {}
+        rest = line[space:].split()
+    if not rest:
+        raise ParseError(f"No value in {line!r}")
+    if extra_labels:
+        for label, value in extra_labels.items():
+            if label in labels:
+                labels['exported_' + label] = labels[label]
+            labels[label] = value
+    timestamp = float(rest[1]) / 1000 if len(rest) > 1 else None
+    return Sample(name, labels, float(rest[0]), timestamp)
+
+
+def _belongs(sample_name, family, family_type):
+    if sample_name == family:
+        return family_type not in ('counter', 'histogram', 'gaugehistogram')
+    suffixes = _SUFFIXES.get(family_type, ())
+    return sample_name.startswith(family) and sample_name[len(family):] in suffixes
+
+
+def parse_families(lines, extra_labels=None):
+    """Parse text exposition lines into {family name: Metric}
+
+    Lines are consumed one at a time, so a response can be parsed while it
+    downloads. Samples outside a declared family form untyped families.
+    """
+    families = {}
+    helps = {}
+    current = None
+    for line in lines:
+        if not line:
+            continue
+        if line[0] == '#':
+            parts = line.split(None, 3)
+            if len(parts) < 3:
+                continue
+            if parts[1] == 'HELP':
+                helps[parts[2]] = _unescape(parts[3]) if len(parts) > 3 else ''
+            elif parts[1] == 'TYPE':
+                name, family_type = parts[2], parts[3].strip() if len(parts) > 3 else 'untyped'
+                if family_type not in _TYPES:
+                    raise ParseError(f"Unknown type {family_type} for {name}")
+                documentation = helps.get(name, '')
+                if family_type == 'counter' and name.endswith('_total'):
+                    name = name[:-len('_total')]
+                if family_type == 'untyped':
+                    family_type = 'unknown'
+                current = families.get(name)
+                if current is None:
+                    current = families[name] = Metric(name, documentation, family_type)
+            continue
+        sample = parse_sample(line, extra_labels)
+        if current is None or not _belongs(sample.name, current.name, current.type):
+            current = families.get(sample.name)
+            if current is None:
+                current = families[sample.name] = Metric(sample.name, helps.get(sample.name, ''), 'unknown')
+        current.samples.append(sample)
+    return families
+
+
+class Target:
+    """One downstream exporter"""
+
+    def __init__(self, instance, url, timeout=None):
+        if not instance or not url:
+            raise ValueError("A federation target needs an instance and a url")
+        self.instance = instance
+        self.url = url
+        self.timeout = float(timeout) if timeout else FEDERATION_TIMEOUT
+        # Latest successfully parsed families, kept until they go stale
+        self.families = {}
+        self.last_success = 0.0
+        self.up = False
+        self.duration = 0.0
+        self.samples = 0
+
+
+def load_targets(path):
+    """Read the targets of a JSON or YAML targets file"""
+    spec = load_spec(path)
+    targets = {}
+    for index, item in enumerate(spec.get('targets', [])):
+        try:
+            target = Target(item['instance'], item['url'], item.get('timeout'))
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Target {index} in {path} needs an instance and a url ({e})")
+        if target.instance in targets:
+            raise ValueError(f"Duplicate instance {target.instance} in {path}")
+        targets[target.instance] = target
+    return targets
+
+
+def _lines(response, deadline):
+    """Decoded lines of a streamed response, giving up at the deadline"""
+    for line in response.iter_lines(chunk_size=upstream.UPSTREAM_STREAM_CHUNK_SIZE):
+        if time.monotonic() > deadline:
+            raise TimeoutError("Scrape took longer than its timeout")
+        yield line.decode('utf-8')
+
+
+class Federation:
+    """Scrapes the targets in the background and collects their merged samples"""
+
+    def __init__(self, targets, concurrency=FEDERATION_CONCURRENCY, registry=REGISTRY, modules=None):
+        self.targets = targets
+        self.registry = registry
+        # Returns {module name: collectors} of the loaded metric modules, whose names take precedence
+        self.modules = modules or dict
+        self.running = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix='federation')
+        # Merged families of the fresh targets and when one of them goes stale, rebuilt on change
+        self.merged = []
+        self.merged_expires = 0.0
+        self.changed = True
+
+    def scrape(self, target):
+        start = time.monotonic()
+        try:
+            headers = {'Accept': 'text/plain;version=0.0.4', 'Accept-Encoding': 'gzip'}
+            with upstream.session.get(target.url, headers=headers, timeout=target.timeout, stream=True) as response:
+                if response.status_code != 200:
+                    raise RuntimeError(f"HTTP {response.status_code}")
+                families = parse_families(_lines(response, start + target.timeout), {'instance': target.instance})
+            target.families = families
+            target.samples = sum(len(family.samples) for family in families.values())
+            target.last_success = time.time()
+            target.up = True
+        except Exception as e:
+            print(f"Error scraping federation target {target.instance}: {e}")
+            target.up = False
+        target.duration = time.monotonic() - start
+        with self.lock:
+            self.running.discard(target.instance)
+            self.changed = True
+
+    def run(self):
+        while not self.stopping.is_set():
+            for target in self.targets.values():
+                with self.lock:
+                    if target.instance in self.running:
+                        continue
+                    self.running.add(target.instance)
+                self.executor.submit(self.scrape, target)
+            self.stopping.wait(FEDERATION_INTERVAL)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='federation-scheduler')
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.executor.shutdown(wait=False)
+
+    def _local_names(self):
+        """Sample names this exporter exposes itself, from its own metrics and the metric modules"""
+        collectors = own_collectors()
+        for module in self.modules().values():
+            collectors.extend(module)
+        names = set()
+        for collector in collectors:
+            if collector is self:
+                continue
+            for name in collector_names(collector):
+                names.update(name + suffix for suffix in _LOCAL_SUFFIXES)
+        return names
+
+    def _merge(self, now):
+        merged = {}
+        expires = float('inf')
+        local = self._local_names()
+        for target in self.targets.values():
+            if not target.families or now - target.last_success > FEDERATION_STALENESS:
+                continue
+            expires = min(expires, target.last_success + FEDERATION_STALENESS)
+            for name, family in target.families.items():
+                if name in local or name + '_total' in local:
+                    continue
+                combined = merged.get(name)
+                if combined is None:
+                    combined = merged[name] = Metric(name, family.documentation, family.type)
+                elif combined.type != family.type:
+                    continue  # Conflicting types, the first target's family wins
+                combined.samples.extend(family.samples)
+        return list(merged.values()), expires
+
+    def families(self):
+        """The merged families of all fresh targets"""
+        now = time.time()
+        with self.lock:
+            if self.changed or now > self.merged_expires:
+                self.changed = False
+                self.merged, self.merged_expires = self._merge(now)
+            return self.merged
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        yield from self.families()
+        up = GaugeMetricFamily('exporter_federation_up', 'Whether the last scrape of a federation target succeeded', labels=['instance'])
+        duration = GaugeMetricFamily('exporter_federation_scrape_duration_seconds', 'Duration of the last scrape of a federation target', labels=['instance'])
+        samples = GaugeMetricFamily('exporter_federation_samples', 'Samples of a federation target in its last successful scrape', labels=['instance'])
+        last_success = GaugeMetricFamily('exporter_federation_last_success_timestamp_seconds', 'Time of the last successful scrape of a federation target', labels=['instance'])
+        for target in self.targets.values():
+            up.add_metric([target.instance], 1 if target.up else 0)
+            duration.add_metric([target.instance], target.duration)
+            samples.add_metric([target.instance], target.samples)
+            last_success.add_metric([target.instance], target.last_success)
+        yield up
+        yield duration
+        yield samples
+        yield last_success
+
+
+def own_collectors():
+    """The collectors of the exporter's own metrics and prometheus_client's default ones"""
+    collectors = [PROCESS_COLLECTOR, PLATFORM_COLLECTOR, GC_COLLECTOR]
+    for name, module in list(sys.modules.items()):
+        if name.startswith(__package__ + '.') and module is not None:
+            collectors.extend(module_collectors(module))
+    return collectors
+
+
+# The running federation, None unless FEDERATION_TARGETS_PATH lists targets
+federation = None
+
+
+def start_federation(path=FEDERATION_TARGETS_PATH, registry=REGISTRY, modules=None):
+    """Start scraping the targets of the targets file and serve them from the registry
+
+    `modules` returns {module name: collectors} of the loaded metric modules.
+    """
+    global federation
+    if not path:
+        return None
+    targets = load_targets(path)
+    if not targets:
+        return None
+    federation = Federation(targets, registry=registry, modules=modules)
+    registry.register(federation)
+    federation.start()
+    print(f"Federating {len(targets)} downstream exporters with up to {FEDERATION_CONCURRENCY} concurrent scrapes")
+    return federation
@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+import time
+
+from prometheus_client import Gauge
+from starlette.routing import Match
+
+from . import mcp_index
+from .accumulators import ShardedHistogram
+
+# Request instrumentation for the exporter's own HTTP endpoints. Every
+# request is timed from its first byte in to its last byte out, per route
+# template (/metrics, /mcp, /debug/profile/{module_name}, ...), method and
+# status code; /mcp requests are also timed per JSON-RPC method and tool,
+# prompt or resource name. Histograms are sharded accumulators, so a
+# request costs a few dict lookups and no lock beyond the in-flight gauge.
+#
+# Label values coming from clients are bounded: unknown paths count as
+# OTHER, names of registered MCP components are kept, and past
+# HTTP_METRICS_LABEL_LIMIT distinct values per label any other HTTP
+# method, MCP method or name is reported as OTHER.
+
+HTTP_METRICS = os.environ.get('HTTP_METRICS', 'true').lower() in ('1', 'true', 'yes')
+# Distinct values kept per client-controlled label
+HTTP_METRICS_LABEL_LIMIT = int(os.environ.get('HTTP_METRICS_LABEL_LIMIT', 100))
+# Largest /mcp request body parsed for its method and name, in bytes
+HTTP_METRICS_MCP_BODY_LIMIT = int(os.environ.get('HTTP_METRICS_MCP_BODY_LIMIT', 65536))
+
+# Label value of everything past a label's limit
+OTHER = 'other'
+# Route of the MCP server, whose requests are also labelled by JSON-RPC method
+MCP_ROUTE = '/mcp'
+
+DURATION_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+http_inflight = Gauge('exporter_http_requests_inflight', 'HTTP requests being handled', ['route'])
+http_duration = ShardedHistogram('exporter_http_request_duration_seconds', 'Time to handle HTTP requests, until the last byte is sent', ['route', 'method', 'code'], buckets=DURATION_BUCKETS)
+http_response_size = ShardedHistogram('exporter_http_response_size_bytes', 'Size of HTTP response bodies', ['route', 'method', 'code'], buckets=SIZE_BUCKETS)
+mcp_inflight = Gauge('exporter_http_mcp_requests_inflight', 'MCP requests being handled', ['mcp_method'])
+mcp_duration = ShardedHistogram('exporter_http_mcp_request_duration_seconds', 'Time to handle MCP requests', ['mcp_method', 'name', 'code'], buckets=DURATION_BUCKETS)
+mcp_response_size = ShardedHistogram('exporter_http_mcp_response_size_bytes', 'Size of MCP response bodies', ['mcp_method', 'name'], buckets=SIZE_BUCKETS)
+
+
+class Bounded:
+    """The values seen for one label, up to a limit; later ones map to OTHER"""
+
+    def __init__(self, limit=HTTP_METRICS_LABEL_LIMIT, known=()):
+        self.limit = limit
+        self.values = set(known)
+        self.lock = threading.Lock()
+
+    def __call__(self, value):
+        if value in self.values:
+            return value
+        with self.lock:
+            if len(self.values) < self.limit:
+                self.values.add(value)
+                return value
+        return OTHER
+
+
+http_methods = Bounded(known=('GET', 'POST', 'PUT', 'DELETE', 'HEAD', 'OPTIONS', 'PATCH'))
+mcp_methods = Bounded()
+mcp_names = Bounded()
+
+
+class Routes:
+    """Maps request paths to the template of the route serving them"""
+
+    def __init__(self, routes, cache_size=1024):
+        # The application's route list, read at request time so routes added later count
+        self.routes = routes
+        self.cache = {}
+        self.cache_size = cache_size
+
+    def __call__(self, scope):
+        path = scope['path']
+        template = self.cache.get(path)
+        if template is None:
+            template = self._match(scope)
+            if template is None and not path.endswith('/'):
+                # Served by a redirect to the same path with a slash
+                template = self._match(dict(scope, path=path + '/'))
+            template = template or OTHER
+            # Paths with parameters may be unbounded, only the first ones are cached
+            if len(self.cache) < self.cache_size:
+                self.cache[path] = template
+        return template
+
+    def _match(self, scope):
+        partial = None
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return self._template(route, scope)
+            if match == Match.PARTIAL and partial is None:
+                partial = self._template(route, scope)
+        return partial
+
+    def _template(self, route, scope):
+        # Included routers have no path of their own, their first path segment stands for them
+        return getattr(route, 'path', None) or '/' + scope['path'].lstrip('/').split('/', 1)[0]
+
+
+def mcp_call(body):
+    """The JSON-RPC method of an MCP request body and the tool, prompt or resource it names"""
+    try:
+        request = json.loads(body)
+    except ValueError:
+        return 'invalid', ''
+    if isinstance(request, list):
+        return 'batch', ''
+    if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+        return 'invalid', ''
+    params = request.get('params')
+    name = ''
+    if isinstance(params, dict):
+        name = params.get('name') or params.get('uri') or ''
+    return request['method'], str(name)
+
+
+class InstrumentationMiddleware:
+    """ASGI middleware recording the exporter_http_* metrics of every HTTP request"""
+
+    def __init__(self, app, routes, server=None):
+        self.app = app
+        self.routes = Routes(routes)
+        # Metric children by label values, all labels being bounded
+        self.inflight = {}
+        self.observers = {}
+        # MCP server whose registered component names are kept as labels
+        self.server = server
+
+    def _mcp_name(self, name):
+        if not name:
+            return ''
+        if self.server is not None:
+            for kind in mcp_index.REGISTRIES:
+                if name in mcp_index.registry(self.server, kind):
+                    return name
+        return mcp_names(name)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not HTTP_METRICS:
+            return await self.app(scope, receive, send)
+        route = self.routes(scope)
+        method = http_methods(scope['method'])
+        code = '500'
+        size = 0
+        call = {}
+
+        if route == MCP_ROUTE and method == 'POST':
+            body = []
+            received = 0
+
+            async def receive_and_parse():
+                nonlocal received
+                message = await receive()
+                if message['type'] == 'http.request' and not call:
+                    chunk = message.get('body', b'')
+                    received += len(chunk)
+                    if received <= HTTP_METRICS_MCP_BODY_LIMIT:
+                        body.append(chunk)
+                    if not message.get('more_body'):
+                        if received <= HTTP_METRICS_MCP_BODY_LIMIT:
+                            mcp_method, name = mcp_call(b''.join(body))
+                        else:
+                            mcp_method, name = 'oversized', ''
+                        call['method'] = mcp_methods(mcp_method)
+                        call['name'] = self._mcp_name(name)
+                        mcp_inflight.labels(call['method']).inc()
+                return message
+        else:
+            receive_and_parse = receive
+
+        async def send_and_measure(message):
+            nonlocal code, size
+            if message['type'] == 'http.response.start':
+                code = str(message['status'])
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        inflight = self.inflight.get(route)
+        if inflight is None:
+            inflight = self.inflight[route] = http_inflight.labels(route)
+        inflight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_and_parse, send_and_measure)
+        finally:
+            duration = time.perf_counter() - start
+            inflight.dec()
+            observers = self.observers.get((route, method, code))
+            if observers is None:
+                observers = self.observers[(route, method, code)] = (
+                    http_duration.labels(route, method, code),
+                    http_response_size.labels(route, method, code),
+                )
+            observers[0].observe(duration)
+            observers[1].observe(size)
+            # Requests rejected before their body was read have no MCP method
+            if call:
+                mcp_inflight.labels(call['method']).dec()
+                mcp_duration.labels(call['method'], call['name'], code).observe(duration)
+                mcp_response_size.labels(call['method'], call['name']).observe(size)
@@ -0,0 +1,202 @@
+import codecs
+import json
+import re
+
+# Incremental JSON reader for large upstream payloads.
+#
+# Only the elements of one array are ever decoded, one at a time, while the
+# rest of the document is scanned and discarded. Peak memory is bounded by
+# the largest single element rather than by the payload size.
+
+_WHITESPACE = ' \t\n\r'
+# Characters that can follow a complete value in valid JSON
+_TERMINATORS = _WHITESPACE + ',:]}'
+_COMPACT_THRESHOLD = 1 << 16
+# Characters that matter when skipping a container, and inside a string
+_STRUCTURE = re.compile(r'["{}\[\]]')
+_STRING_END = re.compile(r'["\\]')
+
+
+class _Reader:
+    """Buffered cursor over an iterable of text chunks"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Append the next chunk to the buffer, returning False at end of input"""
+        if self.eof:
+            return False
+        if self.pos > _COMPACT_THRESHOLD:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        for chunk in self.chunks:
+            if chunk:
+                self.buf += chunk
+                return True
+        self.eof = True
+        return False
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON input")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos}, found {self.buf[self.pos]!r}")
+        self.pos += 1
+
+    def decode(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A value not followed by a terminator may be a truncated number or literal
+                if self.eof or (end < len(self.buf) and self.buf[end] in _TERMINATORS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Double the buffered input before retrying so large values decode in O(n)
+            pending = len(self.buf) - self.pos
+            while len(self.buf) - self.pos < 2 * pending and self._fill():
+                pass
+            if not self.eof and pending == len(self.buf) - self.pos:
+                self._fill()
+
+    def skip(self):
+        """Consume the next JSON value without decoding it"""
+        first = self.peek()
+        if first == '"':
+            self._skip_string()
+            return
+        if first not in '{[':
+            self.decode()
+            return
+        depth = 0
+        while True:
+            # Jump from one bracket or quote to the next over whole buffered chunks
+            match = _STRUCTURE.search(self.buf, self.pos)
+            if match is None:
+                self.pos = len(self.buf)
+                if not self._fill():
+                    raise ValueError("Unexpected end of JSON input")
+                continue
+            char = match.group()
+            self.pos = match.start()
+            if char == '"':
+                self._skip_string()
+                continue
+            self.pos += 1
+            if char in '{[':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def _skip_string(self):
+        self.pos += 1
+        while True:
+            match = _STRING_END.search(self.buf, self.pos)
+            if match is None:
+                self.pos = len(self.buf)
+                if not self._fill():
+                    raise ValueError("Unterminated JSON string")
+                continue
+            self.pos = match.end()
+            if match.group() == '"':
+                return
+            # Skip the escaped character, which may be in the next chunk
+            if self.pos >= len(self.buf) and not self._fill():
+                raise ValueError("Unterminated JSON string")
+            self.pos += 1
+
+
+def _iter_array(reader):
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.pos += 1
+        return
+    while True:
+        yield reader.decode()
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError(f"Expected ',' or ']' in array, found {separator!r}")
+
+
+def _find(reader, path):
+    """Advance the reader to the value at `path`, returning False if it is absent
+
+    Integer keys are array indices, string keys object keys, as in
+    declarative.extract().
+    """
+    for key in path:
+        if isinstance(key, int):
+            if reader.peek() != '[':
+                return False
+            reader.pos += 1
+            for _ in range(key):
+                if reader.peek() == ']':
+                    return False
+                reader.skip()
+                if reader.peek() == ',':
+                    reader.pos += 1
+            if reader.peek() == ']':
+                return False
+            continue
+        if reader.peek() != '{':
+            return False
+        reader.pos += 1
+        while True:
+            if reader.peek() == '}':
+                return False
+            name = reader.decode()
+            reader.expect(':')
+            if name == key:
+                break
+            reader.skip()
+            if reader.peek() == ',':
+                reader.pos += 1
+    return True
+
+
+def iter_text_items(chunks, path=()):
+    """Yield the elements of the array at `path` from an iterable of text chunks
+
+    `path` is a sequence of object keys and array indices leading from the
+    document root to the array; an empty path streams a top-level array.
+    """
+    reader = _Reader(chunks)
+    if not _find(reader, path):
+        return
+    if reader.peek() != '[':
+        raise ValueError(f"Value at {'.'.join(map(str, path)) or 'root'} is not an array")
+    yield from _iter_array(reader)
+
+
+def iter_items(byte_chunks, path=(), encoding='utf-8'):
+    """Yield the elements of the array at `path` from an iterable of byte chunks"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+
+    def text_chunks():
+        for chunk in byte_chunks:
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+
+    return iter_text_items(text_chunks(), path)
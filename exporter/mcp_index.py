@@ -0,0 +1,462 @@
+import ast
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import sys
+import threading
+import typing
+
+import fastmcp
+from fastmcp import Context, FastMCP
+from fastmcp.prompts import Prompt
+from fastmcp.prompts.prompt import FunctionPrompt
+from fastmcp.resources import FunctionResource, Resource, ResourceTemplate
+from fastmcp.resources.template import FunctionResourceTemplate
+from fastmcp.tools import Tool
+from fastmcp.tools.tool import FunctionTool
+from prometheus_client import Gauge
+
+from . import offload
+
+# Lazy loading of MCP modules.
+#
+# An MCP module is indexed from its source: every `@mcp.tool`, `@mcp.resource`
+# and `@mcp.prompt` function is replayed against a scratch FastMCP server with
+# a body-less stub of the function, which yields the same names, descriptions
+# and schemas the real import would. The stubs are registered on the shared
+# server, so listings are answered without importing the module. The first
+# call to any of them imports the real module on the offload worker pool,
+# whose registrations then replace the stubs. Stubs are always async, so
+# only the real components run through exporter/offload.py.
+#
+# Every module owns the components it registered. Imports run against a
+# scratch server so their registrations can be captured, and are then
+# swapped into the shared server in one step; unloading a module removes
+# exactly what it owns. A version number is bumped whenever the listed
+# components change, so clients can cache `tools/list`.
+#
+# Building schemas is most of the indexing cost, so the resulting component
+# definitions are kept in a manifest file keyed by a hash of each module's
+# source. Unchanged modules are registered from the manifest directly.
+
+# Decorators of the shared FastMCP instance the index understands
+REGISTRATION_DECORATORS = ('tool', 'resource', 'prompt')
+
+# Component types that can be rebuilt from a manifest record
+COMPONENT_TYPES = {cls.__name__: cls for cls in (FunctionTool, FunctionResource, FunctionResourceTemplate, FunctionPrompt)}
+MANIFEST_VERSION = 1
+
+mcp_registry_version = Gauge('exporter_mcp_registry_version', 'Version of the MCP tool, resource and prompt listings, bumped on every change')
+mcp_registry_components = Gauge('exporter_mcp_registry_components', 'Number of registered MCP components', ['kind'])
+
+# Current listing version, also returned in the X-MCP-Registry-Version header
+registry_version = 0
+
+# Names available to the annotations and defaults of indexed functions
+_STUB_NAMESPACE = {name: getattr(typing, name) for name in typing.__all__}
+_STUB_NAMESPACE['Context'] = Context
+
+
+class NotIndexable(Exception):
+    """The module registers components in a way the index cannot follow"""
+
+
+# Where each kind of component is held: (manager attribute, dict attribute)
+REGISTRIES = {
+    'tool': ('_tool_manager', '_tools'),
+    'resource': ('_resource_manager', '_resources'),
+    'template': ('_resource_manager', '_templates'),
+    'prompt': ('_prompt_manager', '_prompts'),
+}
+
+
+def registry(server, kind):
+    """The FastMCP manager dict holding components of one kind, keyed by component key"""
+    manager, attribute = REGISTRIES[kind]
+    return getattr(getattr(server, manager), attribute)
+
+
+def replace_registry(server, kind, entries):
+    """Swap in a new registry dict; readers see either the old or the new one, never a mix"""
+    manager, attribute = REGISTRIES[kind]
+    setattr(getattr(server, manager), attribute, entries)
+
+
+def component_kind(component):
+    if isinstance(component, Tool):
+        return 'tool'
+    if isinstance(component, ResourceTemplate):
+        return 'template'
+    if isinstance(component, Resource):
+        return 'resource'
+    if isinstance(component, Prompt):
+        return 'prompt'
+    raise TypeError(f"Unknown MCP component {component!r}")
+
+
+def _registration(decorator, server_name):
+    """Return (kind, call) for an @<server>.<kind> decorator, or None for other decorators"""
+    call = decorator if isinstance(decorator, ast.Call) else None
+    target = call.func if call else decorator
+    if (isinstance(target, ast.Attribute) and isinstance(target.value, ast.Name)
+            and target.value.id == server_name and target.attr in REGISTRATION_DECORATORS):
+        return target.attr, call
+    return None
+
+
+def _literal_arguments(call):
+    """Decorator arguments, which must be literals to be evaluated without the module"""
+    if call is None:
+        return None
+    try:
+        args = [ast.literal_eval(arg) for arg in call.args]
+        kwargs = {keyword.arg: ast.literal_eval(keyword.value) for keyword in call.keywords if keyword.arg}
+    except ValueError:
+        raise NotIndexable(f"non-literal decorator arguments on line {call.lineno}")
+    if any(keyword.arg is None for keyword in call.keywords):
+        raise NotIndexable(f"**kwargs in decorator arguments on line {call.lineno}")
+    return args, kwargs
+
+
+def index_source(source, filename, server_name='mcp'):
+    """Return (kind, decorator arguments, function node) for every registration in a module
+
+    Decorator arguments are None for bare decorators such as `@mcp.tool`.
+    Raises NotIndexable when the module uses the server in any other way.
+    """
+    try:
+        tree = ast.parse(source, filename)
+    except SyntaxError as e:
+        raise NotIndexable(f"syntax error: {e}")
+
+    entries = []
+    indexed = set()
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        registrations = [_registration(decorator, server_name) for decorator in node.decorator_list]
+        if not any(registrations):
+            continue
+        # Other decorators may change the function, only the real import can tell how
+        if not all(registrations):
+            raise NotIndexable(f"{node.name} has decorators other than @{server_name}.*")
+        for decorator, (kind, call) in zip(node.decorator_list, registrations):
+            entries.append((kind, _literal_arguments(call), node))
+            indexed.update(id(child) for child in ast.walk(decorator))
+
+    # Any other use of the server (e.g. mcp.add_tool(...) or aliasing it) needs the real module
+    for child in ast.walk(tree):
+        if isinstance(child, ast.Name) and child.id == server_name and id(child) not in indexed:
+            raise NotIndexable(f"{server_name} used outside registration decorators on line {child.lineno}")
+    if not entries:
+        raise NotIndexable("no registrations found")
+    return entries
+
+
+def compile_stub(node, filename, module_name, forward):
+    """Compile an async copy of a function whose body awaits `forward` with its arguments
+
+    The signature, annotations, defaults and docstring are kept, so FastMCP
+    derives the same schemas from the stub as from the real function.
+    Raises NotIndexable if they refer to names defined by the module.
+    """
+    arguments = node.args
+    positional = [ast.Name(arg.arg, ast.Load()) for arg in arguments.posonlyargs + arguments.args]
+    if arguments.vararg:
+        positional.append(ast.Starred(ast.Name(arguments.vararg.arg, ast.Load()), ast.Load()))
+    keywords = [ast.keyword(arg.arg, ast.Name(arg.arg, ast.Load())) for arg in arguments.kwonlyargs]
+    if arguments.kwarg:
+        keywords.append(ast.keyword(None, ast.Name(arguments.kwarg.arg, ast.Load())))
+    call = ast.Await(ast.Call(ast.Name('__forward__', ast.Load()), positional, keywords))
+    body = [node.body[0]] if ast.get_docstring(node, clean=False) is not None else []
+    # Shares the argument and annotation nodes of the original, which are left untouched
+    fields = {field: getattr(node, field) for field in node._fields}
+    fields.update(body=body + [ast.Return(call)], decorator_list=[])
+    stub = ast.copy_location(ast.AsyncFunctionDef(**fields), node)
+
+    tree = ast.fix_missing_locations(ast.Module([stub], []))
+    namespace = dict(_STUB_NAMESPACE, __forward__=forward, __name__=module_name)
+    try:
+        exec(compile(tree, filename, 'exec'), namespace)
+    except NameError as e:
+        raise NotIndexable(f"{node.name} signature needs the module: {e}")
+    return namespace[node.name]
+
+
+class Manifest:
+    """Component definitions of indexed modules, cached on disk by source hash"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.modules = {}
+        self.dirty = False
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == MANIFEST_VERSION and data.get('fastmcp') == fastmcp.__version__:
+                    self.modules = data['modules']
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Ignoring unreadable MCP manifest {path}: {e}")
+
+    @staticmethod
+    def fingerprint(source):
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def get(self, import_name, fingerprint):
+        entry = self.modules.get(import_name)
+        if entry is not None and entry['fingerprint'] == fingerprint:
+            return entry['components']
+        return None
+
+    def put(self, import_name, fingerprint, components):
+        records = []
+        for component in components:
+            if type(component).__name__ not in COMPONENT_TYPES or getattr(component, 'serializer', None):
+                return
+            data = component.model_dump(mode='json', exclude={'fn', 'serializer'})
+            records.append({'type': type(component).__name__, 'data': data})
+        self.modules[import_name] = {'fingerprint': fingerprint, 'components': records}
+        self.dirty = True
+
+    def save(self):
+        """Write the manifest if it changed, replacing the file atomically"""
+        if not self.path or not self.dirty:
+            return
+        data = {'version': MANIFEST_VERSION, 'fastmcp': fastmcp.__version__, 'modules': self.modules}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+# Indexed decorators are replayed and modules imported on one scratch server, emptied before each use
+_scratch = None
+_scratch_lock = threading.RLock()
+# Serializes registry swaps
+_swap_lock = threading.Lock()
+
+
+def _scratch_server():
+    global _scratch
+    if _scratch is None:
+        _scratch = FastMCP(name="mcp-scratch")
+    for kind in REGISTRIES:
+        registry(_scratch, kind).clear()
+    return _scratch
+
+
+def _listing(components):
+    """What clients see of a set of components, used to tell whether a swap changes the listings"""
+    return sorted(
+        (component_kind(component), component.key, json.dumps(component.model_dump(mode='json', exclude={'fn', 'serializer'}), sort_keys=True))
+        for component in components
+    )
+
+
+def swap(server, old, new):
+    """Replace the components `old` with `new` on the server, one registry dict per kind
+
+    Components in `old` that were since replaced by another module's
+    registration are left alone. Returns the registry version.
+    """
+    global registry_version
+    with _swap_lock:
+        for kind in REGISTRIES:
+            entries = dict(registry(server, kind))
+            for component in old:
+                if component_kind(component) == kind and entries.get(component.key) is component:
+                    del entries[component.key]
+            for component in new:
+                if component_kind(component) == kind:
+                    entries[component.key] = component
+            replace_registry(server, kind, entries)
+            mcp_registry_components.labels(kind=kind).set(len(entries))
+        if _listing(old) != _listing(new):
+            registry_version += 1
+            mcp_registry_version.set(registry_version)
+        return registry_version
+
+
+class McpModule:
+    """An MCP module and the components it owns on the shared server
+
+    With `lazy=True` the module is registered from its index and imported
+    on first use; modules the index can't follow are imported right away.
+
+        module = McpModule(mcp, 'mcps.custom_mcp_1', 'mcps/custom_mcp_1.py', manifest)
+        module.register()     # tools/list now includes its tools
+        module.load()         # imports mcps.custom_mcp_1 in place of the stubs
+        module.reload()       # picks up changes to the file
+        module.unregister()   # removes everything it registered
+    """
+
+    def __init__(self, server, import_name, path, manifest=None):
+        self.server = server
+        self.import_name = import_name
+        self.path = path
+        self.manifest = manifest if manifest is not None else Manifest()
+        self.module = None
+        self.fingerprint = None
+        # Components currently registered on the server: stubs, or the real ones once imported
+        self.components = []
+        self._lock = threading.RLock()
+
+    def _read(self):
+        with open(self.path, encoding='utf-8') as f:
+            return f.read()
+
+    def index(self, source):
+        """Build stub components for every registration of the module"""
+        entries = index_source(source, self.path)
+        fingerprint = self.manifest.fingerprint(source)
+        records = self.manifest.get(self.import_name, fingerprint)
+        if records is not None and len(records) == len(entries):
+            return [
+                self._stub_component(node, lambda fn, record=record: COMPONENT_TYPES[record['type']](fn=fn, **record['data']))
+                for (_, _, node), record in zip(entries, records)
+            ]
+        with _scratch_lock:
+            scratch = _scratch_server()
+            components = [
+                self._stub_component(node, lambda fn, kind=kind, arguments=arguments: _replay(scratch, kind, arguments, fn))
+                for kind, arguments, node in entries
+            ]
+        self.manifest.put(self.import_name, fingerprint, components)
+        return components
+
+    def _stub_component(self, node, build):
+        target = {}
+        fn = compile_stub(node, self.path, self.import_name, self._forwarder(target))
+        try:
+            component = build(fn)
+        except (TypeError, ValueError) as e:
+            raise NotIndexable(f"{node.name}: {e}")
+        target['kind'] = component_kind(component)
+        target['key'] = component.key
+        target['stub'] = component
+        return component
+
+    def _import(self):
+        """Import a fresh copy of the module and capture what it registers
+
+        The shared server is swapped for the scratch server on the package
+        while the module runs, so a failed import leaves the shared server
+        untouched. Returns (module, components).
+        """
+        package_name = self.import_name.rpartition('.')[0]
+        package = importlib.import_module(package_name)
+        with _scratch_lock:
+            scratch = _scratch_server()
+            server_names = [name for name, value in vars(package).items() if value is self.server]
+            previous = sys.modules.pop(self.import_name, None)
+            for name in server_names:
+                setattr(package, name, scratch)
+            try:
+                module = importlib.import_module(self.import_name)
+            except Exception:
+                sys.modules.pop(self.import_name, None)
+                if previous is not None:
+                    sys.modules[self.import_name] = previous
+                raise
+            finally:
+                for name in server_names:
+                    setattr(package, name, self.server)
+            # Runtime uses of the server inside the module go to the shared one
+            for name, value in list(vars(module).items()):
+                if value is scratch:
+                    setattr(module, name, self.server)
+            components = [component for kind in REGISTRIES for component in registry(scratch, kind).values()]
+        # Synchronous functions run on the offload worker pool
+        for component in components:
+            if hasattr(component, 'fn'):
+                component.fn = offload.wrap(component_kind(component), component.key, component.fn)
+        return module, components
+
+    def register(self, lazy=True):
+        """Register the module's current source, replacing whatever it registered before
+
+        Returns the new components. Errors leave the previous registrations in place.
+        """
+        with self._lock:
+            source = self._read()
+            components = None
+            if lazy:
+                try:
+                    components = self.index(source)
+                except NotIndexable as e:
+                    print(f"MCP module {self.import_name} can't be indexed ({e}), importing it now")
+            if components is None:
+                module, components = self._import()
+            else:
+                # The next use imports the new source
+                module = None
+                sys.modules.pop(self.import_name, None)
+            swap(self.server, self.components, components)
+            self.components = components
+            self.module = module
+            self.fingerprint = self.manifest.fingerprint(source)
+            return components
+
+    def reload(self, lazy=True):
+        """Re-register the module if its source changed; returns the new components or None
+
+        A module already in use is re-imported right away, so a broken change
+        is rejected and the previous version keeps serving.
+        """
+        with self._lock:
+            if self.manifest.fingerprint(self._read()) == self.fingerprint:
+                return None
+            previous = self.module
+            components = self.register(lazy and previous is None)
+            if previous is not None and hasattr(previous, 'close'):
+                previous.close()
+            return components
+
+    def unregister(self):
+        """Remove every component the module registered and forget the module"""
+        with self._lock:
+            swap(self.server, self.components, [])
+            self.components = []
+            if self.module is not None and hasattr(self.module, 'close'):
+                self.module.close()
+            self.module = None
+            sys.modules.pop(self.import_name, None)
+
+    def load(self):
+        """Import the real module in place of the stubs, once"""
+        with self._lock:
+            if self.module is None:
+                module, components = self._import()
+                swap(self.server, self.components, components)
+                self.components = components
+                self.module = module
+                print(f"MCP module {self.import_name} imported on first use")
+        return self.module
+
+    def _forwarder(self, target):
+        async def forward(*args, **kwargs):
+            if self.module is None:
+                # The import blocks, keep it off the event loop
+                await asyncio.get_running_loop().run_in_executor(offload.executor, self.load)
+            component = registry(self.server, target['kind']).get(target['key'])
+            if component is None or component is target['stub'] or not hasattr(component, 'fn'):
+                raise RuntimeError(f"{self.import_name} did not register {target['kind']} {target['key']}")
+            # Real components are async, synchronous ones were wrapped by offload
+            return await component.fn(*args, **kwargs)
+        return forward
+
+    def __repr__(self):
+        state = 'imported' if self.module is not None else 'indexed'
+        return f"<McpModule {self.import_name} ({len(self.components)} {state} components)>"
+
+
+def _replay(scratch, kind, decorator_arguments, fn):
+    """Apply an indexed decorator to a stub on the scratch server"""
+    if decorator_arguments is None:
+        return getattr(scratch, kind)(fn)
+    args, kwargs = decorator_arguments
+    return getattr(scratch, kind)(*args, **kwargs)(fn)
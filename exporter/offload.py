@@ -0,0 +1,128 @@
+import asyncio
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Synchronous MCP tools, resources and prompts run on a bounded thread pool
+# instead of the event loop, where their blocking I/O would stall /metrics
+# scrapes and every other MCP request. Async functions are left as they are.
+#
+# A module can limit its own components by key (tool or prompt name,
+# resource URI):
+#
+#     TOOL_LIMITS = {
+#         'refresh_zstack_metrics': {'concurrency': 1, 'timeout': 30},
+#     }
+#
+# Calls over a component's concurrency limit wait their turn without
+# holding a worker thread. A call that times out returns an error to the
+# client; its thread can't be interrupted and keeps its slot until it ends.
+
+# Worker threads shared by all synchronous MCP components
+MCP_SYNC_WORKERS = int(os.environ.get('MCP_SYNC_WORKERS', 8))
+# Seconds before a call without its own limit times out (0 waits forever)
+MCP_CALL_TIMEOUT = float(os.environ.get('MCP_CALL_TIMEOUT', 60))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+mcp_call_queue_seconds = Histogram('exporter_mcp_call_queue_seconds', 'Time synchronous MCP calls waited for a worker', ['kind', 'name'], buckets=LATENCY_BUCKETS)
+mcp_call_seconds = Histogram('exporter_mcp_call_seconds', 'Execution time of synchronous MCP calls', ['kind', 'name'], buckets=LATENCY_BUCKETS)
+mcp_call_timeouts = Counter('exporter_mcp_call_timeouts', 'Synchronous MCP calls that exceeded their timeout', ['kind', 'name'])
+mcp_calls_running = Gauge('exporter_mcp_calls_running', 'Synchronous MCP calls executing on a worker', ['kind', 'name'])
+mcp_calls_waiting = Gauge('exporter_mcp_calls_waiting', 'Synchronous MCP calls waiting for a worker', ['kind', 'name'])
+
+executor = ThreadPoolExecutor(max_workers=MCP_SYNC_WORKERS, thread_name_prefix='mcp-sync')
+
+
+class Limit:
+    """Concurrency limit and timeout of one component"""
+
+    def __init__(self, concurrency=None, timeout=None):
+        self.concurrency = min(concurrency or MCP_SYNC_WORKERS, MCP_SYNC_WORKERS)
+        self.timeout = MCP_CALL_TIMEOUT if timeout is None else timeout
+        # Created on first use, in the event loop serving the calls
+        self.semaphore = None
+
+    def acquire_semaphore(self):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self.semaphore
+
+
+# (kind, key) -> Limit of the component currently registered under that key
+_limits = {}
+_limits_lock = threading.Lock()
+
+
+def declared_limits(fn):
+    """The TOOL_LIMITS entries of the module defining a function"""
+    module = sys.modules.get(getattr(fn, '__module__', None))
+    return getattr(module, 'TOOL_LIMITS', None) or {}
+
+
+def limit(kind, key, fn):
+    """Set up the limit of a component from its module's TOOL_LIMITS"""
+    declared = declared_limits(fn).get(key, {})
+    new = Limit(declared.get('concurrency'), declared.get('timeout'))
+    with _limits_lock:
+        current = _limits.get((kind, key))
+        # Keep the semaphore when nothing changed, calls may be waiting on it
+        if current is not None and (current.concurrency, current.timeout) == (new.concurrency, new.timeout):
+            return current
+        _limits[(kind, key)] = new
+    return new
+
+
+def wrap(kind, key, fn):
+    """Return an async function running the synchronous `fn` on the worker pool
+
+    Coroutine functions are returned unchanged.
+    """
+    if inspect.iscoroutinefunction(fn):
+        return fn
+    component_limit = limit(kind, key, fn)
+    labels = {'kind': kind, 'name': key}
+
+    @functools.wraps(fn)
+    async def call(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        semaphore = component_limit.acquire_semaphore()
+        queued = time.perf_counter()
+        mcp_calls_waiting.labels(**labels).inc()
+        try:
+            await semaphore.acquire()
+        finally:
+            mcp_calls_waiting.labels(**labels).dec()
+
+        def run():
+            started = time.perf_counter()
+            mcp_call_queue_seconds.labels(**labels).observe(started - queued)
+            mcp_calls_running.labels(**labels).inc()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                mcp_calls_running.labels(**labels).dec()
+                mcp_call_seconds.labels(**labels).observe(time.perf_counter() - started)
+
+        def done(future):
+            # The slot is freed when the thread is done, even after a timeout
+            semaphore.release()
+            if not future.cancelled():
+                future.exception()  # Retrieved here in case the caller gave up on it
+
+        future = loop.run_in_executor(executor, run)
+        future.add_done_callback(done)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), component_limit.timeout or None)
+        except asyncio.TimeoutError:
+            mcp_call_timeouts.labels(**labels).inc()
+            raise TimeoutError(f"{kind} {key} timed out after {component_limit.timeout:g}s")
+        return result
+
+    return call
@@ -0,0 +1,192 @@
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from prometheus_client import Counter, Gauge
+from prometheus_client.core import GaugeMetricFamily
+
+from . import replay, zstack
+from .declarative import load_spec
+
+# Multi-target probing: one exporter polls many ZStack clusters listed in
+# a targets file and serves each cluster's cached results on
+# /probe?target=<name>, every series labelled with cluster="<name>".
+#
+#     {"targets": [{"name": "cluster-a", "url": "https://zstack-a/.../available-hosts-metrics",
+#                   "api_key": "${ZSTACK_A_API_KEY}"},
+#                  {"name": "cluster-b", "url": "...", "api_key": "...", "interval": 120}]}
+#
+# Targets are polled by at most ZSTACK_PROBE_CONCURRENCY threads, their
+# schedules spread evenly over the interval so the clusters aren't all hit
+# at once. A scrape of /probe never waits for a cluster.
+
+# JSON or YAML file listing the clusters to probe (empty disables probing)
+ZSTACK_TARGETS_PATH = os.environ.get('ZSTACK_TARGETS_PATH', '')
+# Seconds between two polls of a target without its own interval
+ZSTACK_PROBE_INTERVAL = float(os.environ.get('ZSTACK_PROBE_INTERVAL', 60))
+# Targets polled at the same time
+ZSTACK_PROBE_CONCURRENCY = int(os.environ.get('ZSTACK_PROBE_CONCURRENCY', 8))
+ZSTACK_PROBE_TIMEOUT = float(os.environ.get('ZSTACK_PROBE_TIMEOUT', 10))
+
+probe_targets = Gauge('exporter_probe_targets', 'ZStack clusters configured for probing')
+probe_polls = Counter('exporter_probe_polls', 'Polls of probed ZStack clusters', ['result'])
+probe_overruns = Counter('exporter_probe_overruns', 'Polls skipped because the previous poll of the target was still running')
+
+
+class Target:
+    """One ZStack cluster to probe"""
+
+    def __init__(self, name, url, api_key, interval=None):
+        if not name or not url or not api_key:
+            raise ValueError("A probe target needs a name, a url and an api_key")
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.interval = float(interval) if interval else ZSTACK_PROBE_INTERVAL
+
+
+class Result:
+    """The outcome of a target's latest poll, replaced as a whole"""
+
+    __slots__ = ('success', 'duration', 'values', 'last_success', 'error')
+
+    def __init__(self, success, duration, values, last_success, error=None):
+        self.success = success
+        self.duration = duration
+        self.values = values
+        self.last_success = last_success
+        self.error = error
+
+
+def load_targets(path):
+    """Read the targets of a JSON or YAML targets file"""
+    spec = load_spec(path)
+    targets = {}
+    for index, item in enumerate(spec.get('targets', [])):
+        try:
+            target = Target(item['name'], item['url'], item['api_key'], item.get('interval'))
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Target {index} in {path} needs a name, a url and an api_key ({e})")
+        if target.name in targets:
+            raise ValueError(f"Duplicate target {target.name} in {path}")
+        targets[target.name] = target
+    return targets
+
+
+class TargetCollector:
+    """Collector rendering one target's cached result"""
+
+    def __init__(self, target, result):
+        self.target = target
+        self.result = result
+
+    def collect(self):
+        labels = [self.target.name]
+        result = self.result
+        if result is not None and result.values is not None:
+            for name, description in zstack.ZSTACK_FIELDS.values():
+                family = GaugeMetricFamily(name, description, labels=['cluster'])
+                family.add_metric(labels, result.values.get(name, 0))
+                yield family
+            family = GaugeMetricFamily('zstack_lastSuccessfulFetch', 'Timestamp of the last successful fetch from ZStack API', labels=['cluster'])
+            family.add_metric(labels, result.last_success)
+            yield family
+        success = GaugeMetricFamily('zstack_probe_success', 'Whether the latest poll of the cluster succeeded', labels=['cluster'])
+        success.add_metric(labels, 1 if result is not None and result.success else 0)
+        yield success
+        if result is not None:
+            duration = GaugeMetricFamily('zstack_probe_duration_seconds', 'Duration of the latest poll of the cluster', labels=['cluster'])
+            duration.add_metric(labels, result.duration)
+            yield duration
+
+
+class Prober:
+    """Polls targets on staggered schedules and keeps their latest results"""
+
+    def __init__(self, targets, concurrency=ZSTACK_PROBE_CONCURRENCY):
+        self.targets = targets
+        # target name -> latest Result; a failed poll keeps the last good values
+        self.results = {}
+        self.running = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix='probe')
+        self.thread = None
+
+    def poll(self, target):
+        start = time.time()
+        previous = self.results.get(target.name)
+        try:
+            # Each poll asks the cluster, the cache only revalidates unchanged responses
+            data = zstack.fetch_available_hosts_metrics(target.url, target.api_key, timeout=ZSTACK_PROBE_TIMEOUT, ttl=0)
+            result = Result(True, time.time() - start, zstack.metric_values(data), time.time())
+            probe_polls.labels(result='success').inc()
+        except Exception as e:
+            print(f"Error probing ZStack cluster {target.name}: {e}")
+            result = Result(False, time.time() - start,
+                            previous.values if previous is not None else None,
+                            previous.last_success if previous is not None else 0.0, str(e))
+            probe_polls.labels(result='error').inc()
+        self.results[target.name] = result
+        with self.lock:
+            self.running.discard(target.name)
+
+    def schedule(self):
+        """Spread first polls over the interval, then poll each target every interval"""
+        now = time.time()
+        names = sorted(self.targets)
+        queue = [(now + replay.scaled(self.targets[name].interval) * index / len(names), name)
+                 for index, name in enumerate(names)]
+        heapq.heapify(queue)
+        while queue and not self.stopping.is_set():
+            due, name = queue[0]
+            if self.stopping.wait(max(due - time.time(), 0)):
+                break
+            heapq.heapreplace(queue, (due + replay.scaled(self.targets[name].interval), name))
+            with self.lock:
+                if name in self.running:
+                    probe_overruns.inc()
+                    continue
+                self.running.add(name)
+            self.executor.submit(self.poll, self.targets[name])
+
+    def start(self):
+        probe_targets.set(len(self.targets))
+        self.thread = threading.Thread(target=self.schedule, name='probe-scheduler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.executor.shutdown(wait=False)
+
+    def collector(self, name):
+        """Return the collector of a target's cached result, or None for an unknown target"""
+        target = self.targets.get(name)
+        if target is None:
+            return None
+        return TargetCollector(target, self.results.get(name))
+
+
+# The running prober, None unless ZSTACK_TARGETS_PATH lists targets
+prober = None
+
+
+def start_probing(path=ZSTACK_TARGETS_PATH):
+    """Start polling the targets of the targets file; returns the Prober or None"""
+    global prober
+    if not path:
+        return None
+    targets = load_targets(path)
+    if not targets:
+        return None
+    prober = Prober(targets)
+    prober.start()
+    print(f"Probing {len(targets)} ZStack clusters with up to {ZSTACK_PROBE_CONCURRENCY} concurrent polls")
+    return prober
+
+
+def collector(name):
+    return prober.collector(name) if prober is not None else None
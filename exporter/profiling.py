@@ -0,0 +1,209 @@
+import collections
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+# On-demand profiling for the debug endpoints. Nothing here runs until it is
+# asked for: the stack sampler only exists for the duration of a request,
+# module profiling costs a dict lookup per process() call until armed, and
+# tracemalloc is off until started.
+
+# Longest stack sampling window a request may ask for
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 60))
+# Most process() calls a module profile may be armed for
+PROFILE_MAX_CALLS = int(os.environ.get('PROFILE_MAX_CALLS', 100))
+# Shortest interval between stack samples, in seconds
+PROFILE_MIN_INTERVAL = 0.001
+# Deepest traceback tracemalloc keeps per allocation, each frame costs memory on every block
+PROFILE_MAX_FRAMES = 100
+# Most entries a profile report or tracemalloc snapshot lists
+PROFILE_MAX_ENTRIES = 1000
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds, interval=0.01, thread_filter=None):
+    """Sample every thread's stack for `seconds` and return collapsed stacks
+
+    The result is in the collapsed format read by flamegraph.pl and
+    speedscope: one `thread;outer;...;inner count` line per distinct stack.
+    """
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+    interval = min(max(interval, PROFILE_MIN_INTERVAL), seconds)
+    me = threading.get_ident()
+    counts = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            thread_name = names.get(ident, str(ident))
+            if thread_filter and thread_filter not in thread_name:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(thread_name.replace(';', ':'))
+            counts[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+class ModuleProfile:
+    """cProfile statistics of the next `calls` process() calls of a module"""
+
+    def __init__(self, module_name, calls):
+        self.module_name = module_name
+        self.calls = calls
+        self.remaining = calls
+        self.stats = None
+        self.started = time.time()
+        self.finished = None
+
+    def add(self, profiler):
+        if self.stats is None:
+            self.stats = pstats.Stats(profiler)
+        else:
+            self.stats.add(profiler)
+        self.remaining -= 1
+        if self.remaining <= 0:
+            self.finished = time.time()
+
+    def report(self, sort='cumulative', limit=50):
+        if self.stats is None:
+            return ''
+        output = io.StringIO()
+        self.stats.stream = output
+        self.stats.sort_stats(sort).print_stats(min(limit, PROFILE_MAX_ENTRIES))
+        return output.getvalue()
+
+    def status(self):
+        return {
+            'module': self.module_name,
+            'calls': self.calls,
+            'remaining': max(self.remaining, 0),
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+# module name -> ModuleProfile still collecting
+_armed = {}
+# module name -> last ModuleProfile, finished or not
+_profiles = {}
+_profiles_lock = threading.Lock()
+# Only one profiler can be active at a time in the interpreter
+_profiler_lock = threading.Lock()
+
+
+def arm(module_name, calls):
+    """Profile the next `calls` process() calls of a module, replacing any earlier profile"""
+    profile = ModuleProfile(module_name, min(calls, PROFILE_MAX_CALLS))
+    with _profiles_lock:
+        _armed[module_name] = profile
+        _profiles[module_name] = profile
+    return profile
+
+
+def profile(module_name):
+    """Return the latest ModuleProfile of a module, or None"""
+    with _profiles_lock:
+        return _profiles.get(module_name)
+
+
+def call(module_name, function):
+    """Run a module's process(), under cProfile if profiling was armed for it"""
+    if module_name not in _armed:
+        return function()
+    # Another module is being profiled, this call runs unprofiled and doesn't count
+    if not _profiler_lock.acquire(blocking=False):
+        return function()
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function)
+    finally:
+        _profiler_lock.release()
+        with _profiles_lock:
+            profile = _armed.get(module_name)
+            if profile is not None:
+                profile.add(profiler)
+                if profile.remaining <= 0:
+                    del _armed[module_name]
+
+
+# The last tracemalloc snapshot, kept to diff the next one against
+_last_snapshot = None
+_tracemalloc_lock = threading.Lock()
+
+_TRACEMALLOC_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def start_tracemalloc(frames=1):
+    global _last_snapshot
+    with _tracemalloc_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(min(frames, PROFILE_MAX_FRAMES))
+            _last_snapshot = None
+    return tracemalloc_status()
+
+
+def stop_tracemalloc():
+    global _last_snapshot
+    with _tracemalloc_lock:
+        tracemalloc.stop()
+        _last_snapshot = None
+    return tracemalloc_status()
+
+
+def tracemalloc_status():
+    traced, peak = tracemalloc.get_traced_memory()
+    return {
+        'tracing': tracemalloc.is_tracing(),
+        'frames': tracemalloc.get_traceback_limit(),
+        'traced_bytes': traced,
+        'peak_bytes': peak,
+        'has_snapshot': _last_snapshot is not None,
+    }
+
+
+def _stat(stat, key_type):
+    frames = stat.traceback if key_type == 'traceback' else stat.traceback[:1]
+    entry = {
+        'location': [f"{frame.filename}:{frame.lineno}" for frame in frames],
+        'size_bytes': stat.size,
+        'count': stat.count,
+    }
+    if hasattr(stat, 'size_diff'):
+        entry['size_diff_bytes'] = stat.size_diff
+        entry['count_diff'] = stat.count_diff
+    return entry
+
+
+def take_snapshot(key_type='lineno', limit=25):
+    """Take a tracemalloc snapshot and return its top allocations and the diff with the previous one"""
+    global _last_snapshot
+    limit = min(limit, PROFILE_MAX_ENTRIES)
+    with _tracemalloc_lock:
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running, start it first")
+        current = tracemalloc.take_snapshot().filter_traces(_TRACEMALLOC_FILTERS)
+        previous, _last_snapshot = _last_snapshot, current
+    result = dict(tracemalloc_status(), top=[_stat(stat, key_type) for stat in current.statistics(key_type)[:limit]])
+    if previous is not None:
+        result['diff'] = [_stat(stat, key_type) for stat in current.compare_to(previous, key_type)[:limit]]
+    return result
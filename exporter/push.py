@@ -0,0 +1,376 @@
+import gzip
+import math
+import os
+import struct
+import threading
+import time
+
+import requests
+from prometheus_client import Counter, Gauge, Histogram
+
+from . import updates
+
+try:
+    import snappy
+except ImportError:  # optional, only needed for remote write
+    snappy = None
+
+# Push pipeline: changed samples are sent to a remote receiver after each
+# module update, batched by size and time. Batches that can't be delivered
+# wait in a bounded on-disk queue and are retried in order.
+#
+# Two formats are supported:
+# - remote_write: Prometheus remote-write protobuf, snappy-compressed. Only
+#   changed series are sent; removed series get a staleness marker.
+# - text: Prometheus text exposition format, gzip-compressed, POSTed
+#   Pushgateway-style. Pushgateway replaces whole metric families on POST,
+#   so every series of a family with a change is sent.
+
+PUSH_URL = os.environ.get('PUSH_URL', '')
+PUSH_FORMAT = os.environ.get('PUSH_FORMAT', 'remote_write')
+# Flush once this many samples are pending, or when the oldest has waited PUSH_BATCH_INTERVAL seconds
+PUSH_BATCH_SIZE = int(os.environ.get('PUSH_BATCH_SIZE', 5000))
+PUSH_BATCH_INTERVAL = float(os.environ.get('PUSH_BATCH_INTERVAL', 5))
+PUSH_TIMEOUT = float(os.environ.get('PUSH_TIMEOUT', 10))
+# Undelivered batches, oldest dropped first beyond PUSH_QUEUE_MAX_BYTES
+PUSH_QUEUE_DIR = os.environ.get('PUSH_QUEUE_DIR', 'push_queue')
+PUSH_QUEUE_MAX_BYTES = int(os.environ.get('PUSH_QUEUE_MAX_BYTES', 64 * 1024 * 1024))
+# Extra labels for every pushed series, e.g. "site=edge-1,cluster=zs1"
+PUSH_LABELS = os.environ.get('PUSH_LABELS', '')
+PUSH_BEARER_TOKEN = os.environ.get('PUSH_BEARER_TOKEN', '')
+
+push_latency = Histogram('exporter_push_latency_seconds', 'Duration of push requests to the receiver')
+push_samples = Counter('exporter_push_samples', 'Samples delivered to the push receiver')
+push_failures = Counter('exporter_push_failures', 'Push requests that failed and were queued for retry')
+push_dropped_batches = Counter('exporter_push_dropped_batches', 'Batches dropped because the receiver rejected them or the queue was full')
+push_queue_depth = Gauge('exporter_push_queue_depth', 'Batches waiting in the on-disk retry queue')
+push_queue_bytes = Gauge('exporter_push_queue_bytes', 'Size of the on-disk retry queue')
+push_lag = Gauge('exporter_push_lag_seconds', 'Age of the oldest sample in the last delivered batch')
+
+# Prometheus staleness marker, tells the receiver a series is gone
+STALE_NAN = struct.unpack('<d', struct.pack('<Q', 0x7ff0000000000002))[0]
+
+
+def parse_labels(value):
+    """Parse "name=value,name=value" into a sorted tuple of pairs"""
+    labels = []
+    for item in value.split(','):
+        if '=' in item:
+            name, _, label_value = item.partition('=')
+            labels.append((name.strip(), label_value.strip()))
+    return tuple(sorted(labels))
+
+
+# Protocol buffer encoding of prometheus.WriteRequest, without a protobuf dependency:
+#   WriteRequest { repeated TimeSeries timeseries = 1; }
+#   TimeSeries { repeated Label labels = 1; repeated Sample samples = 2; }
+#   Label { string name = 1; string value = 2; }
+#   Sample { double value = 1; int64 timestamp = 2; }
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _length_delimited(number, payload):
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def encode_write_request(series):
+    """Encode [(labels, [(value, timestamp ms)])] as a WriteRequest; labels are sorted (name, value) pairs"""
+    out = []
+    for labels, samples in series:
+        body = [
+            _length_delimited(1, _length_delimited(1, name.encode('utf-8')) + _length_delimited(2, value.encode('utf-8')))
+            for name, value in labels
+        ]
+        for value, timestamp in samples:
+            body.append(_length_delimited(2, b'\x09' + struct.pack('<d', value) + b'\x10' + _varint(timestamp)))
+        out.append(_length_delimited(1, b''.join(body)))
+    return b''.join(out)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class Batch:
+    """Updates waiting to be pushed"""
+
+    def __init__(self):
+        self.updates = []
+        self.samples = 0
+        self.oldest = None
+
+    def add(self, update):
+        self.updates.append(update)
+        self.samples += len(update.changed) + len(update.removed)
+        if self.oldest is None:
+            self.oldest = update.timestamp
+
+    def remote_write(self, extra_labels=()):
+        """WriteRequest of the changed series, with staleness markers for removed ones"""
+        series = {}
+        for update in self.updates:
+            timestamp = int(update.timestamp * 1000)
+            points = [(key, value) for key, value in update.changed]
+            points.extend((key, STALE_NAN) for key in update.removed)
+            for (name, labels), value in points:
+                series_labels = tuple(sorted(dict(extra_labels, **dict(labels), __name__=name).items()))
+                series.setdefault(series_labels, []).append((value, timestamp))
+        return encode_write_request(series.items())
+
+    def text(self, extra_labels=()):
+        """Text exposition of every family with a change, as of its latest update"""
+        families = {}
+        for update in self.updates:
+            touched = {update.metadata[name][0] for (name, _), _ in update.changed if name in update.metadata}
+            touched.update(update.metadata[name][0] for name, _ in update.removed if name in update.metadata)
+            for family in touched:
+                families[family] = (update, [])
+            for (name, labels), value in update.samples.items():
+                family = update.metadata[name][0]
+                if family in touched:
+                    families[family][1].append((name, labels, value))
+        lines = []
+        for family, (update, samples) in families.items():
+            _, family_type, documentation = next(meta for meta in update.metadata.values() if meta[0] == family)
+            lines.append(f"# HELP {family} {_escape(documentation)}")
+            lines.append(f"# TYPE {family} {family_type if family_type != 'unknown' else 'untyped'}")
+            for name, labels, value in samples:
+                merged = dict(extra_labels, **dict(labels))
+                label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in sorted(merged.items()))
+                lines.append(f"{name}{{{label_text}}} {_format_value(value)}" if label_text else f"{name} {_format_value(value)}")
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class DiskQueue:
+    """Encoded batches waiting for delivery, one file each, oldest first"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._sequence = 0
+        self._update_metrics()
+
+    def _files(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith('.batch'))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _update_metrics(self):
+        files = self._files()
+        push_queue_depth.set(len(files))
+        push_queue_bytes.set(sum(os.path.getsize(path) for path in files))
+
+    def __len__(self):
+        return len(self._files())
+
+    def put(self, body, samples, oldest):
+        """Queue a batch, remembering its sample count and oldest sample time for the metrics"""
+        self._sequence += 1
+        name = f"{time.time_ns():020d}-{self._sequence:06d}-{samples}-{int(oldest * 1000)}.batch"
+        path = os.path.join(self.directory, name)
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(body)
+        os.replace(f"{path}.tmp", path)
+        files = self._files()
+        total = sum(os.path.getsize(queued) for queued in files)
+        while total > self.max_bytes and files:
+            oldest_file = files.pop(0)
+            total -= os.path.getsize(oldest_file)
+            os.remove(oldest_file)
+            push_dropped_batches.inc()
+            print(f"Push queue over {self.max_bytes} bytes, dropped {oldest_file}")
+        self._update_metrics()
+
+    def peek(self):
+        """Return (path, body, samples, oldest) of the oldest batch, or None"""
+        files = self._files()
+        if not files:
+            return None
+        path = files[0]
+        with open(path, 'rb') as f:
+            body = f.read()
+        _, _, samples, oldest = os.path.basename(path)[:-len('.batch')].split('-')
+        return path, body, int(samples), int(oldest) / 1000
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        self._update_metrics()
+
+
+class Pusher:
+    """Batches module updates and delivers them to the receiver from a background thread"""
+
+    def __init__(self, url, push_format=PUSH_FORMAT, queue_dir=PUSH_QUEUE_DIR,
+                 batch_size=PUSH_BATCH_SIZE, batch_interval=PUSH_BATCH_INTERVAL,
+                 extra_labels=parse_labels(PUSH_LABELS), bearer_token=PUSH_BEARER_TOKEN):
+        if push_format == 'remote_write' and snappy is None:
+            print("python-snappy is not installed, pushing in text format with gzip instead of remote write")
+            push_format = 'text'
+        if push_format not in ('remote_write', 'text'):
+            raise ValueError(f"Unknown PUSH_FORMAT: {push_format}")
+        self.url = url
+        self.format = push_format
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.extra_labels = extra_labels
+        self.queue = DiskQueue(queue_dir, PUSH_QUEUE_MAX_BYTES)
+        self.session = requests.Session()
+        self.headers = {'User-Agent': 'prometheus-custom-exporter'}
+        if push_format == 'remote_write':
+            self.headers.update({
+                'Content-Type': 'application/x-protobuf',
+                'Content-Encoding': 'snappy',
+                'X-Prometheus-Remote-Write-Version': '0.1.0',
+            })
+        else:
+            self.headers.update({'Content-Type': 'text/plain; version=0.0.4', 'Content-Encoding': 'gzip'})
+        if bearer_token:
+            self.headers['Authorization'] = f"Bearer {bearer_token}"
+        self.batch = Batch()
+        self.condition = threading.Condition()
+        self.retry_at = 0.0
+        self.backoff = 1.0
+        self.running = False
+
+    def on_update(self, update):
+        """Update listener, queues the update for the next batch"""
+        with self.condition:
+            self.batch.add(update)
+            if self.batch.samples >= self.batch_size:
+                self.condition.notify()
+
+    def encode(self, batch):
+        if self.format == 'remote_write':
+            return snappy.compress(batch.remote_write(self.extra_labels))
+        return gzip.compress(batch.text(self.extra_labels))
+
+    def send(self, body):
+        """POST one encoded batch; returns True once the batch is done with, delivered or rejected"""
+        start = time.time()
+        try:
+            response = self.session.post(self.url, data=body, headers=self.headers, timeout=PUSH_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"Push to {self.url} failed: {e}")
+            return False
+        finally:
+            push_latency.observe(time.time() - start)
+        if response.status_code < 300:
+            return True
+        # Client errors other than throttling will fail the same way on every retry
+        if 400 <= response.status_code < 500 and response.status_code != 429:
+            print(f"Push rejected by {self.url} with HTTP {response.status_code}, dropping batch: {response.text[:200]}")
+            push_dropped_batches.inc()
+            return True
+        print(f"Push to {self.url} failed with HTTP {response.status_code}")
+        return False
+
+    def _failed(self):
+        push_failures.inc()
+        self.retry_at = time.time() + self.backoff
+        self.backoff = min(self.backoff * 2, 60.0)
+
+    def _delivered(self, samples, oldest):
+        push_samples.inc(samples)
+        push_lag.set(time.time() - oldest)
+        self.backoff = 1.0
+
+    def drain(self):
+        """Deliver queued batches in order until the queue is empty or a push fails"""
+        while time.time() >= self.retry_at:
+            queued = self.queue.peek()
+            if queued is None:
+                return
+            path, body, samples, oldest = queued
+            if not self.send(body):
+                self._failed()
+                return
+            self.queue.remove(path)
+            self._delivered(samples, oldest)
+
+    def flush(self):
+        """Push the pending batch now, queueing it on disk if it can't be delivered"""
+        with self.condition:
+            batch, self.batch = self.batch, Batch()
+        if batch.samples:
+            body = self.encode(batch)
+            # Earlier batches go first so the receiver sees samples in order
+            sent = False
+            if not len(self.queue) and time.time() >= self.retry_at:
+                sent = self.send(body)
+                if not sent:
+                    self._failed()
+            if sent:
+                self._delivered(batch.samples, batch.oldest)
+            else:
+                self.queue.put(body, batch.samples, batch.oldest)
+        self.drain()
+
+    def run(self):
+        self.running = True
+        while self.running:
+            with self.condition:
+                if self.batch.oldest is None:
+                    timeout = self.batch_interval
+                else:
+                    timeout = self.batch.oldest + self.batch_interval - time.time()
+                if self.batch.samples < self.batch_size and timeout > 0:
+                    self.condition.wait(timeout)
+                due = self.batch.samples >= self.batch_size or (
+                    self.batch.oldest is not None and time.time() >= self.batch.oldest + self.batch_interval)
+            try:
+                if due:
+                    self.flush()
+                else:
+                    self.drain()
+            except Exception as e:
+                print(f"Error pushing metrics: {e}")
+
+    def start(self):
+        updates.add_listener(self.on_update)
+        thread = threading.Thread(target=self.run, name='metrics-push')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stop(self):
+        """Stop listening and push what is pending"""
+        updates.remove_listener(self.on_update)
+        self.running = False
+        with self.condition:
+            self.condition.notify()
+        self.flush()
+
+
+def start_pushing(modules):
+    """Start the push pipeline if PUSH_URL is set, returning the Pusher
+
+    `modules` maps the names of the already loaded metric modules to the
+    modules; their current samples make up the first push.
+    """
+    if not PUSH_URL:
+        return None
+    pusher = Pusher(PUSH_URL)
+    pusher.start()
+    # Modules processed at startup, or restored from a snapshot, may not update again for a while
+    for name, module in list(modules.items()):
+        updates.module_processed(name, module)
+    print(f"Pushing changed samples to {PUSH_URL} ({pusher.format}), {len(pusher.queue)} batches queued from earlier runs")
+    return pusher
@@ -0,0 +1,131 @@
+import base64
+import gzip
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from requests.adapters import HTTPAdapter
+
+# Record and replay of upstream traffic for offline performance tests.
+#
+# With UPSTREAM_RECORD_PATH set, every request sent through the shared
+# upstream session (upstream.get(), stream_items() and direct
+# upstream.session calls) is appended to a gzip-compressed JSON lines file
+# with its response, its latency and its offset from the start of the
+# recording. Credentials are never written: query parameters named in
+# UPSTREAM_RECORD_REDACT are dropped and request headers aren't kept.
+#
+# `python -m stubs.replay recording.jsonl.gz` serves the recording back;
+# running the exporter with TIME_SCALE=720 against it replays a day of
+# refresh cycles in two minutes.
+
+# File to record upstream requests and responses to (empty disables recording)
+UPSTREAM_RECORD_PATH = os.environ.get('UPSTREAM_RECORD_PATH', '')
+# Query parameters left out of recordings
+UPSTREAM_RECORD_REDACT = os.environ.get('UPSTREAM_RECORD_REDACT', 'apikey,api_key,token,sessionId,session_id')
+# Speed-up of the exporter's clock: refresh intervals and cache TTLs are divided by it
+TIME_SCALE = float(os.environ.get('TIME_SCALE', 1)) or 1.0
+
+# Response headers worth replaying; the rest describe the original connection
+_KEPT_HEADERS = ('content-type', 'etag', 'last-modified', 'cache-control')
+
+
+def scaled(seconds):
+    """Real seconds to wait for `seconds` of exporter time"""
+    return seconds / TIME_SCALE
+
+
+def _redacted(names):
+    return {name.strip().lower() for name in names.split(',') if name.strip()}
+
+
+def request_key(url, redact=None):
+    """Path and sorted query of a URL without redacted parameters, as recorded and matched"""
+    redact = _redacted(UPSTREAM_RECORD_REDACT) if redact is None else redact
+    parts = urlsplit(url)
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if name.lower() not in redact)
+    return f"{parts.path}?{urlencode(query)}" if query else parts.path
+
+
+def encode_body(content):
+    try:
+        return {'body': content.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'body_base64': base64.b64encode(content).decode('ascii')}
+
+
+def decode_body(entry):
+    if 'body_base64' in entry:
+        return base64.b64decode(entry['body_base64'])
+    return entry.get('body', '').encode('utf-8')
+
+
+class Recorder:
+    """Appends request/response pairs to a recording file"""
+
+    def __init__(self, path, redact=UPSTREAM_RECORD_REDACT):
+        self.path = path
+        self.redact = _redacted(redact)
+        self.started = time.time()
+        self.lock = threading.Lock()
+        # Offsets are relative to this run, so a new run starts a new recording
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+
+    def record(self, request, response, started, elapsed):
+        entry = {
+            't': round(started - self.started, 6),
+            'elapsed': round(elapsed, 6),
+            'method': request.method,
+            'host': urlsplit(request.url).netloc,
+            'request': request_key(request.url, self.redact),
+            'status': response.status_code,
+            'headers': {name: value for name, value in response.headers.items() if name.lower() in _KEPT_HEADERS},
+        }
+        entry.update(encode_body(response.content))
+        line = json.dumps(entry, separators=(',', ':'))
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Transport adapter recording every exchange it sends
+
+    Streamed responses are read in full before being handed back, so
+    recording gives up the flat memory of stream_items().
+    """
+
+    def __init__(self, recorder, *args, **kwargs):
+        self.recorder = recorder
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        started = time.time()
+        response = super().send(request, *args, **kwargs)
+        # Reading the body here times the full transfer, as the caller would see it
+        response.content
+        try:
+            self.recorder.record(request, response, started, time.time() - started)
+        except Exception as e:
+            print(f"Error recording upstream request {request_key(request.url, self.recorder.redact)}: {e}")
+        return response
+
+
+def load_recording(path):
+    """Read a recording into {request key: [entries ordered by time]}"""
+    exchanges = {}
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                exchanges.setdefault(entry['request'], []).append(entry)
+    for entries in exchanges.values():
+        entries.sort(key=lambda entry: entry['t'])
+    return exchanges
@@ -0,0 +1,404 @@
+import ast
+import math
+import operator
+import os
+import threading
+
+from prometheus_client import REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+from . import updates
+from .collectors import collector_names, module_collectors
+from .declarative import load_spec
+
+# Recording rules: derived series computed once per update of their inputs
+# instead of on every MCP call and again in PromQL.
+#
+#     {"rules": [{"record": "zstack_cpuUsageRatio",
+#                 "expr": "(zstack_totalCpuCapacity - zstack_availableCpuCapacity) / zstack_totalCpuCapacity",
+#                 "help": "Fraction of the ZStack CPU capacity in use"}]}
+#
+# Expressions use metric names, numbers, + - * / % ** and a few functions.
+# Operations between two series vectors match series with identical label
+# sets; a series without labels is applied to every series of the other
+# side. Division by zero gives NaN or +-Inf, as in PromQL, and so does a
+# power without a real result, e.g. (-8) ** 0.5 is NaN.
+#
+# Rules are evaluated in file order whenever a module providing one of
+# their inputs has processed; a rule may use the output of rules above it.
+
+# JSON or YAML file with the rules (empty disables them)
+RULES_PATH = os.environ.get('RULES_PATH', 'rules.json')
+
+# Module name under which rule results are reported to update listeners
+RULES_MODULE = 'recording_rules'
+
+
+def _divide(a, b):
+    if b == 0:
+        return math.nan if a == 0 or math.isnan(a) else math.copysign(math.inf, a) * math.copysign(1, b)
+    return a / b
+
+
+def _modulo(a, b):
+    return math.nan if b == 0 else math.fmod(a, b)
+
+
+def _power(a, b):
+    try:
+        result = a ** b
+    except ZeroDivisionError:
+        return math.inf
+    except OverflowError:
+        # Only odd integer powers of a negative base are negative
+        return -math.inf if a < 0 and float(b).is_integer() and b % 2 else math.inf
+    # A negative base with a fractional exponent has no real result
+    return math.nan if isinstance(result, complex) else result
+
+
+_BINARY = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: _divide,
+    ast.Mod: _modulo,
+    ast.Pow: _power,
+}
+_UNARY = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+
+# Element-wise functions: name -> (function, number of scalar arguments after the vector)
+_FUNCTIONS = {
+    'abs': (abs, 0),
+    'clamp_min': (max, 1),
+    'clamp_max': (min, 1),
+}
+_AGGREGATIONS = {
+    'sum': sum,
+    'min': min,
+    'max': max,
+    'count': len,
+    'avg': lambda values: sum(values) / len(values),
+}
+
+
+def _compile(node, inputs):
+    """Check that an expression node only uses supported syntax, collecting input names"""
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise ValueError(f"Unsupported constant {node.value!r}")
+    elif isinstance(node, ast.Name):
+        inputs.add(node.id)
+    elif isinstance(node, ast.BinOp):
+        if type(node.op) not in _BINARY:
+            raise ValueError(f"Unsupported operator {type(node.op).__name__}")
+        _compile(node.left, inputs)
+        _compile(node.right, inputs)
+    elif isinstance(node, ast.UnaryOp):
+        if type(node.op) not in _UNARY:
+            raise ValueError(f"Unsupported operator {type(node.op).__name__}")
+        _compile(node.operand, inputs)
+    elif isinstance(node, ast.Call):
+        name = getattr(node.func, 'id', None)
+        if name in _FUNCTIONS:
+            if len(node.args) != 1 + _FUNCTIONS[name][1] or node.keywords:
+                raise ValueError(f"{name}() takes {1 + _FUNCTIONS[name][1]} arguments")
+        elif name in _AGGREGATIONS:
+            if len(node.args) != 1 or any(keyword.arg != 'by' for keyword in node.keywords):
+                raise ValueError(f"{name}() takes one argument and an optional by=[labels]")
+            for keyword in node.keywords:
+                if not (isinstance(keyword.value, (ast.List, ast.Tuple))
+                        and all(isinstance(item, ast.Constant) and isinstance(item.value, str) for item in keyword.value.elts)):
+                    raise ValueError(f"{name}(by=...) must be a list of label names")
+        else:
+            raise ValueError(f"Unknown function {name or ast.dump(node.func)}")
+        for argument in node.args:
+            _compile(argument, inputs)
+    else:
+        raise ValueError(f"Unsupported expression {type(node).__name__}")
+
+
+def _apply(function, a, b):
+    """Apply a binary function to scalars and/or vectors"""
+    if not isinstance(a, dict) and not isinstance(b, dict):
+        return function(a, b)
+    if not isinstance(a, dict):
+        return {key: function(a, value) for key, value in b.items()}
+    if not isinstance(b, dict):
+        return {key: function(value, b) for key, value in a.items()}
+    # A single series without labels applies to every series of the other side
+    if list(a) == [()] and list(b) != [()]:
+        return {key: function(a[()], value) for key, value in b.items()}
+    if list(b) == [()] and list(a) != [()]:
+        return {key: function(value, b[()]) for key, value in a.items()}
+    return {key: function(value, b[key]) for key, value in a.items() if key in b}
+
+
+def _aggregate(function, vector, by):
+    if not isinstance(vector, dict):
+        vector = {(): vector}
+    groups = {}
+    for key, value in vector.items():
+        labels = dict(key)
+        group = tuple((label, labels.get(label, '')) for label in sorted(by))
+        groups.setdefault(group, []).append(value)
+    return {group: float(function(values)) for group, values in groups.items()}
+
+
+def _evaluate(node, vectors):
+    if isinstance(node, ast.Constant):
+        return float(node.value)
+    if isinstance(node, ast.Name):
+        return vectors.get(node.id, {})
+    if isinstance(node, ast.BinOp):
+        return _apply(_BINARY[type(node.op)], _evaluate(node.left, vectors), _evaluate(node.right, vectors))
+    if isinstance(node, ast.UnaryOp):
+        value = _evaluate(node.operand, vectors)
+        function = _UNARY[type(node.op)]
+        return {key: function(item) for key, item in value.items()} if isinstance(value, dict) else function(value)
+    name = node.func.id
+    argument = _evaluate(node.args[0], vectors)
+    if name in _AGGREGATIONS:
+        by = [item.value for keyword in node.keywords for item in keyword.value.elts]
+        return _aggregate(_AGGREGATIONS[name], argument, by)
+    function, extra = _FUNCTIONS[name]
+    if extra:
+        return _apply(function, argument, _evaluate(node.args[1], vectors))
+    return {key: function(value) for key, value in argument.items()} if isinstance(argument, dict) else function(argument)
+
+
+class Rule:
+    """One recording rule: `record` is the exported name of `expr`"""
+
+    def __init__(self, record, expr, help=''):
+        if not record.isidentifier():
+            raise ValueError(f"Invalid rule name {record!r}")
+        self.record = record
+        self.expr = expr
+        self.help = help or f"Recording rule: {expr}"
+        try:
+            self.tree = ast.parse(expr.strip(), mode='eval').body
+        except SyntaxError as e:
+            raise ValueError(f"Invalid expression for {record}: {e.msg}")
+        self.inputs = set()
+        _compile(self.tree, self.inputs)
+
+    def evaluate(self, vectors):
+        """Return the rule's vector {labels tuple: value} from its input vectors"""
+        result = _evaluate(self.tree, vectors)
+        return result if isinstance(result, dict) else {(): result}
+
+
+def load_rules(path):
+    """Read the rules of a JSON or YAML rules file"""
+    spec = load_spec(path)
+    rules = []
+    for index, item in enumerate(spec.get('rules', [])):
+        try:
+            rules.append(Rule(item['record'], item['expr'], item.get('help', '')))
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Rule {index} in {path} needs a record and an expr ({e})")
+    return rules
+
+
+def _source_name(name):
+    """Family names a sample name may belong to, e.g. requests_total -> requests"""
+    yield name
+    for suffix in ('_total', '_count', '_sum', '_bucket'):
+        if name.endswith(suffix):
+            yield name[:-len(suffix)]
+
+
+class RecordingRules:
+    """Evaluates rules as their input modules update and exposes the results as gauges"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.records = {rule.record for rule in rules}
+        # Latest vector of every rule, replaced as a whole so readers need no lock
+        self.results = {}
+        # record -> {input name: number of the published generation it was
+        # read from, None for inputs of other collectors}
+        self.generations = {}
+        # (results, generations), swapped in one assignment for readers
+        self.evaluated = ({}, {})
+        # module name -> (module, {family name: collector})
+        self.modules = {}
+        self.lock = threading.Lock()
+
+    def _index(self, module_name, module):
+        indexed = self.modules.get(module_name)
+        if indexed is not None and indexed[0] is module:
+            return
+        families = {}
+        for collector in module_collectors(module):
+            for name in collector_names(collector):
+                families[name] = collector
+        self.modules[module_name] = (module, families)
+
+    def _source(self, name):
+        """Return (module name, collector) providing an input, or None"""
+        for family in _source_name(name):
+            for module_name, (_, families) in self.modules.items():
+                if family in families:
+                    return module_name, families[family]
+        return None
+
+    def _read(self, names):
+        """Read the current vectors of input series from their collectors
+
+        Returns the vectors and, for inputs of gauge groups publishing
+        generations (AtomicGauges, CompactGauges), the generation read.
+        """
+        vectors = {name: {} for name in names}
+        generations = {name: None for name in names}
+        by_collector = {}
+        for name in names:
+            source = self._source(name)
+            if source is not None:
+                by_collector.setdefault(id(source[1]), (source[1], set()))[1].add(name)
+        for collector, wanted in by_collector.values():
+            if hasattr(collector, 'current') and hasattr(collector, 'families'):
+                # All inputs of a group come from one generation
+                generation = collector.current()
+                for name in wanted & set(collector.families):
+                    labelnames = collector.families[name][1]
+                    vectors[name] = {
+                        tuple(sorted(zip(labelnames, labelvalues))): value
+                        for labelvalues, value in generation.values[name].items()
+                    }
+                    generations[name] = generation.number
+                continue
+            for family in collector.collect():
+                for sample in family.samples:
+                    if sample.name in wanted:
+                        vectors[sample.name][tuple(sorted(sample.labels.items()))] = sample.value
+        return vectors, generations
+
+    def evaluate(self, changed_modules=None):
+        """Evaluate the rules depending on the given modules (all rules if None)"""
+        with self.lock:
+            results = dict(self.results)
+            generations = dict(self.generations)
+            changed_records = set()
+            due = []
+            for rule in self.rules:
+                sources = {source[0] for source in map(self._source, rule.inputs - self.records) if source}
+                if changed_modules is None or sources & changed_modules or rule.inputs & changed_records:
+                    due.append(rule)
+                    changed_records.add(rule.record)
+            if not due:
+                return False
+            vectors, read = self._read({name for rule in due for name in rule.inputs - self.records})
+            for rule in due:
+                inputs = dict(vectors)
+                inputs.update({record: results.get(record, {}) for record in rule.inputs & self.records})
+                try:
+                    results[rule.record] = rule.evaluate(inputs)
+                except Exception as e:
+                    print(f"Error evaluating rule {rule.record}: {e}")
+                    continue
+                used = {name: read[name] for name in rule.inputs - self.records}
+                for record in rule.inputs & self.records:
+                    used.update(generations.get(record, {}))
+                generations[rule.record] = used
+            self.results = results
+            self.generations = generations
+            self.evaluated = (results, generations)
+        updates.module_processed(RULES_MODULE, self)
+        return True
+
+    def module_processed(self, module_name, module):
+        with self.lock:
+            self._index(module_name, module)
+        self.evaluate({module_name})
+
+    def module_removed(self, module_name):
+        with self.lock:
+            removed = self.modules.pop(module_name, None)
+        if removed is not None:
+            self.evaluate()
+
+    def refresh(self, modules):
+        """Index every loaded module and evaluate all rules, e.g. after startup"""
+        with self.lock:
+            for module_name, module in list(modules.items()):
+                self._index(module_name, module)
+        self.evaluate()
+
+    def vector(self, record, generation=None):
+        """Return the latest vector of a rule
+
+        Given a Generation read by the caller, the vector is only returned
+        if every input the rule takes from that generation's families was
+        read from it, and is empty otherwise.
+        """
+        results, generations = self.evaluated
+        if generation is not None:
+            for name, number in generations.get(record, {}).items():
+                if name in generation.values and number != generation.number:
+                    return {}
+        return results.get(record, {})
+
+    def collectors(self):
+        return [self]
+
+    def describe(self):
+        for rule in self.rules:
+            yield GaugeMetricFamily(rule.record, rule.help)
+
+    def collect(self):
+        results = self.results
+        for rule in self.rules:
+            vector = results.get(rule.record, {})
+            labelnames = sorted({label for key in vector for label, _ in key})
+            family = GaugeMetricFamily(rule.record, rule.help, labels=labelnames)
+            for key, value in vector.items():
+                labels = dict(key)
+                family.add_metric([labels.get(label, '') for label in labelnames], value)
+            yield family
+
+
+# The loaded rules, None until load() succeeds
+engine = None
+
+
+def load(path=RULES_PATH, registry=REGISTRY):
+    """Load the rules file and register its results; returns the number of rules"""
+    global engine
+    if not path or not os.path.exists(path):
+        return 0
+    rules = RecordingRules(load_rules(path))
+    if engine is not None:
+        registry.unregister(engine)
+    registry.register(rules)
+    engine = rules
+    return len(rules.rules)
+
+
+def module_processed(module_name, module):
+    if engine is not None:
+        engine.module_processed(module_name, module)
+
+
+def module_removed(module_name):
+    if engine is not None:
+        engine.module_removed(module_name)
+
+
+def refresh(modules):
+    if engine is not None:
+        engine.refresh(modules)
+
+
+def vector(record, generation=None):
+    """Return the latest {labels tuple: value} of a rule, empty if it isn't loaded
+
+    With `generation`, also empty unless the rule was computed from that
+    generation of its inputs (see RecordingRules.vector).
+    """
+    return engine.vector(record, generation) if engine is not None else {}
+
+
+def value(record, default=math.nan, generation=None, **labels):
+    """Return one series of a rule, selected by its labels"""
+    return vector(record, generation).get(tuple(sorted(labels.items())), default)
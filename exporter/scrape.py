@@ -0,0 +1,73 @@
+import gzip
+from urllib.parse import parse_qs
+
+from prometheus_client import REGISTRY
+from prometheus_client.exposition import choose_encoder, gzip_accepted
+from prometheus_client.metrics_core import Metric
+
+# Filtered scrapes. `/metrics?module[]=custom_metrics_1` (or `collect[]=`)
+# only collects the collectors of the named modules, and
+# `name[]=zstack_availableHostCount` only those exposing the named series;
+# given together, both apply. Collectors that aren't selected are never
+# called, so a cheap subset can be scraped often and expensive families
+# rarely.
+
+
+class Selection:
+    """The collectors of some modules, optionally restricted to some series names"""
+
+    def __init__(self, collectors, names=None):
+        self.collectors = collectors
+        self.names = names
+
+    def collect(self):
+        for collector in self.collectors:
+            for family in collector.collect():
+                if self.names is None:
+                    yield family
+                    continue
+                samples = [sample for sample in family.samples if sample.name in self.names]
+                if samples:
+                    restricted = Metric(family.name, family.documentation, family.type, family.unit)
+                    restricted.samples = samples
+                    yield restricted
+
+
+def select(params, get_modules, registry=REGISTRY):
+    """Return the collector to render for a scrape's query parameters
+
+    `get_modules()` maps module names to their collectors.
+    """
+    modules = params.get('module[]', []) + params.get('collect[]', [])
+    names = params.get('name[]')
+    if not modules:
+        return registry.restricted_registry(names) if names else registry
+    available = get_modules()
+    collectors = []
+    seen = set()
+    # Unknown modules select nothing, like unknown names
+    for module_name in modules:
+        for collector in available.get(module_name, ()):
+            if id(collector) not in seen:
+                seen.add(id(collector))
+                collectors.append(collector)
+    return Selection(collectors, set(names) if names else None)
+
+
+def make_metrics_app(get_modules, registry=REGISTRY, disable_compression=False):
+    """ASGI app serving the registry like prometheus_client's, plus module[] selection"""
+
+    async def metrics_app(scope, receive, send):
+        assert scope.get('type') == 'http'
+        params = parse_qs(scope.get('query_string', b'').decode('utf-8'))
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+        encoder, content_type = choose_encoder(headers.get('accept', ''))
+        output = encoder(select(params, get_modules, registry))
+        response_headers = [(b'content-type', content_type.encode())]
+        if not disable_compression and gzip_accepted(headers.get('accept-encoding', '')):
+            output = gzip.compress(output)
+            response_headers.append((b'content-encoding', b'gzip'))
+        await send({'type': 'http.response.start', 'status': 200, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': output})
+
+    return metrics_app
@@ -0,0 +1,210 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+from prometheus_client import Counter, Gauge
+
+from .collectors import collector_names, module_collectors
+
+# Compact binary snapshot of the last-known values of gauges, counters and
+# sharded accumulators (prometheus_client histograms and summaries are
+# saved but not restored, their buckets can't be set from outside):
+#   header: magic, format version, record count
+#   record: name length, name, labels length, labels (JSON), value, updated timestamp
+MAGIC = b'PCES'
+VERSION = 2
+_HEADER = struct.Struct('<4sHI')
+_LENGTH = struct.Struct('<H')
+# Version 1 snapshots stored the labels length on two bytes as well
+_LABELS_LENGTH = {1: _LENGTH, 2: struct.Struct('<I')}
+_VALUES = struct.Struct('<dd')
+
+# Sample name suffixes of the families a collector restores at once
+_SUFFIXES = ('', '_total', '_bucket', '_count', '_sum')
+
+# (name, labels JSON) -> (value, timestamp of the last observed change)
+_series = {}
+_series_lock = threading.Lock()
+
+# Per-module records carry the time of the module's last successful process()
+MODULE_RECORD = '__module_processed__'
+
+
+def _series_key(name, labels):
+    return name, json.dumps(sorted(labels.items()), separators=(',', ':'))
+
+
+def _iter_samples(module):
+    """Yield (name, labels, value) for every sample defined by a module, creation timestamps aside"""
+    for collector in module_collectors(module):
+        for family in collector.collect():
+            for sample in family.samples:
+                if sample.name.endswith('_created'):
+                    continue
+                yield sample.name, sample.labels, sample.value
+
+
+def encode(records):
+    """Encode (name, labels JSON, value, updated) records into snapshot bytes"""
+    parts = []
+    count = 0
+    labels_length = _LABELS_LENGTH[VERSION]
+    for name, labels, value, updated in records:
+        name_bytes = name.encode('utf-8')
+        labels_bytes = labels.encode('utf-8')
+        if len(name_bytes) > 0xffff or len(labels_bytes) > 0xffffffff:
+            print(f"Skipping series {name} in snapshot, its name or labels are too long")
+            continue
+        parts.append(_LENGTH.pack(len(name_bytes)))
+        parts.append(name_bytes)
+        parts.append(labels_length.pack(len(labels_bytes)))
+        parts.append(labels_bytes)
+        parts.append(_VALUES.pack(value, updated))
+        count += 1
+    return _HEADER.pack(MAGIC, VERSION, count) + b''.join(parts)
+
+
+def decode(buffer):
+    """Decode snapshot bytes into a list of (name, labels JSON, value, updated) records"""
+    magic, version, count = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version not in _LABELS_LENGTH:
+        raise ValueError(f"Unsupported snapshot format: {magic!r} v{version}")
+    labels_length = _LABELS_LENGTH[version]
+    offset = _HEADER.size
+    records = []
+    for _ in range(count):
+        (name_length,) = _LENGTH.unpack_from(buffer, offset)
+        offset += _LENGTH.size
+        name = bytes(buffer[offset:offset + name_length]).decode('utf-8')
+        offset += name_length
+        (length,) = labels_length.unpack_from(buffer, offset)
+        offset += labels_length.size
+        labels = bytes(buffer[offset:offset + length]).decode('utf-8')
+        offset += length
+        value, updated = _VALUES.unpack_from(buffer, offset)
+        offset += _VALUES.size
+        records.append((name, labels, value, updated))
+    return records
+
+
+def mark_processed(module_name, when=None):
+    """Record that a module finished a successful process() call"""
+    when = time.time() if when is None else when
+    with _series_lock:
+        _series[_series_key(MODULE_RECORD, {'module': module_name})] = (0.0, when)
+
+
+def save(path, modules):
+    """Write the current values of the given modules to the snapshot file
+
+    `modules` maps module names to loaded metric modules. Only the series
+    they expose now are kept, removed series are dropped from the snapshot.
+    """
+    now = time.time()
+    with _series_lock:
+        current = {}
+        for module_name, module in modules.items():
+            key = _series_key(MODULE_RECORD, {'module': module_name})
+            if key in _series:
+                current[key] = _series[key]
+            for name, labels, value in _iter_samples(module):
+                key = _series_key(name, labels)
+                previous = _series.get(key)
+                if previous is None or previous[0] != value:
+                    previous = (value, now)
+                current[key] = previous
+        _series.clear()
+        _series.update(current)
+        records = [(name, labels, value, updated) for (name, labels), (value, updated) in current.items()]
+
+    # Write to a temporary file and rename it so a crash never leaves a torn snapshot
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(encode(records))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+def load(path):
+    """Load the snapshot file into memory, returning the number of series read"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return 0
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            records = decode(buffer)
+    with _series_lock:
+        for name, labels, value, updated in records:
+            _series[(name, labels)] = (value, updated)
+    return len(records)
+
+
+def restore_module(module_name, module):
+    """Set a freshly imported module's gauges from the loaded snapshot
+
+    Returns the seconds since the module was last processed according to the
+    snapshot, or None if nothing was restored for this module.
+    """
+    restored = 0
+    with _series_lock:
+        processed = _series.get(_series_key(MODULE_RECORD, {'module': module_name}))
+        by_name = {}
+        for (name, labels), (value, updated) in _series.items():
+            by_name.setdefault(name, []).append((json.loads(labels), value, updated))
+
+    for collector in module_collectors(module):
+        # Generations and sharded accumulators restore all their samples at once
+        if callable(getattr(collector, 'restore', None)):
+            samples = [
+                (family + suffix, dict(labels), value)
+                for family in collector_names(collector)
+                for suffix in _SUFFIXES
+                for labels, value, _ in by_name.get(family + suffix, [])
+            ]
+            if samples:
+                collector.restore(samples)
+                restored += len(samples)
+            continue
+        if isinstance(collector, Gauge):
+            name = collector.describe()[0].name
+        elif isinstance(collector, Counter):
+            name = collector.describe()[0].name + '_total'
+        else:
+            continue
+        for labels, value, _ in by_name.get(name, []):
+            try:
+                child = collector.labels(**dict(labels)) if labels else collector
+                if isinstance(collector, Counter):
+                    # A fresh counter is at 0, so incrementing sets it
+                    child.inc(value)
+                else:
+                    child.set(value)
+            except Exception as e:
+                print(f"Error restoring {name}{dict(labels)} from snapshot: {e}")
+                continue
+            restored += 1
+
+    if not restored or processed is None:
+        return None
+    return max(0.0, time.time() - processed[1])
+
+
+def start_periodic_save(path, interval, get_modules):
+    """Save a snapshot every `interval` seconds in a background thread"""
+    def save_loop():
+        while True:
+            time.sleep(interval)
+            try:
+                count = save(path, get_modules())
+                print(f"Saved {count} series to snapshot {path}")
+            except Exception as e:
+                print(f"Error saving snapshot {path}: {e}")
+
+    thread = threading.Thread(target=save_loop)
+    thread.daemon = True
+    thread.start()
+    return thread
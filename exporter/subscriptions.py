@@ -0,0 +1,249 @@
+import asyncio
+import collections
+import json
+import math
+import operator
+import os
+import re
+import threading
+import time
+
+from prometheus_client import Counter, Gauge
+
+from . import updates
+
+# Change subscriptions: clients keep one Server-Sent Events stream open and
+# receive the series that changed after each module update, instead of
+# polling MCP tools that re-read every gauge.
+#
+# A subscription selects series with Prometheus-style selectors, e.g.
+# `zstack_host_connected{cluster_uuid="c1"}`, and can carry threshold
+# conditions such as `zstack_availableHostCount < 2` that are evaluated
+# server-side and only reported when they start or stop holding.
+
+# Events waiting for a slow client before its stream is closed
+SUBSCRIBE_MAX_PENDING = int(os.environ.get('SUBSCRIBE_MAX_PENDING', 1000))
+# Seconds between keep-alive comments on an idle stream
+SUBSCRIBE_KEEPALIVE = float(os.environ.get('SUBSCRIBE_KEEPALIVE', 15))
+
+active_subscriptions = Gauge('exporter_subscriptions', 'Open change subscription streams')
+subscription_events = Counter('exporter_subscription_events', 'Events sent to change subscribers', ['event'])
+subscription_overflows = Counter('exporter_subscription_overflows', 'Subscription streams closed because the client fell behind')
+
+_NAME = r'[a-zA-Z_:][a-zA-Z0-9_:]*'
+_SELECTOR = re.compile(r'^\s*(' + _NAME + r')?\s*(?:\{(.*)\})?\s*$', re.S)
+_MATCHER = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!~|!=|=)\s*"((?:[^"\\]|\\.)*)"\s*(?:,|$)')
+_CONDITION = re.compile(r'^(.*?)\s*(>=|<=|==|!=|>|<)\s*([^\s<>=!]+)\s*$', re.S)
+# Escapes of label values in selectors, as in the exposition format; others are kept as written
+_ESCAPE = re.compile(r'\\(.)', re.S)
+_ESCAPES = {'\\': '\\', '"': '"', 'n': '\n'}
+_OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le, '==': operator.eq, '!=': operator.ne}
+
+
+class Selector:
+    """A series selector: an optional metric name and label matchers
+
+    The name matches either the sample name or its family name, so
+    `request_seconds` selects the `_bucket`, `_sum` and `_count` samples.
+    """
+
+    def __init__(self, text):
+        match = _SELECTOR.match(text)
+        if not match or not (match.group(1) or match.group(2)):
+            raise ValueError(f"Invalid selector: {text!r}")
+        self.text = text.strip()
+        self.name = match.group(1)
+        self.matchers = []
+        body = (match.group(2) or '').strip()
+        position = 0
+        while position < len(body):
+            matcher = _MATCHER.match(body, position)
+            if not matcher:
+                raise ValueError(f"Invalid label matcher in {text!r}: {body[position:]!r}")
+            label, op, value = matcher.groups()
+            value = _ESCAPE.sub(lambda escape: _ESCAPES.get(escape.group(1), escape.group(0)), value)
+            if op in ('=~', '!~'):
+                try:
+                    value = re.compile(value)
+                except re.error as e:
+                    raise ValueError(f"Invalid regular expression in {text!r}: {e}")
+            self.matchers.append((label, op, value))
+            position = matcher.end()
+
+    def matches(self, name, family, labels):
+        if self.name is not None and self.name != name and self.name != family:
+            return False
+        labels = dict(labels)
+        for label, op, value in self.matchers:
+            actual = labels.get(label, '')
+            if op == '=':
+                matched = actual == value
+            elif op == '!=':
+                matched = actual != value
+            elif op == '=~':
+                matched = value.fullmatch(actual) is not None
+            else:
+                matched = value.fullmatch(actual) is None
+            if not matched:
+                return False
+        return True
+
+
+class Condition:
+    """A threshold on the selected series, e.g. `zstack_availableHostCount < 2`"""
+
+    def __init__(self, text):
+        match = _CONDITION.match(text)
+        if not match:
+            raise ValueError(f"Invalid condition: {text!r}")
+        selector, op, threshold = match.groups()
+        self.text = text.strip()
+        self.selector = Selector(selector)
+        self.op = op
+        try:
+            self.threshold = float(threshold)
+        except ValueError:
+            raise ValueError(f"Invalid threshold in {text!r}: {threshold!r}")
+
+    def holds(self, value):
+        return not math.isnan(value) and _OPERATORS[self.op](value, self.threshold)
+
+
+def _series(key, value=None):
+    name, labels = key
+    series = {'name': name, 'labels': dict(labels)}
+    if value is not None:
+        # JSON has no NaN or infinities
+        series['value'] = value if math.isfinite(value) else str(value)
+    return series
+
+
+class Subscription:
+    """One client's stream of changed series and threshold alerts
+
+    With no selectors and no conditions every change is sent. With only
+    conditions, only alerts are sent.
+    """
+
+    def __init__(self, selectors=(), conditions=()):
+        self.selectors = [Selector(text) for text in selectors]
+        self.conditions = [Condition(text) for text in conditions]
+        self.send_changes = bool(self.selectors) or not self.conditions
+        # (condition index, series key) currently holding
+        self.firing = set()
+        # Series families seen so far, so removals can be matched by family name
+        self.families = {}
+        # Updates and the initial snapshot are evaluated on different threads
+        self.lock = threading.Lock()
+        self.loop = None
+        self.pending = collections.deque()
+        self.wake = None
+        self.overflowed = False
+
+    def selected(self, key, family):
+        if not self.selectors:
+            return True
+        return any(selector.matches(key[0], family, key[1]) for selector in self.selectors)
+
+    def evaluate(self, samples, removed, families):
+        """Return (changes, removals, alerts) for one batch of series"""
+        changes = []
+        removals = []
+        alerts = []
+        for key, value in samples:
+            family = families.get(key[0], key[0])
+            if self.send_changes and self.selected(key, family):
+                changes.append(_series(key, value))
+            for index, condition in enumerate(self.conditions):
+                if not condition.selector.matches(key[0], family, key[1]):
+                    continue
+                holds = condition.holds(value)
+                firing = (index, key) in self.firing
+                if holds != firing:
+                    if holds:
+                        self.firing.add((index, key))
+                    else:
+                        self.firing.discard((index, key))
+                    alerts.append(dict(_series(key, value), condition=condition.text,
+                                       state='firing' if holds else 'resolved'))
+        for key in removed:
+            family = families.get(key[0], key[0])
+            if self.send_changes and self.selected(key, family):
+                removals.append(_series(key))
+            for index, condition in enumerate(self.conditions):
+                if (index, key) in self.firing:
+                    self.firing.discard((index, key))
+                    alerts.append(dict(_series(key), condition=condition.text, state='resolved'))
+        return changes, removals, alerts
+
+    def events_for(self, module, timestamp, samples, removed, metadata):
+        """Turn one module's samples into SSE event tuples (event, data)"""
+        with self.lock:
+            for name, (family, _, _) in metadata.items():
+                self.families[name] = family
+            changes, removals, alerts = self.evaluate(samples, removed, self.families)
+        events = []
+        if changes or removals:
+            events.append(('update', {'module': module, 'timestamp': timestamp,
+                                      'changed': changes, 'removed': removals}))
+        for alert in alerts:
+            events.append(('alert', dict(alert, module=module, timestamp=timestamp)))
+        return events
+
+    def on_update(self, update):
+        """Update listener, runs on the module's processing thread"""
+        events = self.events_for(update.module, update.timestamp, update.changed, update.removed, update.metadata)
+        if events and self.loop is not None:
+            self.loop.call_soon_threadsafe(self._deliver, events)
+
+    def _deliver(self, events):
+        if len(self.pending) + len(events) > SUBSCRIBE_MAX_PENDING:
+            self.overflowed = True
+        else:
+            self.pending.extend(events)
+        self.wake.set()
+
+    def snapshot(self, modules):
+        events = []
+        for name, module in list(modules.items()):
+            samples, metadata = updates.collect_samples(module)
+            events.extend(self.events_for(name, time.time(), samples.items(), [], metadata))
+        return events
+
+    async def stream(self, modules):
+        """Yield the SSE stream: a snapshot of the current state, then changes
+
+        `modules` maps metric module names to the loaded modules.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.wake = asyncio.Event()
+        updates.add_listener(self.on_update)
+        active_subscriptions.inc()
+        try:
+            # Listen first so nothing between the snapshot and the first update is lost
+            snapshot = await self.loop.run_in_executor(None, self.snapshot, modules)
+            yield _format('snapshot', {'updates': [data for event, data in snapshot if event == 'update']})
+            for event, data in snapshot:
+                if event == 'alert':
+                    yield _format(event, data)
+            while True:
+                try:
+                    await asyncio.wait_for(self.wake.wait(), SUBSCRIBE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                self.wake.clear()
+                if self.overflowed:
+                    subscription_overflows.inc()
+                    yield _format('overflow', {'reason': 'client fell behind, reconnect for a fresh snapshot'})
+                    return
+                while self.pending:
+                    yield _format(*self.pending.popleft())
+        finally:
+            updates.remove_listener(self.on_update)
+            active_subscriptions.dec()
+
+
+def _format(event, data):
+    subscription_events.labels(event=event).inc()
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
@@ -0,0 +1,121 @@
+import math
+import threading
+import time
+
+from .collectors import module_collectors
+
+# Module update events.
+#
+# After every process() of a metric module its samples are diffed against
+# the previous update and the listeners receive what changed. Nothing is
+# collected while there are no listeners.
+
+_listeners = []
+_listeners_lock = threading.Lock()
+
+# module name -> {(sample name, labels tuple): value} as of the last update
+_last_samples = {}
+_last_lock = threading.Lock()
+
+
+class Update:
+    """Samples of one module after a process() call
+
+    Series are keyed by (sample name, labels), labels being a sorted tuple
+    of (name, value) pairs.
+
+    - samples: every current series, {key: value}
+    - changed: [(key, value)] for series that are new or changed value
+    - removed: [key] for series that disappeared
+    - metadata: {sample name: (family name, type, documentation)}
+    """
+
+    def __init__(self, module, timestamp, samples, changed, removed, metadata):
+        self.module = module
+        self.timestamp = timestamp
+        self.samples = samples
+        self.changed = changed
+        self.removed = removed
+        self.metadata = metadata
+
+    def __bool__(self):
+        return bool(self.changed or self.removed)
+
+
+def add_listener(listener):
+    """Call `listener(update)` after every module update that changed something
+
+    Listeners run on the module's processing thread and must return quickly.
+    """
+    with _listeners_lock:
+        _listeners.append(listener)
+
+
+def remove_listener(listener):
+    with _listeners_lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+        if not _listeners:
+            # Updates stop being tracked, the next listener starts from a full diff
+            with _last_lock:
+                _last_samples.clear()
+
+
+def _same(a, b):
+    return a == b or (math.isnan(a) and math.isnan(b))
+
+
+def collect_samples(module):
+    """Return ({key: value}, metadata) for every sample a module currently exposes"""
+    samples = {}
+    metadata = {}
+    for collector in module_collectors(module):
+        for family in collector.collect():
+            for sample in family.samples:
+                # Creation timestamps never change and aren't worth sending
+                if sample.name.endswith('_created'):
+                    continue
+                samples[(sample.name, tuple(sorted(sample.labels.items())))] = sample.value
+                metadata[sample.name] = (family.name, family.type, family.documentation)
+    return samples, metadata
+
+
+def _notify(update):
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        try:
+            listener(update)
+        except Exception as e:
+            print(f"Error in update listener {listener!r}: {e}")
+
+
+def module_processed(module_name, module):
+    """Diff a module's samples against its previous update and notify listeners"""
+    if not _listeners:
+        return None
+    samples, metadata = collect_samples(module)
+    with _last_lock:
+        previous = _last_samples.get(module_name, {})
+        _last_samples[module_name] = samples
+    changed = [(key, value) for key, value in samples.items()
+               if key not in previous or not _same(previous[key], value)]
+    removed = [key for key in previous if key not in samples]
+    update = Update(module_name, time.time(), samples, changed, removed, metadata)
+    if update:
+        _notify(update)
+    return update
+
+
+def module_removed(module_name):
+    """Report every series of an unloaded module as removed"""
+    with _last_lock:
+        previous = _last_samples.pop(module_name, {})
+    if previous:
+        _notify(Update(module_name, time.time(), {}, [], list(previous), {}))
+
+
+def last_samples():
+    """Return {module name: {key: value}} as of each module's last update"""
+    with _last_lock:
+        return dict(_last_samples)
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from prometheus_client import Counter, Gauge
+
+from . import jsonstream, replay
+
+# Process-wide cache of upstream responses shared by metric and MCP modules
+UPSTREAM_CACHE_TTL = float(os.environ.get('UPSTREAM_CACHE_TTL', 60))
+UPSTREAM_CACHE_MAX_ENTRIES = int(os.environ.get('UPSTREAM_CACHE_MAX_ENTRIES', 256))
+# Read size for streamed responses
+UPSTREAM_STREAM_CHUNK_SIZE = int(os.environ.get('UPSTREAM_STREAM_CHUNK_SIZE', 65536))
+# Connections kept per upstream host, the upper bound for concurrent fetches
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 32))
+
+upstream_cache_hits = Counter('exporter_upstream_cache_hits', 'Upstream requests served from the shared response cache', ['endpoint'])
+upstream_cache_misses = Counter('exporter_upstream_cache_misses', 'Upstream requests that had to be sent to the upstream', ['endpoint'])
+upstream_cache_revalidations = Counter('exporter_upstream_cache_revalidations', 'Expired cache entries confirmed unchanged by the upstream (HTTP 304)', ['endpoint'])
+upstream_cache_evictions = Counter('exporter_upstream_cache_evictions', 'Cache entries evicted to stay within UPSTREAM_CACHE_MAX_ENTRIES')
+upstream_cache_entries = Gauge('exporter_upstream_cache_entries', 'Number of responses held in the shared upstream cache')
+
+# Records upstream traffic when UPSTREAM_RECORD_PATH is set, see exporter/replay.py
+recorder = replay.Recorder(replay.UPSTREAM_RECORD_PATH) if replay.UPSTREAM_RECORD_PATH else None
+
+# Pooled connections shared by every upstream request
+session = requests.Session()
+if recorder is not None:
+    _adapter = replay.RecordingAdapter(recorder, pool_connections=UPSTREAM_POOL_SIZE, pool_maxsize=UPSTREAM_POOL_SIZE)
+else:
+    _adapter = requests.adapters.HTTPAdapter(pool_connections=UPSTREAM_POOL_SIZE, pool_maxsize=UPSTREAM_POOL_SIZE)
+session.mount('http://', _adapter)
+session.mount('https://', _adapter)
+
+
+class CachedResponse:
+    """An upstream response that can be shared between callers
+
+    The decoded JSON document is parsed once and shared, so callers must
+    treat it as read-only.
+    """
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.etag = headers.get('ETag')
+        self.last_modified = headers.get('Last-Modified')
+        # When the upstream last confirmed this response, each caller decides how old is too old
+        self.fetched = 0.0
+        self._json = None
+        self._json_lock = threading.Lock()
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        """Decode the body once and return the shared document"""
+        if self._json is None:
+            with self._json_lock:
+                if self._json is None:
+                    self._json = json.loads(self.content)
+        return self._json
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# key -> [lock, callers using it], so concurrent callers for the same
+# request share a single fetch; dropped once its last caller is done
+_key_locks = {}
+
+
+def endpoint_label(url):
+    """Metric label for an upstream URL (host and path, never the query string)"""
+    parts = urlsplit(url)
+    return f"{parts.netloc}{parts.path}"
+
+
+def cache_key(url, params=None, headers=None, auth=None):
+    """Key a request by URL, params, headers and auth identity without retaining secrets
+
+    Every request header is part of the key, since Accept, credentials and
+    the like can change the response.
+    """
+    identity = {
+        'url': url,
+        'params': sorted((params or {}).items()),
+        'headers': sorted((k.lower(), v) for k, v in (headers or {}).items()),
+        'auth': repr(auth) if auth else None,
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+@contextmanager
+def _single_flight(key):
+    """Hold the lock of a key, removing it when no other caller uses it"""
+    with _cache_lock:
+        entry = _key_locks.get(key)
+        if entry is None:
+            entry = _key_locks[key] = [threading.Lock(), 0]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _cache_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _key_locks[key]
+
+
+def _store(key, response):
+    with _cache_lock:
+        _cache[key] = response
+        _cache.move_to_end(key)
+        while len(_cache) > UPSTREAM_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+            upstream_cache_evictions.inc()
+        upstream_cache_entries.set(len(_cache))
+
+
+def get(url, params=None, headers=None, auth=None, timeout=10, ttl=None):
+    """GET an upstream URL through the shared response cache
+
+    A cached response is returned while it is younger than `ttl` seconds
+    (UPSTREAM_CACHE_TTL by default), so `ttl=0` always asks the upstream.
+    Older entries with an ETag or Last-Modified header are revalidated with
+    a conditional request. Non-200 responses are returned but never cached.
+    Network errors propagate to the caller.
+    """
+    ttl = replay.scaled(UPSTREAM_CACHE_TTL if ttl is None else ttl)
+    key = cache_key(url, params, headers, auth)
+    endpoint = endpoint_label(url)
+
+    with _single_flight(key):
+        with _cache_lock:
+            cached = _cache.get(key)
+            if cached is not None:
+                _cache.move_to_end(key)
+        now = time.time()
+        if cached is not None and now - cached.fetched < ttl:
+            upstream_cache_hits.labels(endpoint=endpoint).inc()
+            return cached
+
+        request_headers = dict(headers or {})
+        if cached is not None:
+            if cached.etag:
+                request_headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                request_headers['If-Modified-Since'] = cached.last_modified
+
+        response = session.get(url, params=params, headers=request_headers, auth=auth, timeout=timeout)
+        if response.status_code == 304 and cached is not None:
+            upstream_cache_revalidations.labels(endpoint=endpoint).inc()
+            cached.fetched = time.time()
+            return cached
+
+        upstream_cache_misses.labels(endpoint=endpoint).inc()
+        result = CachedResponse(response.status_code, response.headers, response.content)
+        if response.status_code == 200:
+            result.fetched = time.time()
+            _store(key, result)
+        return result
+
+
+def stream_items(url, path=(), params=None, headers=None, auth=None, timeout=10):
+    """Stream the elements of the JSON array at `path` from an upstream response
+
+    The body is parsed incrementally while it downloads, so memory stays
+    flat however large the payload is. Streamed responses bypass the cache.
+    Raises RuntimeError for non-200 responses.
+    """
+    with session.get(url, params=params, headers=headers, auth=auth, timeout=timeout, stream=True) as response:
+        upstream_cache_misses.labels(endpoint=endpoint_label(url)).inc()
+        if response.status_code != 200:
+            raise RuntimeError(f"{endpoint_label(url)} returned HTTP {response.status_code}")
+        chunks = response.iter_content(chunk_size=UPSTREAM_STREAM_CHUNK_SIZE)
+        yield from jsonstream.iter_items(chunks, tuple(path))
+
+
+def clear():
+    """Drop every cached response"""
+    with _cache_lock:
+        _cache.clear()
+        upstream_cache_entries.set(0)
@@ -0,0 +1,38 @@
+from . import upstream
+
+# ZStack available-hosts metrics API, shared by the single-cluster metric
+# module, its MCP tools and the multi-target prober.
+
+# ZStack API fields and the Prometheus metric each one is exported as
+ZSTACK_FIELDS = {
+    'availableHostCount': ('zstack_availableHostCount', 'Number of available hosts in ZStack'),
+    'totalMemoryCapacity': ('zstack_totalMemoryCapacity', 'Total memory capacity in ZStack (bytes)'),
+    'totalCpuCapacity': ('zstack_totalCpuCapacity', 'Total CPU capacity in ZStack'),
+    'availableCpuCapacity': ('zstack_availableCpuCapacity', 'Available CPU capacity in ZStack'),
+    'availableMemoryCapacity': ('zstack_availableMemoryCapacity', 'Available memory capacity in ZStack (bytes)'),
+    'primaryStorageTotalCapacity': ('zstack_primaryStorageTotalCapacity', 'Total primary storage capacity in ZStack (bytes)'),
+    'primaryStorageAvailableCapacity': ('zstack_primaryStorageAvailableCapacity', 'Available primary storage capacity in ZStack (bytes)'),
+    'totalHostCount': ('zstack_totalHostCount', 'Total number of hosts in ZStack'),
+    'totalVmCount': ('zstack_totalVmCount', 'Total number of VMs in ZStack'),
+    'runningVmCount': ('zstack_runningVmCount', 'Number of running VMs in ZStack'),
+}
+
+
+def fetch_available_hosts_metrics(api_url, api_key, timeout=10, ttl=None):
+    """Fetch the available-hosts metrics of one cluster through the upstream cache
+
+    Returns the API's `data` object. Raises RuntimeError when the API
+    answers with an error; network errors propagate.
+    """
+    response = upstream.get(api_url, params={'apikey': api_key}, timeout=timeout, ttl=ttl)
+    if response.status_code != 200:
+        raise RuntimeError(f"ZStack API request failed with status code: {response.status_code}")
+    data = response.json()
+    if not data.get('success'):
+        raise RuntimeError(f"ZStack API returned error: {data.get('message', 'Unknown error')}")
+    return data.get('data', {})
+
+
+def metric_values(data):
+    """Map an API `data` object to {metric name: value}"""
+    return {name: data.get(field, 0) for field, (name, _) in ZSTACK_FIELDS.items()}
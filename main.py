@@ -1,19 +1,40 @@
 import importlib
+import sys
 import time
 import threading
 import os
 import contextlib
 from dotenv import load_dotenv
-from fastapi import FastAPI
-from prometheus_client import make_asgi_app
+import hmac
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from prometheus_client.exposition import choose_encoder
+from starlette.concurrency import run_in_threadpool
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Imported after load_dotenv() since these modules read their settings at import time
+from exporter import accounting, admission, cardinality, declarative, federation, instrumentation, mcp_index, profiling, probe, push, replay, rules, scrape, snapshot, subscriptions, updates, upstream
+from exporter.collectors import module_collectors, unregister_collectors
+
 METRICS_REFRESH_INTERVAL = int(os.environ.get('METRICS_REFRESH_INTERVAL', 10))
 
+# Snapshot of last-known metric values used for warm restarts (empty path disables it)
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', 'metrics_snapshot.bin')
+SNAPSHOT_INTERVAL = int(os.environ.get('SNAPSHOT_INTERVAL', 60))
+
+# Index MCP modules and import each one on its first call instead of at startup
+MCP_LAZY_LOADING = os.environ.get('MCP_LAZY_LOADING', 'true').lower() in ('1', 'true', 'yes')
+# Cached tool, resource and prompt definitions of indexed modules (empty path keeps them in memory only)
+MCP_INDEX_PATH = os.environ.get('MCP_INDEX_PATH', 'mcp_index.json')
+mcp_manifest = mcp_index.Manifest(MCP_INDEX_PATH)
+
+# Token for the /debug profiling endpoints (empty disables them)
+DEBUG_TOKEN = os.environ.get('DEBUG_TOKEN', '')
+
 # Import MCP server
 from mcps import mcp
 
@@ -31,25 +52,54 @@ def load_mcp_modules():
 
     print(f"load_mcp_modules, loaded_mcps: {loaded_mcps}, current_files: {current_files}")
     
-    # Remove modules that no longer exist
+    # Remove modules that no longer exist, along with everything they registered
     to_remove = [mcp_name for mcp_name in loaded_mcps if f"{mcp_name}.py" not in current_files]
     with lock:
         for mcp_name in to_remove:
-            del loaded_mcps[mcp_name]
+            loaded_mcps.pop(mcp_name).unregister()
             print(f"MCP module {mcp_name} removed, loaded_mcps: {loaded_mcps}")
 
     # Load new modules
     for filename in current_files:
         if filename.endswith(".py") and filename != '__init__.py':
             module_name = filename[:-3]
-            if module_name not in loaded_mcps:
+            if module_name not in loaded_mcps and not accounting.is_disabled('mcp', module_name):
+                mcp_module = mcp_index.McpModule(mcp, f'mcps.{module_name}', os.path.join(mcps_directory, filename), mcp_manifest)
                 try:
-                    module = importlib.import_module(f'mcps.{module_name}')
-                    loaded_mcps[module_name] = module
-                    print(f"MCP module {module_name} loaded, loaded_mcps: {loaded_mcps}")
+                    components = mcp_module.register(lazy=MCP_LAZY_LOADING)
+                    loaded_mcps[module_name] = mcp_module
+                    if mcp_module.module is None:
+                        print(f"MCP module {module_name} indexed with {len(components)} components, import deferred to first use")
+                    else:
+                        print(f"MCP module {module_name} loaded with {len(components)} components, loaded_mcps: {loaded_mcps}")
                 except Exception as e:
                     print(f"Error loading MCP module {module_name}: {e}")
 
+    try:
+        mcp_manifest.save()
+    except OSError as e:
+        print(f"Error saving MCP manifest {MCP_INDEX_PATH}: {e}")
+
+def reload_mcp_module(filename):
+    """Re-register a changed MCP module, keeping its previous registrations if that fails"""
+    module_name = filename[:-3]
+    mcp_module = loaded_mcps.get(module_name)
+    if mcp_module is None:
+        # A module disabled for crossing a hard limit is retried once its file changes
+        accounting.enable('mcp', module_name)
+        load_mcp_modules()
+        return
+    try:
+        components = mcp_module.reload(lazy=MCP_LAZY_LOADING)
+        if components is not None:
+            print(f"MCP module {module_name} reloaded with {len(components)} components, registry version {mcp_index.registry_version}")
+    except Exception as e:
+        print(f"Error reloading MCP module {module_name}, keeping the previous version: {e}")
+    try:
+        mcp_manifest.save()
+    except OSError as e:
+        print(f"Error saving MCP manifest {MCP_INDEX_PATH}: {e}")
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -63,40 +113,95 @@ loaded_metrics = {}
 # Lock for thread safety
 lock = threading.Lock()
 
+def is_metric_file(filename):
+    """Return True for Python modules and declarative collector specs in the metrics directory"""
+    if filename == '__init__.py':
+        return False
+    return filename.endswith(".py") or filename.endswith(declarative.SPEC_SUFFIXES)
+
+def metric_module_name(filename):
+    """Module name under which a metrics file is loaded"""
+    return os.path.splitext(filename)[0]
+
+def import_metric_module(filename):
+    """Import a Python metric module or compile a declarative collector spec"""
+    module_name = metric_module_name(filename)
+    if filename.endswith(".py"):
+        return importlib.import_module(f'metrics.{module_name}')
+    return declarative.load_collector(module_name, os.path.join(metrics_directory, filename))
+
 def load_metric_modules():
     """Load all modules from the metrics directory"""
     global loaded_metrics
     
     # Get all files in the metrics directory
     current_files = set(os.listdir(metrics_directory))
+    current_modules = {metric_module_name(filename) for filename in current_files if is_metric_file(filename)}
 
     print(f"load_metric_modules, loaded_metrics: {loaded_metrics}, current_files: {current_files}")
     
     # Remove modules that no longer exist
-    to_remove = [metric_name for metric_name in loaded_metrics if f"{metric_name}.py" not in current_files]
+    to_remove = [metric_name for metric_name in loaded_metrics if metric_name not in current_modules]
     with lock:
         for metric_name in to_remove:
-            del loaded_metrics[metric_name]
+            module = loaded_metrics.pop(metric_name)
+            if hasattr(module, 'close'):
+                module.close()
+            forget_initial_delay(metric_name)
+            rules.module_removed(metric_name)
+            updates.module_removed(metric_name)
             print(f"Module {metric_name} removed, loaded_metrics: {loaded_metrics}")
 
     # Load new modules
     for filename in current_files:
-        if filename.endswith(".py") and filename != '__init__.py':
-            module_name = filename[:-3]
-            if module_name not in loaded_metrics:
+        if is_metric_file(filename):
+            module_name = metric_module_name(filename)
+            if module_name not in loaded_metrics and not accounting.is_disabled('metrics', module_name):
                 try:
-                    module = importlib.import_module(f'metrics.{module_name}')
+                    module = import_metric_module(filename)
+                    cardinality.limit_module(module_name, module)
                     loaded_metrics[module_name] = module
                     refresh_interval = getattr(module, 'REFRESH_INTERVAL', METRICS_REFRESH_INTERVAL)
                     print(f"Module {module_name} loaded with refresh interval: {refresh_interval}s, loaded_metrics: {loaded_metrics}")
-                    if hasattr(module, 'process'):
+                    initial_delay = get_initial_delay(module_name, module)
+                    if hasattr(module, 'process') and initial_delay == 0:
                         print(f"Processing {module_name}")
-                        module.process()
+                        try:
+                            profiling.call(module_name, module.process)
+                            snapshot.mark_processed(module_name)
+                            rules.module_processed(module_name, module)
+                            updates.module_processed(module_name, module)
+                        except Exception as e:
+                            print(f"Error processing {module_name}: {e}")
                     # Start individual processing thread for this new module
-                    start_individual_metric_processing(module_name, module)
+                    start_individual_metric_processing(module_name, module, initial_delay)
                 except Exception as e:
                     print(f"Error loading {module_name}: {e}")
 
+# Seconds to wait before the first process() of each module restored from the snapshot
+metric_initial_delays = {}
+
+def get_initial_delay(metric_name, metric_module):
+    """Restore a module's gauges from the snapshot and return how long its first process() can wait"""
+    if metric_name not in metric_initial_delays:
+        delay = 0
+        if SNAPSHOT_PATH:
+            age = snapshot.restore_module(metric_name, metric_module)
+            refresh_interval = getattr(metric_module, 'REFRESH_INTERVAL', METRICS_REFRESH_INTERVAL)
+            if age is not None and age < refresh_interval:
+                delay = refresh_interval - age
+                print(f"Restored {metric_name} from snapshot ({age:.0f}s old), next processing in {delay:.0f}s")
+        metric_initial_delays[metric_name] = delay
+    return metric_initial_delays[metric_name]
+
+def forget_initial_delay(metric_name):
+    """Process a removed or disabled module right away when it is loaded again
+
+    The snapshot only describes the first load after startup, a module
+    re-created or re-enabled later starts from fresh gauges.
+    """
+    metric_initial_delays[metric_name] = 0
+
 def process_metrics():
     """
     Process all loaded metrics once (used during initial loading)
@@ -113,10 +218,13 @@ def process_metrics():
             except Exception as e:
                 print(f"Error processing {metric_name}: {e}")
 
-def start_individual_metric_processing(metric_name, metric_module):
+def start_individual_metric_processing(metric_name, metric_module, initial_delay=0):
     """Start processing a specific metric in its own background thread with its own refresh interval"""
     def individual_process_loop():
-        while True:
+        # Values restored from the snapshot are still fresh, so skip the immediate re-poll
+        time.sleep(replay.scaled(initial_delay))
+        # Stop once the module has been unloaded or replaced
+        while loaded_metrics.get(metric_name) is metric_module:
             try:
                 # Get the module's refresh interval or use the global default
                 refresh_interval = getattr(metric_module, 'REFRESH_INTERVAL', METRICS_REFRESH_INTERVAL)
@@ -124,15 +232,19 @@ def start_individual_metric_processing(metric_name, metric_module):
                 if hasattr(metric_module, 'process'):
                     print(f"Processing {metric_name} (refresh: {refresh_interval}s)")
                     with lock:
-                        metric_module.process()
+                        profiling.call(metric_name, metric_module.process)
+                    snapshot.mark_processed(metric_name)
+                    rules.module_processed(metric_name, metric_module)
+                    updates.module_processed(metric_name, metric_module)
                 
                 # Sleep for this metric's specific refresh interval
-                time.sleep(refresh_interval)
+                time.sleep(replay.scaled(refresh_interval))
             except Exception as e:
                 print(f"Error processing {metric_name}: {e}")
-                time.sleep(METRICS_REFRESH_INTERVAL)  # Use default interval on error
+                time.sleep(replay.scaled(METRICS_REFRESH_INTERVAL))  # Use default interval on error
     
-    thread = threading.Thread(target=individual_process_loop)
+    # Named after the module so stack samples can be attributed to it
+    thread = threading.Thread(target=individual_process_loop, name=f"metrics-{metric_name}")
     thread.daemon = True
     thread.start()
     print(f"Started processing thread for {metric_name} with refresh interval: {getattr(metric_module, 'REFRESH_INTERVAL', METRICS_REFRESH_INTERVAL)}s")
@@ -142,18 +254,34 @@ class MetricFileEventHandler(FileSystemEventHandler):
     
     def on_created(self, event):
         """When a file is created, load the module"""
-        if event.src_path.endswith(".py"):
+        if is_metric_file(os.path.basename(event.src_path)):
             print(f"Detected new metric file: {event.src_path}, loading...")
             load_metric_modules()
 
     def on_deleted(self, event):
         """When a file is deleted, unload the module"""
-        if event.src_path.endswith(".py"):
+        if is_metric_file(os.path.basename(event.src_path)):
             print(f"Detected deleted metric file: {event.src_path}, reloading...")
             load_metric_modules()
 
+    def on_modified(self, event):
+        """When a disabled module's file changes, try loading it again"""
+        filename = os.path.basename(event.src_path)
+        module_name = metric_module_name(filename)
+        if not event.is_directory and is_metric_file(filename) and accounting.is_disabled('metrics', module_name):
+            print(f"Detected modified metric file: {event.src_path}, loading disabled module again...")
+            accounting.enable('metrics', module_name)
+            load_metric_modules()
+
 class McpFileEventHandler(FileSystemEventHandler):
     """Custom event handler for file system events in mcps directory"""
+
+    # Editors often write a file in several steps, so reload once it has been quiet this long
+    reload_delay = 0.5
+
+    def __init__(self):
+        super().__init__()
+        self.pending_reloads = {}
     
     def on_created(self, event):
         """When a file is created, load the module"""
@@ -167,6 +295,19 @@ class McpFileEventHandler(FileSystemEventHandler):
             print(f"Detected deleted MCP file: {event.src_path}, reloading...")
             load_mcp_modules()
 
+    def on_modified(self, event):
+        """When a file changes, re-register the module"""
+        filename = os.path.basename(event.src_path)
+        if not event.is_directory and filename.endswith(".py") and filename != '__init__.py':
+            print(f"Detected modified MCP file: {event.src_path}, reloading...")
+            pending = self.pending_reloads.pop(filename, None)
+            if pending is not None:
+                pending.cancel()
+            timer = threading.Timer(self.reload_delay, reload_mcp_module, args=(filename,))
+            timer.daemon = True
+            self.pending_reloads[filename] = timer
+            timer.start()
+
 def watch_directories():
     """Watch the metrics and mcps directories for changes"""
     # Set up metrics directory watching
@@ -191,11 +332,77 @@ def watch_directories():
     metrics_observer.join()
     mcps_observer.join()
 
-def start_metrics_processing():
-    """Start processing metrics in a background thread"""
-    # Start individual metric processing threads with their own refresh intervals
-    for metric_name, metric_module in loaded_metrics.items():
-        start_individual_metric_processing(metric_name, metric_module)
+def start_metric_modules():
+    """Load the metric modules at startup; each one gets its processing thread as it loads"""
+    load_metric_modules()
+    # Modules restored from the snapshot aren't processed yet
+    rules.refresh(loaded_metrics)
+
+def load_snapshot():
+    """Load the last-known metric values before the first collection"""
+    if not SNAPSHOT_PATH:
+        return
+    try:
+        count = snapshot.load(SNAPSHOT_PATH)
+        print(f"Loaded {count} series from snapshot {SNAPSHOT_PATH}")
+    except Exception as e:
+        print(f"Error loading snapshot {SNAPSHOT_PATH}: {e}")
+
+def start_snapshotting():
+    """Periodically save the last-known metric values in a background thread"""
+    if SNAPSHOT_PATH:
+        snapshot.start_periodic_save(SNAPSHOT_PATH, SNAPSHOT_INTERVAL, lambda: dict(loaded_metrics))
+
+def save_snapshot():
+    """Save the last-known metric values, e.g. on shutdown"""
+    if not SNAPSHOT_PATH:
+        return
+    try:
+        count = snapshot.save(SNAPSHOT_PATH, dict(loaded_metrics))
+        print(f"Saved {count} series to snapshot {SNAPSHOT_PATH}")
+    except Exception as e:
+        print(f"Error saving snapshot {SNAPSHOT_PATH}: {e}")
+
+def loaded_modules():
+    """Return [(kind, name, module)] for the loaded metric and MCP modules"""
+    modules = [('metrics', name, module) for name, module in list(loaded_metrics.items())]
+    # MCP modules only have a module object once imported
+    modules.extend(('mcp', name, mcp_module.module) for name, mcp_module in list(loaded_mcps.items()))
+    return modules
+
+def disable_module(kind, name):
+    """Unload a module that crossed a hard limit; it stays unloaded until its file changes"""
+    if kind == 'mcp':
+        with lock:
+            mcp_module = loaded_mcps.pop(name, None)
+            if mcp_module is not None:
+                mcp_module.unregister()
+        return
+    with lock:
+        module = loaded_metrics.pop(name, None)
+        if module is None:
+            return
+        if hasattr(module, 'close'):
+            module.close()
+        # Drop its series and the module itself so its memory can be reclaimed
+        unregister_collectors(module)
+        sys.modules.pop(f'metrics.{name}', None)
+        forget_initial_delay(name)
+        rules.module_removed(name)
+        updates.module_removed(name)
+
+def load_recording_rules():
+    """Load the recording rules evaluated after each module update"""
+    try:
+        count = rules.load(rules.RULES_PATH)
+        if count:
+            print(f"Loaded {count} recording rules from {rules.RULES_PATH}")
+    except Exception as e:
+        print(f"Error loading recording rules {rules.RULES_PATH}: {e}")
+
+def start_module_accounting():
+    """Measure module memory and series in a background thread, enforcing their limits"""
+    accounting.start_accounting(loaded_modules, disable_module)
 
 def start_directory_watching():
     """Start watching the metrics and mcps directories in a background thread"""
@@ -217,12 +424,27 @@ def start_directory_watching():
 @contextlib.asynccontextmanager
 async def custom_lifespan(app: FastAPI):
     # Startup logic
-    load_metric_modules()  # Load metrics modules
+    load_snapshot()        # Restore last-known values before the first collection
+    load_recording_rules()
+    start_metric_modules()  # Load metrics modules, each with its own processing thread
     load_mcp_modules()     # Load MCP modules
-    start_metrics_processing()
     start_directory_watching()
+    start_snapshotting()
+    start_module_accounting()
+    pusher = push.start_pushing(loaded_metrics)  # Push changed samples if PUSH_URL is set
+    prober = probe.start_probing()  # Poll the clusters of ZSTACK_TARGETS_PATH if set
+    federator = federation.start_federation(modules=metric_module_collectors)  # Merge downstream exporters if FEDERATION_TARGETS_PATH is set
     yield
-    # Shutdown logic (if any)
+    # Shutdown logic
+    if federator is not None:
+        federator.stop()
+    if prober is not None:
+        prober.stop()
+    if pusher is not None:
+        pusher.stop()
+    save_snapshot()
+    if upstream.recorder is not None:
+        upstream.recorder.close()
 
 # 合并两个lifespan：自定义的和mcp_app的
 @contextlib.asynccontextmanager
@@ -239,14 +461,138 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Duration, size and in-flight metrics of every request, per route and MCP method
+app.add_middleware(instrumentation.InstrumentationMiddleware, routes=app.router.routes, server=mcp)
+
 # Create and mount the MCP server
 # Use the correct path parameter to avoid redirection issues
 mcp_app = mcp.http_app(path="/")
-app.mount("/mcp", mcp_app)
 
-# Add prometheus asgi middleware to route /metrics requests
-metrics_app = make_asgi_app()
-app.mount("/metrics", metrics_app)
+def with_registry_version(asgi_app):
+    """Add the MCP registry version to every response, so clients know when to re-list"""
+    async def app_with_version(scope, receive, send):
+        if scope['type'] != 'http':
+            return await asgi_app(scope, receive, send)
+
+        async def send_with_version(message):
+            if message['type'] == 'http.response.start':
+                headers = list(message.get('headers', []))
+                headers.append((b'x-mcp-registry-version', str(mcp_index.registry_version).encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        await asgi_app(scope, receive, send_with_version)
+    return app_with_version
+
+# Requests beyond the in-flight cap queue, or are rejected with 429 once the queue is full
+app.mount("/mcp", admission.admitted(with_registry_version(mcp_app)))
+
+def metric_module_collectors():
+    """Map each loaded metric module, the recording rules and federated exporters to their collectors"""
+    modules = {name: module_collectors(module) for name, module in list(loaded_metrics.items())}
+    if rules.engine is not None:
+        modules[rules.RULES_MODULE] = [rules.engine]
+    if federation.federation is not None:
+        modules[federation.FEDERATION_MODULE] = [federation.federation]
+    return modules
+
+# Serve /metrics, with name[] and module[] parameters to scrape only part of it
+metrics_app = scrape.make_metrics_app(metric_module_collectors)
+app.mount("/metrics", admission.prioritized(metrics_app))
+
+@app.get("/probe")
+async def probe_target(request: Request, target: str = ''):
+    """Serve the cached metrics of one probed ZStack cluster"""
+    if not target:
+        raise HTTPException(status_code=400, detail="target is required")
+    collector = probe.collector(target)
+    if collector is None:
+        raise HTTPException(status_code=404, detail=f"Unknown target {target}")
+    encoder, content_type = choose_encoder(request.headers.get('accept', ''))
+    return Response(encoder(collector), media_type=content_type)
+
+@app.get("/subscribe")
+async def subscribe(request: Request):
+    """Stream changed series and threshold alerts as Server-Sent Events
+
+    Query parameters: `match[]` series selectors and `alert` conditions,
+    both repeatable, e.g. `?alert=zstack_availableHostCount<2`.
+    """
+    try:
+        subscription = subscriptions.Subscription(
+            request.query_params.getlist('match[]'),
+            request.query_params.getlist('alert'),
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return StreamingResponse(
+        subscription.stream(loaded_metrics),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def require_debug_token(request: Request):
+    """Allow debug requests carrying DEBUG_TOKEN as a bearer token"""
+    if not DEBUG_TOKEN:
+        raise HTTPException(status_code=404, detail="Debug endpoints are disabled, set DEBUG_TOKEN")
+    token = request.headers.get('authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid debug token")
+
+debug = APIRouter(prefix="/debug", dependencies=[Depends(require_debug_token)])
+
+@debug.get("/stacks", response_class=PlainTextResponse)
+async def debug_stacks(seconds: float = 10, interval: float = 0.01, thread: str = ''):
+    """Sample all thread stacks and return them in collapsed-stack format"""
+    if not (seconds > 0 and interval > 0):
+        raise HTTPException(status_code=400, detail="seconds and interval must be greater than 0")
+    return await run_in_threadpool(profiling.sample_stacks, seconds, interval, thread)
+
+@debug.post("/profile/{module_name}")
+async def debug_profile_arm(module_name: str, calls: int = 1):
+    """Profile the next `calls` process() calls of a metric module"""
+    if calls < 1:
+        raise HTTPException(status_code=400, detail="calls must be at least 1")
+    if module_name not in loaded_metrics:
+        raise HTTPException(status_code=404, detail=f"Metric module {module_name} is not loaded")
+    return profiling.arm(module_name, calls).status()
+
+@debug.get("/profile/{module_name}", response_class=PlainTextResponse)
+async def debug_profile_report(module_name: str, sort: str = 'cumulative', limit: int = 50):
+    """Return the cProfile report of a module, once its profiled calls are done"""
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    profile = profiling.profile(module_name)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"No profile armed for {module_name}")
+    if profile.remaining > 0:
+        raise HTTPException(status_code=409, detail=f"{profile.remaining} of {profile.calls} calls still to profile")
+    return profile.report(sort, limit)
+
+@debug.post("/tracemalloc/start")
+async def debug_tracemalloc_start(frames: int = 1):
+    """Start tracing allocations, keeping `frames` frames of each allocation's traceback"""
+    if frames < 1:
+        raise HTTPException(status_code=400, detail="frames must be at least 1")
+    return profiling.start_tracemalloc(frames)
+
+@debug.post("/tracemalloc/stop")
+async def debug_tracemalloc_stop():
+    return profiling.stop_tracemalloc()
+
+@debug.post("/tracemalloc/snapshot")
+async def debug_tracemalloc_snapshot(group_by: str = 'lineno', limit: int = 25):
+    """Take a snapshot and return the top allocations and the diff with the previous snapshot"""
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    try:
+        return await run_in_threadpool(profiling.take_snapshot, group_by, limit)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+app.include_router(debug)
 
 @app.get("/")
 async def root():
@@ -255,7 +601,9 @@ async def root():
         "message": "Prometheus Custom Exporter with MCP",
         "endpoints": {
             "metrics": "/metrics",
-            "mcp": "/mcp"
+            "mcp": "/mcp",
+            "probe": "/probe",
+            "subscribe": "/subscribe"
         }
     }
 
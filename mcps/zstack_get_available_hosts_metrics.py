@@ -1,27 +1,66 @@
 from . import mcp
 import json
+import math
+from exporter import rules
 from metrics.zstack_get_available_hosts_metrics import (
-    zstack_available_host_count,
-    zstack_total_memory_capacity,
-    zstack_total_cpu_capacity,
-    zstack_available_cpu_capacity,
-    zstack_available_memory_capacity,
-    zstack_primary_storage_total_capacity,
-    zstack_primary_storage_available_capacity,
-    zstack_total_host_count,
-    zstack_total_vm_count,
-    zstack_running_vm_count,
-    fetch_zstack_metrics
+    ZSTACK_FIELDS,
+    zstack_metrics,
+    fetch_zstack_metrics,
+    publish_zstack_metrics
 )
 
+# One refresh at a time, each given up after 30s (see exporter/offload.py)
+TOOL_LIMITS = {
+    'refresh_zstack_metrics': {'concurrency': 1, 'timeout': 30},
+}
+
+# Metric names, e.g. zstack_available_host_count = 'zstack_availableHostCount'
+zstack_available_host_count = ZSTACK_FIELDS['availableHostCount'][0]
+zstack_total_memory_capacity = ZSTACK_FIELDS['totalMemoryCapacity'][0]
+zstack_total_cpu_capacity = ZSTACK_FIELDS['totalCpuCapacity'][0]
+zstack_available_cpu_capacity = ZSTACK_FIELDS['availableCpuCapacity'][0]
+zstack_available_memory_capacity = ZSTACK_FIELDS['availableMemoryCapacity'][0]
+zstack_primary_storage_total_capacity = ZSTACK_FIELDS['primaryStorageTotalCapacity'][0]
+zstack_primary_storage_available_capacity = ZSTACK_FIELDS['primaryStorageAvailableCapacity'][0]
+zstack_total_host_count = ZSTACK_FIELDS['totalHostCount'][0]
+zstack_total_vm_count = ZSTACK_FIELDS['totalVmCount'][0]
+zstack_running_vm_count = ZSTACK_FIELDS['runningVmCount'][0]
+
 # Helper function to get metric value
 def get_metric_value(metric):
-    """Get the current value of a Prometheus metric"""
+    """Get the current value of a ZStack metric from the latest published generation"""
     try:
-        return metric._value.get()
+        return zstack_metrics.value(metric)
     except Exception as e:
         return f"Error retrieving metric: {str(e)}"
 
+def read_zstack_metrics(generation=None) -> dict:
+    """Read all ZStack metrics from a single published generation, the latest by default"""
+    values = (generation or zstack_metrics.current()).values
+    return {
+        field: values[name].get((), 0.0)
+        for field, (name, _) in ZSTACK_FIELDS.items()
+    }
+
+def usage_percent(record, total, available, generation):
+    """Usage percentage recorded by a rule in rules.json from the given generation
+
+    Computed here from `total` and `available` if the rule isn't loaded or
+    hasn't been evaluated on that generation yet.
+    """
+    ratio = rules.value(record, generation=generation)
+    if not math.isfinite(ratio):
+        ratio = (total - available) / total if total > 0 else 0
+    return ratio * 100
+
+def read_usage_percents(metrics, generation) -> dict:
+    """CPU, memory and storage usage percentages of `metrics`, read from `generation`"""
+    return {
+        "cpu": usage_percent("zstack_cpuUsageRatio", metrics["totalCpuCapacity"], metrics["availableCpuCapacity"], generation),
+        "memory": usage_percent("zstack_memoryUsageRatio", metrics["totalMemoryCapacity"], metrics["availableMemoryCapacity"], generation),
+        "storage": usage_percent("zstack_primaryStorageUsageRatio", metrics["primaryStorageTotalCapacity"], metrics["primaryStorageAvailableCapacity"], generation),
+    }
+
 # Tool to get all ZStack metrics
 @mcp.tool("get_zstack_metrics")
 def get_zstack_metrics() -> dict:
@@ -31,18 +70,7 @@ def get_zstack_metrics() -> dict:
     Returns:
         A dictionary containing all ZStack metrics
     """
-    return {
-        "availableHostCount": get_metric_value(zstack_available_host_count),
-        "totalMemoryCapacity": get_metric_value(zstack_total_memory_capacity),
-        "totalCpuCapacity": get_metric_value(zstack_total_cpu_capacity),
-        "availableCpuCapacity": get_metric_value(zstack_available_cpu_capacity),
-        "availableMemoryCapacity": get_metric_value(zstack_available_memory_capacity),
-        "primaryStorageTotalCapacity": get_metric_value(zstack_primary_storage_total_capacity),
-        "primaryStorageAvailableCapacity": get_metric_value(zstack_primary_storage_available_capacity),
-        "totalHostCount": get_metric_value(zstack_total_host_count),
-        "totalVmCount": get_metric_value(zstack_total_vm_count),
-        "runningVmCount": get_metric_value(zstack_running_vm_count)
-    }
+    return read_zstack_metrics()
 
 # Tool to refresh ZStack metrics
 @mcp.tool("refresh_zstack_metrics")
@@ -53,12 +81,21 @@ def refresh_zstack_metrics() -> dict:
     Returns:
         The newly fetched metrics or an error message
     """
-    metrics_data = fetch_zstack_metrics()
+    # Bypass the upstream cache, a refresh that returns the cached response refreshes nothing
+    metrics_data = fetch_zstack_metrics(ttl=0)
     if metrics_data:
+        publish_zstack_metrics(metrics_data)
         return metrics_data
     else:
         return {"error": "Failed to fetch ZStack metrics"}
 
+# Tool to get the usage percentages recorded after each ZStack update
+@mcp.tool("get_zstack_usage")
+def get_zstack_usage() -> dict:
+    """Get the CPU, memory and primary storage usage percentages of ZStack"""
+    generation = zstack_metrics.current()
+    return read_usage_percents(read_zstack_metrics(generation), generation)
+
 # Individual metric tools
 @mcp.tool("get_zstack_available_host_count")
 def get_available_host_count() -> int:
@@ -114,7 +151,7 @@ def get_running_vm_count() -> int:
 @mcp.resource("zstack://metrics")
 def zstack_metrics_resource() -> str:
     """Get all ZStack metrics as a formatted JSON string"""
-    metrics = get_zstack_metrics()
+    metrics = read_zstack_metrics()
     return json.dumps(metrics, indent=2)
 
 @mcp.resource("zstack://availableHostCount")
@@ -179,12 +216,14 @@ def running_vm_count_resource() -> str:
 @mcp.prompt("zstack_status_report")
 def zstack_status_report() -> str:
     """Generate a status report for ZStack"""
-    metrics = get_zstack_metrics()
+    generation = zstack_metrics.current()
+    metrics = read_zstack_metrics(generation)
     
-    # Calculate percentages
-    cpu_usage_percent = ((metrics["totalCpuCapacity"] - metrics["availableCpuCapacity"]) / metrics["totalCpuCapacity"]) * 100 if metrics["totalCpuCapacity"] > 0 else 0
-    memory_usage_percent = ((metrics["totalMemoryCapacity"] - metrics["availableMemoryCapacity"]) / metrics["totalMemoryCapacity"]) * 100 if metrics["totalMemoryCapacity"] > 0 else 0
-    storage_usage_percent = ((metrics["primaryStorageTotalCapacity"] - metrics["primaryStorageAvailableCapacity"]) / metrics["primaryStorageTotalCapacity"]) * 100 if metrics["primaryStorageTotalCapacity"] > 0 else 0
+    # Usage percentages come from the recording rules
+    usage = read_usage_percents(metrics, generation)
+    cpu_usage_percent = usage["cpu"]
+    memory_usage_percent = usage["memory"]
+    storage_usage_percent = usage["storage"]
     
     return f"""
 # ZStack Status Report
@@ -215,12 +254,14 @@ def zstack_alert_check(cpu_threshold: float = 80.0, memory_threshold: float = 80
     Returns:
         Alert messages for any metrics exceeding thresholds
     """
-    metrics = get_zstack_metrics()
+    generation = zstack_metrics.current()
+    metrics = read_zstack_metrics(generation)
     
-    # Calculate percentages
-    cpu_usage_percent = ((metrics["totalCpuCapacity"] - metrics["availableCpuCapacity"]) / metrics["totalCpuCapacity"]) * 100 if metrics["totalCpuCapacity"] > 0 else 0
-    memory_usage_percent = ((metrics["totalMemoryCapacity"] - metrics["availableMemoryCapacity"]) / metrics["totalMemoryCapacity"]) * 100 if metrics["totalMemoryCapacity"] > 0 else 0
-    storage_usage_percent = ((metrics["primaryStorageTotalCapacity"] - metrics["primaryStorageAvailableCapacity"]) / metrics["primaryStorageTotalCapacity"]) * 100 if metrics["primaryStorageTotalCapacity"] > 0 else 0
+    # Usage percentages come from the recording rules
+    usage = read_usage_percents(metrics, generation)
+    cpu_usage_percent = usage["cpu"]
+    memory_usage_percent = usage["memory"]
+    storage_usage_percent = usage["storage"]
     
     alerts = []
     
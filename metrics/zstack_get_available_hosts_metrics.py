@@ -1,9 +1,11 @@
-import requests
 from prometheus_client import Gauge
 import json
 import time
 import os
 from dotenv import load_dotenv
+from exporter import zstack
+from exporter.atomic import AtomicGauges
+from exporter.zstack import ZSTACK_FIELDS
 
 load_dotenv()
 
@@ -16,44 +18,33 @@ ZSTACK_API_URL, ZSTACK_API_KEY = os.getenv("ZSTACK_API_URL"), os.getenv("ZSTACK_
 if not ZSTACK_API_URL or not ZSTACK_API_KEY:
     raise ValueError("Missing ZStack API URL or API key")
 
-# Define Prometheus metrics
-zstack_available_host_count = Gauge('zstack_availableHostCount', 'Number of available hosts in ZStack')
-zstack_total_memory_capacity = Gauge('zstack_totalMemoryCapacity', 'Total memory capacity in ZStack (bytes)')
-zstack_total_cpu_capacity = Gauge('zstack_totalCpuCapacity', 'Total CPU capacity in ZStack')
-zstack_available_cpu_capacity = Gauge('zstack_availableCpuCapacity', 'Available CPU capacity in ZStack')
-zstack_available_memory_capacity = Gauge('zstack_availableMemoryCapacity', 'Available memory capacity in ZStack (bytes)')
-zstack_primary_storage_total_capacity = Gauge('zstack_primaryStorageTotalCapacity', 'Total primary storage capacity in ZStack (bytes)')
-zstack_primary_storage_available_capacity = Gauge('zstack_primaryStorageAvailableCapacity', 'Available primary storage capacity in ZStack (bytes)')
-zstack_total_host_count = Gauge('zstack_totalHostCount', 'Total number of hosts in ZStack')
-zstack_total_vm_count = Gauge('zstack_totalVmCount', 'Total number of VMs in ZStack')
-zstack_running_vm_count = Gauge('zstack_runningVmCount', 'Number of running VMs in ZStack')
-
-# Last successful fetch time
-zstack_last_successful_fetch = Gauge('zstack_lastSuccessfulFetch', 'Timestamp of the last successful fetch from ZStack API')
+# Define Prometheus metrics, published together so readers never see a half-updated set
+zstack_metrics = AtomicGauges({
+    **{name: (description, []) for name, description in ZSTACK_FIELDS.values()},
+    # Last successful fetch time
+    'zstack_lastSuccessfulFetch': ('Timestamp of the last successful fetch from ZStack API', []),
+})
 
 # Fetch error counter
 zstack_fetch_errors = Gauge('zstack_fetchErrors', 'Number of errors encountered when fetching from ZStack API')
 
-def fetch_zstack_metrics():
-    """Fetch metrics from ZStack API"""
+def fetch_zstack_metrics(ttl=None):
+    """Fetch metrics from ZStack API (shared with other modules through the upstream cache)
+
+    A `ttl` of 0 skips the cached response and always asks the API.
+    """
     try:
-        params = {'apikey': ZSTACK_API_KEY}
-        response = requests.get(ZSTACK_API_URL, params=params, timeout=10)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('success'):
-                return data.get('data', {})
-            else:
-                print(f"ZStack API returned error: {data.get('message', 'Unknown error')}")
-                return None
-        else:
-            print(f"ZStack API request failed with status code: {response.status_code}")
-            return None
+        return zstack.fetch_available_hosts_metrics(ZSTACK_API_URL, ZSTACK_API_KEY, timeout=10, ttl=ttl)
     except Exception as e:
         print(f"Error fetching ZStack metrics: {e}")
         return None
 
+def publish_zstack_metrics(metrics_data):
+    """Publish all metrics, including the fetch time, as one generation"""
+    values = zstack.metric_values(metrics_data)
+    values['zstack_lastSuccessfulFetch'] = time.time()
+    zstack_metrics.publish(values)
+
 def process():
     """Process ZStack metrics and update Prometheus gauges"""
     print("ZStack metrics processing...")
@@ -62,20 +53,7 @@ def process():
     metrics_data = fetch_zstack_metrics()
     
     if metrics_data:
-        # Update all metrics
-        zstack_available_host_count.set(metrics_data.get('availableHostCount', 0))
-        zstack_total_memory_capacity.set(metrics_data.get('totalMemoryCapacity', 0))
-        zstack_total_cpu_capacity.set(metrics_data.get('totalCpuCapacity', 0))
-        zstack_available_cpu_capacity.set(metrics_data.get('availableCpuCapacity', 0))
-        zstack_available_memory_capacity.set(metrics_data.get('availableMemoryCapacity', 0))
-        zstack_primary_storage_total_capacity.set(metrics_data.get('primaryStorageTotalCapacity', 0))
-        zstack_primary_storage_available_capacity.set(metrics_data.get('primaryStorageAvailableCapacity', 0))
-        zstack_total_host_count.set(metrics_data.get('totalHostCount', 0))
-        zstack_total_vm_count.set(metrics_data.get('totalVmCount', 0))
-        zstack_running_vm_count.set(metrics_data.get('runningVmCount', 0))
-        
-        # Update last successful fetch time
-        zstack_last_successful_fetch.set(time.time())
+        publish_zstack_metrics(metrics_data)
         print("ZStack metrics updated successfully")
     else:
         # Increment error counter
@@ -0,0 +1,263 @@
+from prometheus_client import Gauge
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import sys
+import time
+import os
+from dotenv import load_dotenv
+from exporter import upstream
+from exporter.compact import CompactGauges
+
+load_dotenv()
+
+# Per-host, per-VM and per-primary-storage metrics from the ZStack inventory API
+REFRESH_INTERVAL = int(os.getenv("ZSTACK_INVENTORY_REFRESH_INTERVAL", 300))
+
+# Inventory API base URL (e.g. http://zstack:8080/zstack/v1) and credentials
+ZSTACK_INVENTORY_API_URL = os.getenv("ZSTACK_INVENTORY_API_URL")
+ZSTACK_API_KEY = os.getenv("ZSTACK_API_KEY")
+ZSTACK_SESSION_ID = os.getenv("ZSTACK_SESSION_ID")
+if not ZSTACK_INVENTORY_API_URL or not (ZSTACK_API_KEY or ZSTACK_SESSION_ID):
+    raise ValueError("Missing ZStack inventory API URL or credentials")
+
+# Paging and fan-out
+ZSTACK_PAGE_SIZE = int(os.getenv("ZSTACK_PAGE_SIZE", 1000))
+ZSTACK_FETCH_CONCURRENCY = int(os.getenv("ZSTACK_FETCH_CONCURRENCY", 8))
+# Changed-only queries are used between full resyncs
+ZSTACK_FULL_RESYNC_INTERVAL = int(os.getenv("ZSTACK_FULL_RESYNC_INTERVAL", 3600))
+
+# Inventory definitions: API resource, labels, and exported fields
+INVENTORIES = {
+    'host': {
+        'resource': 'hosts',
+        'labels': {'uuid': 'uuid', 'name': 'name', 'cluster_uuid': 'clusterUuid'},
+        'fields': {
+            'totalCpuCapacity': 'Total CPU capacity of the host',
+            'availableCpuCapacity': 'Available CPU capacity of the host',
+            'totalMemoryCapacity': 'Total memory capacity of the host (bytes)',
+            'availableMemoryCapacity': 'Available memory capacity of the host (bytes)',
+        },
+        'states': {
+            'connected': ('status', 'Connected', 'Whether the host is connected (1) or not (0)'),
+            'enabled': ('state', 'Enabled', 'Whether the host is enabled (1) or not (0)'),
+        },
+    },
+    'vm': {
+        'resource': 'vm-instances',
+        'labels': {'uuid': 'uuid', 'name': 'name', 'host_uuid': 'hostUuid'},
+        'fields': {
+            'cpuNum': 'Number of vCPUs of the VM',
+            'memorySize': 'Memory size of the VM (bytes)',
+        },
+        'states': {
+            'running': ('state', 'Running', 'Whether the VM is running (1) or not (0)'),
+        },
+    },
+    'primary_storage': {
+        'resource': 'primary-storage',
+        'labels': {'uuid': 'uuid', 'name': 'name', 'type': 'type'},
+        'fields': {
+            'totalCapacity': 'Total capacity of the primary storage (bytes)',
+            'availableCapacity': 'Available capacity of the primary storage (bytes)',
+            'totalPhysicalCapacity': 'Total physical capacity of the primary storage (bytes)',
+            'availablePhysicalCapacity': 'Available physical capacity of the primary storage (bytes)',
+        },
+        'states': {},
+    },
+}
+
+# Define Prometheus metrics, e.g. zstack_host_totalMemoryCapacity{uuid,name,cluster_uuid}
+# All per-entity families live in compact storage since there is one series per
+# VM and family; each run writes the changed entities in place
+inventory_families = {}
+family_definitions = {}
+for kind, inventory in INVENTORIES.items():
+    descriptions = dict(inventory['fields'])
+    descriptions.update({state: description for state, (_, _, description) in inventory['states'].items()})
+    for name, description in descriptions.items():
+        inventory_families[(kind, name)] = f'zstack_{kind}_{name}'
+        family_definitions[f'zstack_{kind}_{name}'] = (description, list(inventory['labels']))
+zstack_inventory_metrics = CompactGauges(family_definitions)
+# (family key, family name) pairs of each inventory kind
+kind_families = {kind: [(key, name) for key, name in inventory_families.items() if key[0] == kind] for kind in INVENTORIES}
+
+zstack_inventory_count = Gauge('zstack_inventory_count', 'Number of entities in each ZStack inventory', ['inventory'])
+zstack_inventory_requests = Gauge('zstack_inventory_lastRequests', 'Number of API requests made by the last inventory run', ['inventory'])
+zstack_inventory_last_successful_fetch = Gauge('zstack_inventory_lastSuccessfulFetch', 'Timestamp of the last successful inventory fetch', ['inventory'])
+zstack_inventory_fetch_errors = Gauge('zstack_inventory_fetchErrors', 'Number of errors encountered when fetching ZStack inventories', ['inventory'])
+
+# ZStack reports dates in several formats depending on the version
+DATE_FORMATS = ('%b %d, %Y %I:%M:%S %p', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S%z')
+
+
+def parse_date(value):
+    """Parse a ZStack inventory date, returning None if the format is unknown"""
+    if not value:
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    return None
+
+
+class InventoryState:
+    """Entities of one inventory kept between runs for changed-only queries
+
+    Only each entity's label values are kept, its values are in
+    zstack_inventory_metrics.
+    """
+
+    def __init__(self):
+        # uuid -> label values
+        self.entities = {}
+        self.last_op_date = None
+        self.last_full_sync = 0.0
+
+
+inventory_states = {kind: InventoryState() for kind in INVENTORIES}
+
+_executor = ThreadPoolExecutor(max_workers=ZSTACK_FETCH_CONCURRENCY, thread_name_prefix='zstack-inventory')
+
+
+def query(resource, params):
+    """Run one inventory query and return the decoded JSON response"""
+    params = dict(params)
+    headers = {}
+    if ZSTACK_SESSION_ID:
+        headers['Authorization'] = f"OAuth {ZSTACK_SESSION_ID}"
+    else:
+        params['apikey'] = ZSTACK_API_KEY
+    url = f"{ZSTACK_INVENTORY_API_URL.rstrip('/')}/{resource}"
+    response = upstream.session.get(url, params=params, headers=headers, timeout=30)
+    if response.status_code != 200:
+        raise RuntimeError(f"ZStack {resource} query failed with status code: {response.status_code}")
+    return response.json()
+
+
+def fetch_all(resource, conditions=None):
+    """Fetch every page of an inventory query, with bounded concurrency
+
+    Returns (inventories, number of requests made).
+    """
+    base_params = {'limit': ZSTACK_PAGE_SIZE}
+    if conditions:
+        base_params['q'] = conditions
+    first = query(resource, {**base_params, 'start': 0, 'replyWithCount': 'true'})
+    inventories = list(first.get('inventories', []))
+    total = int(first.get('total', len(inventories)))
+
+    starts = range(ZSTACK_PAGE_SIZE, total, ZSTACK_PAGE_SIZE)
+    pages = _executor.map(lambda start: query(resource, {**base_params, 'start': start}), starts)
+    for page in pages:
+        inventories.extend(page.get('inventories', []))
+    return inventories, 1 + len(starts)
+
+
+def count(resource):
+    """Return the number of entities in an inventory without fetching them"""
+    return int(query(resource, {'count': 'true'}).get('total', 0))
+
+
+def entity_values(kind, inventory):
+    """Extract the label values and gauge values of one entity"""
+    definition = INVENTORIES[kind]
+    labels = tuple(sys.intern(str(inventory.get(key) or '')) for key in definition['labels'].values())
+    values = {}
+    for field in definition['fields']:
+        value = inventory.get(field)
+        if isinstance(value, (int, float)):
+            values[(kind, field)] = value
+    for state, (key, expected, _) in definition['states'].items():
+        values[(kind, state)] = 1 if inventory.get(key) == expected else 0
+    return labels, values
+
+
+def write_entity(kind, labels, values):
+    """Set the series of one entity, removing those of fields it no longer reports"""
+    for key, name in kind_families[kind]:
+        if key in values:
+            zstack_inventory_metrics.update(name, labels, values[key])
+        else:
+            zstack_inventory_metrics.discard(name, labels)
+
+
+def remove_entity(kind, labels):
+    """Remove every series of one entity"""
+    for _, name in kind_families[kind]:
+        zstack_inventory_metrics.discard(name, labels)
+
+
+def sync_inventory(kind):
+    """Bring one inventory up to date, re-querying only changed entities when possible"""
+    definition = INVENTORIES[kind]
+    state = inventory_states[kind]
+    now = time.time()
+
+    full = state.last_op_date is None or now - state.last_full_sync >= ZSTACK_FULL_RESYNC_INTERVAL
+    if full:
+        inventories, requests_made = fetch_all(definition['resource'])
+    else:
+        since = state.last_op_date.strftime('%Y-%m-%d %H:%M:%S')
+        inventories, requests_made = fetch_all(definition['resource'], f"lastOpDate>={since}")
+
+    seen = set()
+    last_op_date = state.last_op_date
+    for inventory in inventories:
+        uuid = inventory.get('uuid')
+        if not uuid:
+            continue
+        seen.add(uuid)
+        labels, values = entity_values(kind, inventory)
+        # Labels such as the VM's host can change, the old series are then removed
+        previous = state.entities.get(uuid)
+        if previous is not None and previous != labels:
+            remove_entity(kind, previous)
+        write_entity(kind, labels, values)
+        state.entities[uuid] = labels
+        op_date = parse_date(inventory.get('lastOpDate'))
+        if op_date is not None and (last_op_date is None or op_date > last_op_date):
+            last_op_date = op_date
+    # Free the fetched pages before looking for stale series
+    del inventories
+
+    if full:
+        for uuid in set(state.entities) - seen:
+            del state.entities[uuid]
+        # Series of deleted entities, including any restored from a snapshot
+        live = set(state.entities.values())
+        for _, name in kind_families[kind]:
+            for labels in zstack_inventory_metrics.keys(name):
+                if labels not in live:
+                    zstack_inventory_metrics.discard(name, labels)
+        state.last_full_sync = now
+    else:
+        # Deletions don't show up in changed-only queries, resync on the next run
+        requests_made += 1
+        if count(definition['resource']) != len(state.entities):
+            state.last_full_sync = 0.0
+
+    # Incremental queries need a parseable lastOpDate, otherwise always do full syncs
+    state.last_op_date = last_op_date
+    zstack_inventory_count.labels(inventory=kind).set(len(state.entities))
+    zstack_inventory_requests.labels(inventory=kind).set(requests_made)
+    return len(seen), requests_made
+
+
+def process():
+    """Process ZStack inventories, writing the changed per-entity gauges in place"""
+    print("ZStack inventory metrics processing...")
+    for kind in INVENTORIES:
+        try:
+            fetched, requests_made = sync_inventory(kind)
+            zstack_inventory_last_successful_fetch.labels(inventory=kind).set(time.time())
+            print(f"ZStack {kind} inventory updated: {fetched} entities fetched in {requests_made} requests")
+        except Exception as e:
+            zstack_inventory_fetch_errors.labels(inventory=kind).inc()
+            # Inventories that failed keep their previous entities
+            print(f"Failed to update ZStack {kind} inventory: {e}")
+
+# Initial processing
+if __name__ == "__main__":
+    process()
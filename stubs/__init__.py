@@ -0,0 +1,3 @@
+# This file makes the stubs directory a Python package
+#
+# Local stand-ins for upstream services, used for offline testing and benchmarking.
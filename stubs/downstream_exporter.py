@@ -0,0 +1,115 @@
+"""Local stand-ins for downstream exporters, to exercise federation
+
+Run it standalone:
+
+    python -m stubs.downstream_exporter --port 9101 --exporters 3 --series 1000
+
+which serves three exporters on ports 9101-9103, and list them in the
+federation targets file:
+
+    {"targets": [{"instance": "edge-1", "url": "http://127.0.0.1:9101/metrics"}, ...]}
+
+Each exporter serves gauges, counters and a histogram with the given
+number of series, in the Prometheus text format, and changes its values
+on every scrape.
+"""
+import argparse
+import gzip
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+
+class DownstreamExporter:
+    """A registry of generated metrics served over HTTP"""
+
+    def __init__(self, series=100, latency=0.0, seed=0):
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.scrapes = 0
+        self.fail = False
+        self.registry = CollectorRegistry()
+        self.temperature = Gauge('edge_temperature_celsius', 'Sensor temperature', ['sensor', 'site'], registry=self.registry)
+        self.requests = Counter('edge_requests', 'Requests handled', ['path', 'instance'], registry=self.registry)
+        self.latency_histogram = Histogram('edge_request_latency_seconds', 'Request latency', registry=self.registry)
+        self.sensors = [(f'sensor-{i}', f'site "{i % 7}"\\north') for i in range(series)]
+        self.update()
+
+    def update(self):
+        with self.lock:
+            for sensor, site in self.sensors:
+                self.temperature.labels(sensor, site).set(self.random.uniform(-20, 40))
+            for path in ('/', '/api', '/health'):
+                self.requests.labels(path, 'local').inc(self.random.randint(0, 10))
+            for _ in range(10):
+                self.latency_histogram.observe(self.random.expovariate(20))
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with stub.lock:
+                    stub.scrapes += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if stub.fail:
+                    self.send_error(503)
+                    return
+                stub.update()
+                payload = generate_latest(stub.registry)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    payload = gzip.compress(payload)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                try:
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The scraper timed out and went away
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve in a background thread and return the /metrics URL"""
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return f"http://{host}:{self.server.server_address[1]}/metrics"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9101)
+    parser.add_argument('--exporters', type=int, default=1)
+    parser.add_argument('--series', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every scrape')
+    args = parser.parse_args()
+
+    exporters = [DownstreamExporter(args.series, args.latency, seed=i) for i in range(args.exporters)]
+    for i, exporter in enumerate(exporters):
+        print(f"Downstream exporter edge-{i + 1} serving {args.series} series on {exporter.start(args.host, args.port + i)}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for exporter in exporters:
+            exporter.stop()
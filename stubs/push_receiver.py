@@ -0,0 +1,180 @@
+"""Local stand-in for a remote-write or Pushgateway-style receiver
+
+Run it standalone:
+
+    python -m stubs.push_receiver --port 9091
+
+and point the exporter at it:
+
+    PUSH_URL=http://127.0.0.1:9091/api/v1/write
+
+It accepts snappy-compressed remote-write requests and gzip-compressed
+text exposition bodies, keeps what it received in memory and can be told
+to fail requests to exercise the exporter's retry queue.
+"""
+import argparse
+import gzip
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prometheus_client.parser import text_string_to_metric_families
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+
+def _read_varint(buffer, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _fields(buffer):
+    """Yield (field number, value) for the fields of a protobuf message"""
+    offset = 0
+    while offset < len(buffer):
+        key, offset = _read_varint(buffer, offset)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, offset = _read_varint(buffer, offset)
+        elif wire_type == 1:
+            value = buffer[offset:offset + 8]
+            offset += 8
+        elif wire_type == 2:
+            length, offset = _read_varint(buffer, offset)
+            value = buffer[offset:offset + length]
+            offset += length
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type}")
+        yield number, value
+
+
+def decode_write_request(payload):
+    """Decode a WriteRequest into [(labels dict, [(value, timestamp ms)])]"""
+    series = []
+    for number, timeseries in _fields(payload):
+        if number != 1:
+            continue
+        labels = {}
+        samples = []
+        for field, value in _fields(timeseries):
+            if field == 1:
+                label = dict(_fields(value))
+                labels[label.get(1, b'').decode('utf-8')] = label.get(2, b'').decode('utf-8')
+            elif field == 2:
+                sample = dict(_fields(value))
+                samples.append((struct.unpack('<d', sample.get(1, b'\0' * 8))[0], sample.get(2, 0)))
+        series.append((labels, samples))
+    return series
+
+
+class PushReceiver:
+    """In-memory receiver recording every pushed series"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+        # Remote write: labels tuple -> [(value, timestamp ms)]
+        self.series = {}
+        # Text pushes: family name -> [(sample name, labels dict, value)], replaced per push
+        self.families = {}
+        self.failures = []
+        self.server = None
+
+    def fail_next(self, count, status=503):
+        """Answer the next `count` pushes with an error status"""
+        with self.lock:
+            self.failures.extend([status] * count)
+
+    def samples(self):
+        """Number of samples received through remote write"""
+        with self.lock:
+            return sum(len(points) for points in self.series.values())
+
+    def receive(self, headers, body):
+        """Store one push, returning the HTTP status to answer with"""
+        with self.lock:
+            self.requests += 1
+            self.bytes += len(body)
+            if self.failures:
+                return self.failures.pop(0)
+        encoding = headers.get('Content-Encoding', '')
+        if encoding == 'snappy':
+            if snappy is None:
+                return 415
+            for labels, points in decode_write_request(snappy.decompress(body)):
+                with self.lock:
+                    self.series.setdefault(tuple(sorted(labels.items())), []).extend(points)
+            return 204
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        for family in text_string_to_metric_families(body.decode('utf-8')):
+            with self.lock:
+                self.families[family.name] = [(sample.name, sample.labels, sample.value) for sample in family.samples]
+        return 200
+
+    def handler(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                try:
+                    status = receiver.receive(self.headers, body)
+                except Exception as e:
+                    status = 400
+                    print(f"Bad push: {e}")
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            do_PUT = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve in a background thread and return the base URL"""
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9091)
+    args = parser.parse_args()
+
+    receiver = PushReceiver()
+    base_url = receiver.start(args.host, args.port)
+    print(f"Push receiver listening on {base_url}")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"{receiver.requests} pushes, {receiver.bytes} bytes, {len(receiver.series)} series, {len(receiver.families)} families")
+    except KeyboardInterrupt:
+        receiver.stop()
@@ -0,0 +1,148 @@
+"""Serve a recording of upstream traffic made with UPSTREAM_RECORD_PATH
+
+Run it standalone:
+
+    python -m stubs.replay recording.jsonl.gz --port 8089 --time-scale 720
+
+and point the exporter at it with the same time scale, keeping the paths
+of the recorded URLs:
+
+    ZSTACK_API_URL=http://127.0.0.1:8089/zstack/available-hosts-metrics
+    ZSTACK_API_KEY=replay
+    TIME_SCALE=720
+
+Requests are matched on path and query, redacted parameters left out.
+Each request gets the response recorded for the same point of the
+recording's timeline, so payloads change as they did upstream; with
+--time-scale the timeline runs that many times faster. Requests with no
+exact match, e.g. changed-since queries carrying a date, get the recorded
+response of the same path whose query shares the most parameters.
+"""
+import argparse
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from exporter.replay import decode_body, load_recording, request_key
+
+
+class ReplayStub:
+    """Recorded upstream responses served over HTTP on a compressed timeline"""
+
+    def __init__(self, exchanges, time_scale=1.0, latency=True, loop=False):
+        self.exchanges = exchanges
+        self.time_scale = time_scale
+        self.latency = latency
+        self.loop = loop
+        # Request key -> offsets of its entries, for bisecting the timeline
+        self.offsets = {key: [entry['t'] for entry in entries] for key, entries in exchanges.items()}
+        self.by_path = {}
+        for key in exchanges:
+            self.by_path.setdefault(urlsplit(key).path, []).append(key)
+        self.duration = max((offsets[-1] for offsets in self.offsets.values()), default=0.0)
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.unmatched = 0
+        self.server = None
+
+    def now(self):
+        """Offset into the recording's timeline"""
+        offset = (time.time() - self.started) * self.time_scale
+        if self.loop and self.duration > 0:
+            offset %= self.duration
+        return offset
+
+    def match(self, key):
+        if key in self.exchanges:
+            return key
+        parts = urlsplit(key)
+        wanted = set(parse_qsl(parts.query))
+        candidates = self.by_path.get(parts.path)
+        if not candidates:
+            return None
+        return max(candidates, key=lambda candidate: len(wanted & set(parse_qsl(urlsplit(candidate).query))))
+
+    def entry(self, key):
+        """The latest entry recorded for a request at the current offset, or the first one"""
+        offsets = self.offsets[key]
+        index = bisect.bisect_right(offsets, self.now()) - 1
+        return self.exchanges[key][max(index, 0)]
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                key = stub.match(request_key(self.path))
+                with stub.lock:
+                    stub.requests += 1
+                    if key is None:
+                        stub.unmatched += 1
+                if key is None:
+                    self.send_error(404, 'No recorded response')
+                    return
+                entry = stub.entry(key)
+                if stub.latency:
+                    time.sleep(entry['elapsed'])
+                headers = entry.get('headers', {})
+                etag = headers.get('ETag') or headers.get('etag')
+                if etag and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                payload = decode_body(entry)
+                self.send_response(entry['status'])
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve in a background thread and return the base URL"""
+        self.started = time.time()
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--time-scale', type=float, default=1.0, help='Speed-up of the recorded timeline')
+    parser.add_argument('--no-latency', action='store_true', help='Answer immediately instead of with the recorded latency')
+    parser.add_argument('--loop', action='store_true', help='Start the timeline over once it ends')
+    args = parser.parse_args()
+
+    exchanges = load_recording(args.recording)
+    stub = ReplayStub(exchanges, args.time_scale, not args.no_latency, args.loop)
+    base_url = stub.start(args.host, args.port)
+    print(f"Replaying {sum(map(len, exchanges.values()))} responses to {len(exchanges)} requests "
+          f"({stub.duration:.0f}s recorded, {stub.duration / args.time_scale:.0f}s at x{args.time_scale:g}) on {base_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()
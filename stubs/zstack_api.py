@@ -0,0 +1,181 @@
+"""Local ZStack API stub with generated host, VM and primary-storage inventories
+
+Run it standalone:
+
+    python -m stubs.zstack_api --port 8089 --vms 50000
+
+and point the exporter at it:
+
+    ZSTACK_API_URL=http://127.0.0.1:8089/zstack/available-hosts-metrics
+    ZSTACK_INVENTORY_API_URL=http://127.0.0.1:8089/zstack/v1
+    ZSTACK_API_KEY=stub
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+GB = 1024 * 1024 * 1024
+
+
+def _now(offset=0):
+    return datetime.fromtimestamp(time.time() + offset).strftime(DATE_FORMAT)
+
+
+class ZStackStub:
+    """In-memory ZStack inventories served over HTTP"""
+
+    def __init__(self, hosts=100, vms=10000, storage=10, latency=0.0, seed=0):
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        # Existing entities were last changed at some point during the previous day
+        dates = [_now(-86400 + offset) for offset in range(0, 86400, 60)]
+        self.inventories = {
+            'hosts': [
+                {
+                    'uuid': f'host-{i:05d}', 'name': f'host-{i}', 'clusterUuid': f'cluster-{i % 4}',
+                    'state': 'Enabled', 'status': 'Connected',
+                    'totalCpuCapacity': 128, 'availableCpuCapacity': self.random.randint(0, 128),
+                    'totalMemoryCapacity': 512 * GB, 'availableMemoryCapacity': self.random.randint(0, 512) * GB,
+                    'lastOpDate': self.random.choice(dates),
+                }
+                for i in range(hosts)
+            ],
+            'vm-instances': [
+                {
+                    'uuid': f'vm-{i:06d}', 'name': f'vm-{i}', 'hostUuid': f'host-{i % max(hosts, 1):05d}',
+                    'state': 'Running' if i % 10 else 'Stopped',
+                    'cpuNum': self.random.choice((1, 2, 4, 8)), 'memorySize': self.random.choice((2, 4, 8, 16)) * GB,
+                    'lastOpDate': self.random.choice(dates),
+                }
+                for i in range(vms)
+            ],
+            'primary-storage': [
+                {
+                    'uuid': f'ps-{i:03d}', 'name': f'ps-{i}', 'type': 'Ceph',
+                    'totalCapacity': 100 * 1024 * GB, 'availableCapacity': self.random.randint(0, 100) * 1024 * GB,
+                    'totalPhysicalCapacity': 100 * 1024 * GB, 'availablePhysicalCapacity': self.random.randint(0, 100) * 1024 * GB,
+                    'lastOpDate': self.random.choice(dates),
+                }
+                for i in range(storage)
+            ],
+        }
+        self.server = None
+
+    def churn(self, fraction=0.01):
+        """Change a fraction of the VMs, as a running cluster would between refreshes"""
+        with self.lock:
+            vms = self.inventories['vm-instances']
+            now = _now()
+            for vm in self.random.sample(vms, int(len(vms) * fraction)):
+                vm['state'] = 'Stopped' if vm['state'] == 'Running' else 'Running'
+                vm['lastOpDate'] = now
+
+    def aggregate(self):
+        """Cluster-wide totals in the shape of the available-hosts metrics API"""
+        hosts = self.inventories['hosts']
+        vms = self.inventories['vm-instances']
+        storage = self.inventories['primary-storage']
+        return {
+            'availableHostCount': sum(1 for h in hosts if h['status'] == 'Connected'),
+            'totalHostCount': len(hosts),
+            'totalCpuCapacity': sum(h['totalCpuCapacity'] for h in hosts),
+            'availableCpuCapacity': sum(h['availableCpuCapacity'] for h in hosts),
+            'totalMemoryCapacity': sum(h['totalMemoryCapacity'] for h in hosts),
+            'availableMemoryCapacity': sum(h['availableMemoryCapacity'] for h in hosts),
+            'primaryStorageTotalCapacity': sum(s['totalCapacity'] for s in storage),
+            'primaryStorageAvailableCapacity': sum(s['availableCapacity'] for s in storage),
+            'totalVmCount': len(vms),
+            'runningVmCount': sum(1 for v in vms if v['state'] == 'Running'),
+        }
+
+    def query(self, resource, params):
+        """Answer an inventory query with ZStack paging and lastOpDate conditions"""
+        with self.lock:
+            items = self.inventories[resource]
+            condition = params.get('q', [None])[0]
+            if condition and condition.startswith('lastOpDate>='):
+                since = condition[len('lastOpDate>='):]
+                items = [item for item in items if item['lastOpDate'] >= since]
+            if params.get('count', ['false'])[0] == 'true':
+                return {'total': len(items)}
+            start = int(params.get('start', [0])[0])
+            limit = int(params.get('limit', [1000])[0])
+            reply = {'inventories': items[start:start + limit]}
+            if params.get('replyWithCount', ['false'])[0] == 'true':
+                reply['total'] = len(items)
+            return reply
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                params = parse_qs(url.query)
+                with stub.lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                resource = url.path.rstrip('/').rsplit('/', 1)[-1]
+                if url.path.endswith('/available-hosts-metrics'):
+                    body = {'success': True, 'data': stub.aggregate()}
+                elif resource in stub.inventories:
+                    body = stub.query(resource, params)
+                else:
+                    self.send_error(404)
+                    return
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve in a background thread and return the base URL"""
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--hosts', type=int, default=100)
+    parser.add_argument('--vms', type=int, default=10000)
+    parser.add_argument('--storage', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    args = parser.parse_args()
+
+    stub = ZStackStub(args.hosts, args.vms, args.storage, args.latency)
+    base_url = stub.start(args.host, args.port)
+    print(f"ZStack API stub serving {args.vms} VMs on {base_url}/zstack")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,186 @@
+"""Compact gauge storage, and the ZStack inventory module built on it against stubs/zstack_api.py"""
+import importlib
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest
+
+from exporter import cardinality
+from exporter.atomic import AtomicGauges
+from exporter.compact import CompactGauge, CompactGauges
+from stubs.zstack_api import ZStackStub
+
+FAMILIES = {
+    'vm_cpu': ('vCPUs of the VM', ['uuid', 'name']),
+    'vm_memory': ('Memory of the VM', ['uuid', 'name']),
+    'vm_total': ('Number of VMs', []),
+}
+VALUES = {
+    'vm_cpu': {('vm-1', 'web'): 4, ('vm-2', 'db'): 8},
+    'vm_memory': {('vm-1', 'web'): 2048},
+    'vm_total': 2,
+}
+
+
+class CompactGaugesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gauges = CompactGauges(FAMILIES, registry=CollectorRegistry())
+
+    def test_exposition_matches_atomic_gauges(self):
+        atomic_registry = CollectorRegistry()
+        atomic = AtomicGauges(FAMILIES, registry=atomic_registry)
+        atomic.publish(VALUES)
+        compact_registry = CollectorRegistry()
+        CompactGauges(FAMILIES, registry=compact_registry).publish(VALUES)
+        self.assertEqual(generate_latest(compact_registry), generate_latest(atomic_registry))
+
+    def test_unlabelled_families_start_at_zero(self):
+        self.assertEqual(self.gauges.value('vm_total', default=None), 0.0)
+
+    def test_published_generations_never_change(self):
+        first = self.gauges.publish(VALUES)
+        second = self.gauges.publish({'vm_cpu': {('vm-3', 'cache'): 1}})
+        self.assertGreater(second.number, first.number)
+        self.assertEqual(first.values['vm_cpu'], {('vm-1', 'web'): 4, ('vm-2', 'db'): 8})
+        self.assertEqual(second.values['vm_cpu'], {('vm-3', 'cache'): 1})
+        self.assertEqual(second.values['vm_memory'], {})
+
+    def test_in_place_writes_start_new_generations(self):
+        published = self.gauges.publish(VALUES).number
+        self.gauges.update('vm_cpu', ('vm-1', 'web'), 6)
+        updated = self.gauges.current().number
+        self.gauges.increment('vm_cpu', ('vm-1', 'web'), 2)
+        incremented = self.gauges.current().number
+        self.gauges.discard('vm_cpu', ('vm-2', 'db'))
+        discarded = self.gauges.current().number
+        self.assertLess(published, updated)
+        self.assertLess(updated, incremented)
+        self.assertLess(incremented, discarded)
+        self.assertEqual(self.gauges.current().values['vm_cpu'], {('vm-1', 'web'): 8})
+        # Discarding a missing series changes nothing
+        self.gauges.discard('vm_cpu', ('vm-9', 'none'))
+        self.assertEqual(self.gauges.current().number, discarded)
+
+    def test_rows_are_reused_once_free(self):
+        self.gauges.update('vm_cpu', ('vm-1', 'web'), 1)
+        self.gauges.discard('vm_cpu', ('vm-1', 'web'))
+        self.gauges.update('vm_cpu', ('vm-2', 'db'), 2)
+        table = self.gauges._state[('uuid', 'name')]
+        self.assertEqual(len(table.keys), 1)
+        self.assertEqual(self.gauges.series_count('vm_cpu'), 1)
+        self.assertEqual(self.gauges.keys('vm_cpu'), [('vm-2', 'db')])
+
+    def test_label_tuples_are_shared(self):
+        labels = (sys.intern('vm-1'), sys.intern('web'))
+        self.gauges.update('vm_cpu', labels, 4)
+        self.gauges.update('vm_memory', labels, 2048)
+        table = self.gauges._state[('uuid', 'name')]
+        self.assertIs(table.keys[0], labels)
+
+    def test_series_counts_follow_writes(self):
+        self.gauges.publish(VALUES)
+        self.assertEqual(self.gauges.series_count('vm_cpu'), 2)
+        self.gauges.update('vm_cpu', ('vm-3', 'cache'), 1)
+        self.gauges.update('vm_cpu', ('vm-3', 'cache'), 2)
+        self.assertEqual(self.gauges.series_count('vm_cpu'), 3)
+        self.gauges.discard('vm_cpu', ('vm-1', 'web'))
+        self.assertEqual(self.gauges.series_count('vm_cpu'), 2)
+
+    def test_restore(self):
+        self.gauges.restore([('vm_cpu', {'uuid': 'vm-1', 'name': 'web'}, 4.0), ('unknown', {}, 1.0)])
+        self.assertEqual(self.gauges.value('vm_cpu', 'vm-1', 'web'), 4.0)
+
+    def test_cardinality_limits_fold_new_series(self):
+        module = types.ModuleType('compact_limits')
+        module.gauges = self.gauges
+        with mock.patch.object(cardinality, 'CARDINALITY_METRIC_LIMIT', 2):
+            guard = cardinality.limit_module('compact_limits', module)
+            self.gauges.publish({'vm_cpu': {(f'vm-{i}', 'web'): i for i in range(5)}})
+            overflow = (cardinality.OVERFLOW_VALUE,) * 2
+            self.assertEqual(self.gauges.value('vm_cpu', *overflow), 3)
+            self.gauges.update('vm_memory', ('vm-1', 'web'), 1)
+            self.gauges.update('vm_memory', ('vm-2', 'web'), 1)
+            self.gauges.update('vm_memory', ('vm-3', 'web'), 1)
+            self.assertEqual(set(self.gauges.keys('vm_memory')), {('vm-1', 'web'), ('vm-2', 'web'), overflow})
+        # Two series and the overflow series of each family, vm_total was left out of the publish
+        self.assertEqual(guard.sizes, {'vm_cpu': 3, 'vm_memory': 3, 'vm_total': 0})
+        self.assertEqual(guard.size, 6)
+
+
+class CompactGaugeTest(unittest.TestCase):
+
+    def test_gauge_interface(self):
+        registry = CollectorRegistry()
+        gauge = CompactGauge('queue_depth', 'Queue depth', ['queue'], registry=registry)
+        gauge.labels('a').set(3)
+        gauge.labels(queue='a').inc(2)
+        gauge.labels('b').dec()
+        self.assertEqual(gauge.labels('a').get(), 5)
+        self.assertEqual(registry.get_sample_value('queue_depth', {'queue': 'b'}), -1)
+        gauge.remove('b')
+        self.assertIsNone(registry.get_sample_value('queue_depth', {'queue': 'b'}))
+        with self.assertRaises(ValueError):
+            gauge.set(1)
+        with self.assertRaises(ValueError):
+            gauge.labels('a', 'b')
+        gauge.clear()
+        self.assertEqual(gauge.series_count('queue_depth'), 0)
+
+
+class InventoryTest(unittest.TestCase):
+    """Incremental syncs keep the compact store equal to the stub's inventories"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.stub = ZStackStub(hosts=5, vms=200, storage=2)
+        url = cls.stub.start()
+        environment = {'ZSTACK_INVENTORY_API_URL': url + '/zstack/v1', 'ZSTACK_API_KEY': 'stub', 'ZSTACK_PAGE_SIZE': '50'}
+        with mock.patch.dict(os.environ, environment):
+            cls.inventory = importlib.import_module('metrics.zstack_inventory_metrics')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.inventory.zstack_inventory_metrics.unregister()
+        for collector in (cls.inventory.zstack_inventory_count, cls.inventory.zstack_inventory_requests,
+                          cls.inventory.zstack_inventory_last_successful_fetch, cls.inventory.zstack_inventory_fetch_errors):
+            REGISTRY.unregister(collector)
+        sys.modules.pop('metrics.zstack_inventory_metrics', None)
+        cls.stub.stop()
+
+    def running(self):
+        """zstack_vm_running as the stub reports it"""
+        return {
+            (vm['uuid'], vm['name'], vm['hostUuid']): 1.0 if vm['state'] == 'Running' else 0.0
+            for vm in self.stub.inventories['vm-instances']
+        }
+
+    def test_syncs_follow_the_stub(self):
+        store = self.inventory.zstack_inventory_metrics
+        self.inventory.process()
+        self.assertEqual(store.current().values['zstack_vm_running'], self.running())
+
+        # Changed-only query: a moved VM loses its old series
+        self.stub.churn(0.1)
+        moved = self.stub.inventories['vm-instances'][0]
+        old_labels = (moved['uuid'], moved['name'], moved['hostUuid'])
+        moved['hostUuid'] = 'host-99999'
+        moved['lastOpDate'] = '2999-01-01 00:00:00'
+        self.inventory.process()
+        self.assertEqual(store.current().values['zstack_vm_running'], self.running())
+        self.assertNotIn(old_labels, store.current().values['zstack_vm_cpuNum'])
+
+        # Deletions are only seen by the full resync they trigger
+        del self.stub.inventories['vm-instances'][1:11]
+        self.inventory.process()
+        self.inventory.process()
+        self.assertEqual(store.current().values['zstack_vm_running'], self.running())
+        self.assertEqual(store.series_count('zstack_vm_cpuNum'), 190)
+        self.assertEqual(len(self.inventory.inventory_states['vm'].entities), 190)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+"""Declarative collector specs"""
+import unittest
+from unittest import mock
+
+from prometheus_client import CollectorRegistry
+
+from exporter.declarative import DeclarativeCollector
+
+SPEC = {
+    'endpoint': 'http://zstack.invalid/zstack/available-hosts-metrics',
+    'success': 'success',
+    'metrics': [{'name': 'declarative_available_hosts', 'path': 'data.availableHostCount'}],
+}
+
+
+class SuccessTest(unittest.TestCase):
+
+    def process(self, data):
+        collector = DeclarativeCollector('hosts', SPEC, registry=CollectorRegistry())
+        with mock.patch.object(collector, 'fetch', return_value=data):
+            collector.process()
+        return collector.metrics.value('declarative_available_hosts')
+
+    def test_success_publishes(self):
+        self.assertEqual(self.process({'success': True, 'data': {'availableHostCount': 3}}), 3)
+
+    def test_false_or_missing_success_fails(self):
+        for data in ({'success': False, 'data': {'availableHostCount': 3}}, {'data': {'availableHostCount': 3}}):
+            with self.subTest(data=data), self.assertRaises(RuntimeError):
+                self.process(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""Federation against the local stand-in exporters in stubs/downstream_exporter.py"""
+import time
+import unittest
+from unittest import mock
+
+from prometheus_client import CollectorRegistry, Gauge
+
+from exporter import federation
+from stubs.downstream_exporter import DownstreamExporter
+
+
+class FederationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.exporters = [DownstreamExporter(series=5, seed=i) for i in range(2)]
+        self.targets = {
+            f'edge-{i + 1}': federation.Target(f'edge-{i + 1}', exporter.start())
+            for i, exporter in enumerate(self.exporters)
+        }
+        local = CollectorRegistry()
+        self.local_temperature = Gauge('edge_temperature_celsius', 'Local temperature', registry=local)
+        self.federation = federation.Federation(
+            self.targets, concurrency=2, registry=CollectorRegistry(),
+            modules=lambda: {'local': [self.local_temperature]},
+        )
+
+    def tearDown(self):
+        self.federation.stop()
+        for exporter in self.exporters:
+            exporter.stop()
+
+    def scrape(self):
+        for target in self.targets.values():
+            self.federation.scrape(target)
+
+    def families(self):
+        return {family.name: family for family in self.federation.families()}
+
+    def status(self, name):
+        family = next(family for family in self.federation.collect() if family.name == name)
+        return {sample.labels['instance']: sample.value for sample in family.samples}
+
+    def test_samples_carry_the_instance_label(self):
+        self.scrape()
+        histogram = self.families()['edge_request_latency_seconds']
+        instances = {sample.labels['instance'] for sample in histogram.samples}
+        self.assertEqual(instances, {'edge-1', 'edge-2'})
+        self.assertEqual(self.status('exporter_federation_up'), {'edge-1': 1, 'edge-2': 1})
+
+    def test_clashing_instance_label_is_renamed(self):
+        self.scrape()
+        samples = [sample for sample in self.families()['edge_requests'].samples if sample.name == 'edge_requests_total']
+        self.assertTrue(samples)
+        for sample in samples:
+            self.assertEqual(sample.labels['exported_instance'], 'local')
+            self.assertIn(sample.labels['instance'], ('edge-1', 'edge-2'))
+
+    def test_families_clashing_with_local_names_are_dropped(self):
+        self.scrape()
+        families = self.families()
+        self.assertNotIn('edge_temperature_celsius', families)
+        self.assertIn('edge_requests', families)
+
+    def test_stale_targets_expire(self):
+        self.scrape()
+        self.exporters[0].fail = True
+        self.scrape()
+        self.assertEqual(self.status('exporter_federation_up'), {'edge-1': 0, 'edge-2': 1})
+        # The last good scrape is served until it goes stale
+        instances = {sample.labels['instance'] for sample in self.families()['edge_requests'].samples}
+        self.assertEqual(instances, {'edge-1', 'edge-2'})
+
+        with mock.patch.object(federation, 'FEDERATION_STALENESS', 60):
+            self.targets['edge-1'].last_success = time.time() - 61
+            self.federation.changed = True
+            instances = {sample.labels['instance'] for sample in self.families()['edge_requests'].samples}
+        self.assertEqual(instances, {'edge-2'})
+
+    def test_slow_targets_time_out(self):
+        self.exporters[1].latency = 2
+        self.targets['edge-2'].timeout = 0.3
+        start = time.monotonic()
+        self.scrape()
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual(self.status('exporter_federation_up'), {'edge-1': 1, 'edge-2': 0})
+        instances = {sample.labels['instance'] for sample in self.families()['edge_requests'].samples}
+        self.assertEqual(instances, {'edge-1'})
+
+    def test_background_scrapes(self):
+        self.federation.start()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and not all(target.up for target in self.targets.values()):
+            time.sleep(0.05)
+        self.assertEqual(self.status('exporter_federation_up'), {'edge-1': 1, 'edge-2': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
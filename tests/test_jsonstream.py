@@ -0,0 +1,76 @@
+"""Incremental JSON array reader, against json.loads on the same documents"""
+import json
+import unittest
+
+from exporter import jsonstream, upstream
+from stubs.zstack_api import ZStackStub
+
+DOCUMENT = {
+    'success': True,
+    'meta': {'skipped': [{'a': '[{"not": "a bracket"}]'}, [1, [2, [3]]], 'tricky \\" \\\\ é'], 'n': -1.5e3},
+    'data': {
+        'hosts': [
+            {'uuid': 'host-1', 'name': 'héte "1"', 'cpu': 64, 'tags': ['a', 'b'], 'ratio': 0.25},
+            {'uuid': 'host-2', 'name': 'café ☕', 'cpu': 128, 'tags': [], 'ratio': None},
+            {'uuid': 'host-3', 'name': 'x' * 5000, 'cpu': 12345678901234567890, 'tags': [{}], 'ratio': True},
+        ],
+        'empty': [],
+    },
+}
+
+
+def chunked(text, size):
+    return (text[i:i + size] for i in range(0, len(text), size))
+
+
+class IterItemsTest(unittest.TestCase):
+
+    def items(self, document, path, size):
+        return list(jsonstream.iter_text_items(chunked(document, size), path))
+
+    def test_matches_json_loads_at_every_chunk_size(self):
+        for indent in (None, 2):
+            document = json.dumps(DOCUMENT, indent=indent)
+            for size in (1, 2, 3, 7, 64, len(document)):
+                with self.subTest(indent=indent, size=size):
+                    self.assertEqual(self.items(document, ('data', 'hosts'), size), DOCUMENT['data']['hosts'])
+                    self.assertEqual(self.items(document, ('meta', 'skipped', 1), size), [1, [2, [3]]])
+                    self.assertEqual(self.items(document, ('data', 'empty'), size), [])
+
+    def test_top_level_array(self):
+        self.assertEqual(self.items('[1, 2.5, "3", null, false]', (), 2), [1, 2.5, '3', None, False])
+
+    def test_missing_path_yields_nothing(self):
+        document = json.dumps(DOCUMENT)
+        for path in (('data', 'vms'), ('meta', 'skipped', 9), ('success', 'x'), ('data', 0)):
+            with self.subTest(path=path):
+                self.assertEqual(self.items(document, path, 5), [])
+
+    def test_invalid_documents_raise(self):
+        for document, path in (('{"data": {"hosts": 3}}', ('data', 'hosts')),
+                               ('{"data": [1, 2', ('data',)),
+                               ('{"data": [1 2]}', ('data',)),
+                               ('{"skip": "unterminated', ('data',))):
+            with self.subTest(document=document), self.assertRaises(ValueError):
+                self.items(document, path, 3)
+
+    def test_multibyte_characters_split_across_byte_chunks(self):
+        data = json.dumps(DOCUMENT, ensure_ascii=False).encode('utf-8')
+        chunks = (data[i:i + 1] for i in range(len(data)))
+        self.assertEqual(list(jsonstream.iter_items(chunks, ('data', 'hosts'))), DOCUMENT['data']['hosts'])
+
+
+class StreamItemsTest(unittest.TestCase):
+
+    def test_streams_an_upstream_response(self):
+        stub = ZStackStub(hosts=2, vms=300, storage=1)
+        url = stub.start()
+        try:
+            items = list(upstream.stream_items(url + '/zstack/v1/vm-instances', ('inventories',), params={'limit': 1000}))
+        finally:
+            stub.stop()
+        self.assertEqual(items, stub.inventories['vm-instances'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Lazily indexed MCP modules and the offload worker pool"""
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import textwrap
+import unittest
+
+from fastmcp import FastMCP
+from prometheus_client import REGISTRY
+
+from exporter import mcp_index
+
+MODULE = '''
+import time
+from . import mcp
+
+TOOL_LIMITS = {
+    'sleep': {'concurrency': 1, 'timeout': 0.2},
+}
+
+@mcp.tool()
+def sleep(seconds: float) -> str:
+    """Sleep for a while"""
+    time.sleep(seconds)
+    return 'done'
+'''
+
+
+class LazyModuleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.directory, 'lazy_mcps'))
+        with open(os.path.join(self.directory, 'lazy_mcps', '__init__.py'), 'w') as f:
+            f.write('mcp = None\n')
+        self.path = os.path.join(self.directory, 'lazy_mcps', 'sleepy.py')
+        with open(self.path, 'w') as f:
+            f.write(textwrap.dedent(MODULE))
+        sys.path.insert(0, self.directory)
+        self.server = FastMCP(name='lazy-test')
+        import lazy_mcps
+        lazy_mcps.mcp = self.server
+        self.module = mcp_index.McpModule(self.server, 'lazy_mcps.sleepy', self.path)
+
+    def tearDown(self):
+        self.module.unregister()
+        sys.path.remove(self.directory)
+        sys.modules.pop('lazy_mcps', None)
+        shutil.rmtree(self.directory)
+
+    def call(self, seconds):
+        tool = mcp_index.registry(self.server, 'tool')['sleep']
+        return asyncio.run(tool.run({'seconds': seconds}))
+
+    def calls(self):
+        return REGISTRY.get_sample_value('exporter_mcp_call_seconds_count', {'kind': 'tool', 'name': 'sleep'}) or 0
+
+    def test_first_call_imports_and_runs_once(self):
+        self.module.register(lazy=True)
+        self.assertIsNone(self.module.module)
+        before = self.calls()
+        self.call(0)
+        self.assertIsNotNone(self.module.module)
+        self.assertEqual(self.calls(), before + 1)
+        self.call(0)
+        self.assertEqual(self.calls(), before + 2)
+
+    def test_first_call_uses_declared_limits(self):
+        self.module.register(lazy=True)
+        with self.assertRaises(Exception) as raised:
+            self.call(1)
+        self.assertIn('timed out after 0.2s', str(raised.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""Push pipeline against the local stand-in receiver in stubs/push_receiver.py"""
+import math
+import shutil
+import struct
+import tempfile
+import types
+import unittest
+
+from prometheus_client import CollectorRegistry, Gauge
+
+from exporter import push, updates
+from stubs.push_receiver import PushReceiver
+
+
+def _is_stale(value):
+    return struct.pack('<d', value) == struct.pack('<d', push.STALE_NAN)
+
+
+class PushTestCase(unittest.TestCase):
+    push_format = 'remote_write'
+
+    def setUp(self):
+        self.receiver = PushReceiver()
+        self.url = self.receiver.start() + '/api/v1/write'
+        self.queue_dir = tempfile.mkdtemp()
+        self.pusher = push.Pusher(self.url, push_format=self.push_format, queue_dir=self.queue_dir,
+                                  batch_size=1000000, batch_interval=3600, extra_labels=(), bearer_token='')
+        updates.add_listener(self.pusher.on_update)
+        registry = CollectorRegistry()
+        self.module = types.ModuleType('push_test_module')
+        self.module.temperature = Gauge('push_test_temperature', 'Temperature', ['room'], registry=registry)
+        self.module.humidity = Gauge('push_test_humidity', 'Humidity', ['room'], registry=registry)
+
+    def tearDown(self):
+        updates.remove_listener(self.pusher.on_update)
+        self.receiver.stop()
+        shutil.rmtree(self.queue_dir)
+
+    def process(self):
+        updates.module_processed('push_test_module', self.module)
+        self.pusher.flush()
+
+    def points(self, name, room):
+        key = tuple(sorted({'__name__': name, 'room': room}.items()))
+        return [value for value, _ in self.receiver.series.get(key, [])]
+
+
+class RemoteWriteTest(PushTestCase):
+
+    def test_only_changed_series_are_pushed(self):
+        self.module.temperature.labels('a').set(20)
+        self.module.temperature.labels('b').set(21)
+        self.process()
+        self.assertEqual(self.points('push_test_temperature', 'a'), [20])
+        self.assertEqual(self.points('push_test_temperature', 'b'), [21])
+
+        self.module.temperature.labels('a').set(22)
+        self.process()
+        self.assertEqual(self.points('push_test_temperature', 'a'), [20, 22])
+        self.assertEqual(self.points('push_test_temperature', 'b'), [21])
+
+    def test_removed_series_get_a_stale_marker(self):
+        self.module.temperature.labels('a').set(20)
+        self.module.temperature.labels('b').set(21)
+        self.process()
+        self.module.temperature.remove('b')
+        self.process()
+        points = self.points('push_test_temperature', 'b')
+        self.assertEqual(len(points), 2)
+        self.assertTrue(math.isnan(points[-1]) and _is_stale(points[-1]))
+        self.assertEqual(self.points('push_test_temperature', 'a'), [20])
+
+    def test_failed_batch_is_queued_and_replayed(self):
+        self.receiver.fail_next(1, status=503)
+        self.module.temperature.labels('a').set(20)
+        self.process()
+        self.assertEqual(len(self.pusher.queue), 1)
+        self.assertEqual(self.receiver.series, {})
+
+        # A later batch waits behind the queued one
+        self.module.temperature.labels('a').set(23)
+        updates.module_processed('push_test_module', self.module)
+        self.pusher.retry_at = 0
+        self.pusher.flush()
+        self.assertEqual(len(self.pusher.queue), 0)
+        self.assertEqual(self.points('push_test_temperature', 'a'), [20, 23])
+
+
+class TextTest(PushTestCase):
+    push_format = 'text'
+
+    def test_only_changed_families_are_pushed(self):
+        self.module.temperature.labels('a').set(20)
+        self.module.humidity.labels('a').set(40)
+        self.process()
+        self.assertEqual(set(self.receiver.families), {'push_test_temperature', 'push_test_humidity'})
+
+        self.receiver.families.clear()
+        self.module.temperature.labels('b').set(25)
+        self.process()
+        self.assertEqual(list(self.receiver.families), ['push_test_temperature'])
+        # Whole families are sent, as Pushgateway replaces them on every push
+        samples = {labels['room']: value for _, labels, value in self.receiver.families['push_test_temperature']}
+        self.assertEqual(samples, {'a': 20, 'b': 25})
+
+    def test_removed_series_leave_their_family(self):
+        self.module.temperature.labels('a').set(20)
+        self.module.temperature.labels('b').set(21)
+        self.process()
+        self.module.temperature.remove('b')
+        self.process()
+        self.assertEqual(self.receiver.families['push_test_temperature'], [('push_test_temperature', {'room': 'a'}, 20.0)])
+
+    def test_failed_batch_is_queued_and_replayed(self):
+        self.receiver.fail_next(1, status=503)
+        self.module.humidity.labels('a').set(40)
+        self.process()
+        self.assertEqual(len(self.pusher.queue), 1)
+        self.assertEqual(self.receiver.families, {})
+
+        self.pusher.retry_at = 0
+        self.pusher.drain()
+        self.assertEqual(len(self.pusher.queue), 0)
+        self.assertEqual(self.receiver.families['push_test_humidity'], [('push_test_humidity', {'room': 'a'}, 40.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
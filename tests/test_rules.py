@@ -0,0 +1,131 @@
+"""Recording rules: expression evaluation and updates from metric modules"""
+import math
+import types
+import unittest
+
+from prometheus_client import CollectorRegistry, Gauge
+
+from exporter import rules
+from exporter.atomic import AtomicGauges
+
+
+def vector(*series):
+    """{labels tuple: value} from (labels dict, value) pairs"""
+    return {tuple(sorted(labels.items())): value for labels, value in series}
+
+
+class ExpressionTest(unittest.TestCase):
+
+    def evaluate(self, expr, **vectors):
+        return rules.Rule('result', expr).evaluate(vectors)
+
+    def test_scalar_arithmetic(self):
+        self.assertEqual(self.evaluate('(1 + 2) * 3 - 4 / 2 + 7 % 4 + 2 ** 3'), {(): 18.0})
+        self.assertEqual(self.evaluate('-total', total=vector(({}, 5))), {(): -5})
+
+    def test_vectors_match_on_labels(self):
+        total = vector(({'host': 'a'}, 10), ({'host': 'b'}, 20), ({'host': 'c'}, 30))
+        used = vector(({'host': 'a'}, 5), ({'host': 'b'}, 5))
+        self.assertEqual(self.evaluate('used / total', used=used, total=total),
+                         vector(({'host': 'a'}, 0.5), ({'host': 'b'}, 0.25)))
+
+    def test_unlabelled_series_applies_to_every_series(self):
+        used = vector(({'host': 'a'}, 5), ({'host': 'b'}, 10))
+        total = vector(({}, 20))
+        self.assertEqual(self.evaluate('used / total', used=used, total=total),
+                         vector(({'host': 'a'}, 0.25), ({'host': 'b'}, 0.5)))
+
+    def test_division_and_power_follow_promql(self):
+        [(_, zero_by_zero)] = self.evaluate('0 / 0').items()
+        self.assertTrue(math.isnan(zero_by_zero))
+        self.assertEqual(self.evaluate('1 / 0'), {(): math.inf})
+        self.assertEqual(self.evaluate('-1 / 0'), {(): -math.inf})
+        self.assertTrue(math.isnan(self.evaluate('5 % 0')[()]))
+        self.assertTrue(math.isnan(self.evaluate('(-8) ** 0.5')[()]))
+        self.assertEqual(self.evaluate('0 ** -1'), {(): math.inf})
+        self.assertEqual(self.evaluate('(-10) ** 1001'), {(): -math.inf})
+
+    def test_functions_and_aggregations(self):
+        usage = vector(({'host': 'a', 'cluster': 'x'}, -2), ({'host': 'b', 'cluster': 'x'}, 4), ({'host': 'c', 'cluster': 'y'}, 9))
+        self.assertEqual(self.evaluate('clamp_max(clamp_min(usage, 0), 5)', usage=usage),
+                         vector(({'host': 'a', 'cluster': 'x'}, 0), ({'host': 'b', 'cluster': 'x'}, 4), ({'host': 'c', 'cluster': 'y'}, 5)))
+        self.assertEqual(self.evaluate('sum(usage)', usage=usage), {(): 11.0})
+        self.assertEqual(self.evaluate('max(usage, by=["cluster"])', usage=usage),
+                         vector(({'cluster': 'x'}, 4.0), ({'cluster': 'y'}, 9.0)))
+        self.assertEqual(self.evaluate('count(usage, by=["cluster"])', usage=usage),
+                         vector(({'cluster': 'x'}, 2.0), ({'cluster': 'y'}, 1.0)))
+        self.assertEqual(self.evaluate('avg(abs(usage))', usage=usage), {(): 5.0})
+
+    def test_unsupported_syntax_is_rejected(self):
+        for expr in ('__import__("os")', 'usage.real', 'usage[0]', 'usage < 1', '"text"', 'True', 'abs(usage, 1)',
+                     'sum(usage, by="host")', 'lambda: 1', '1 +'):
+            with self.subTest(expr=expr), self.assertRaises(ValueError):
+                rules.Rule('result', expr)
+        with self.assertRaises(ValueError):
+            rules.Rule('not-a-name', '1')
+
+
+class RecordingRulesTest(unittest.TestCase):
+
+    def setUp(self):
+        registry = CollectorRegistry()
+        self.capacity = types.ModuleType('capacity')
+        self.capacity.metrics = AtomicGauges({
+            'total': ('Total capacity', ['host']),
+            'available': ('Available capacity', ['host']),
+        }, registry=registry)
+        self.hosts = types.ModuleType('hosts')
+        self.hosts.up = Gauge('hosts_up', 'Hosts up', registry=registry)
+        self.engine = rules.RecordingRules([
+            rules.Rule('usage_ratio', '(total - available) / total'),
+            rules.Rule('usage_percent', 'usage_ratio * 100'),
+            rules.Rule('hosts_down', '3 - hosts_up'),
+        ])
+
+    def publish(self, total, available):
+        return self.capacity.metrics.publish({
+            'total': {('a',): total, ('b',): total},
+            'available': {('a',): available, ('b',): total},
+        })
+
+    def test_rules_follow_their_input_modules(self):
+        self.publish(100, 25)
+        self.engine.module_processed('capacity', self.capacity)
+        self.assertEqual(self.engine.vector('usage_ratio'), vector(({'host': 'a'}, 0.75), ({'host': 'b'}, 0.0)))
+        # A rule on a rule is evaluated in the same pass
+        self.assertEqual(self.engine.vector('usage_percent'), vector(({'host': 'a'}, 75.0), ({'host': 'b'}, 0.0)))
+        self.assertEqual(self.engine.vector('hosts_down'), {})
+
+        self.hosts.up.set(2)
+        self.engine.module_processed('hosts', self.hosts)
+        self.assertEqual(self.engine.vector('hosts_down'), {(): 1.0})
+
+        self.engine.module_removed('capacity')
+        self.assertEqual(self.engine.vector('usage_ratio'), {})
+        self.assertEqual(self.engine.vector('hosts_down'), {(): 1.0})
+
+    def test_unrelated_modules_do_not_evaluate(self):
+        self.engine.refresh({'capacity': self.capacity, 'hosts': self.hosts})
+        self.assertFalse(self.engine.evaluate({'other'}))
+
+    def test_vector_of_a_generation(self):
+        first = self.publish(100, 25)
+        self.engine.module_processed('capacity', self.capacity)
+        self.assertEqual(self.engine.vector('usage_percent', first)[(('host', 'a'),)], 75.0)
+        # Until the rules catch up, a newer generation has no consistent result
+        second = self.publish(100, 50)
+        self.assertEqual(self.engine.vector('usage_percent', second), {})
+        self.engine.module_processed('capacity', self.capacity)
+        self.assertEqual(self.engine.vector('usage_percent', second)[(('host', 'a'),)], 50.0)
+
+    def test_collect_exposes_rule_results(self):
+        self.publish(100, 25)
+        self.engine.module_processed('capacity', self.capacity)
+        registry = CollectorRegistry()
+        registry.register(self.engine)
+        self.assertEqual(registry.get_sample_value('usage_ratio', {'host': 'a'}), 0.75)
+        self.assertIsNone(registry.get_sample_value('hosts_down'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+"""Snapshot format and warm restarts against the ZStack stub in stubs/zstack_api.py"""
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+import types
+import unittest
+from unittest import mock
+
+from prometheus_client import CollectorRegistry, Counter, Gauge
+
+import main
+from exporter import snapshot, upstream
+from exporter.accumulators import ShardedCounter
+from exporter.atomic import AtomicGauges
+from stubs.zstack_api import ZStackStub
+
+
+class FormatTest(unittest.TestCase):
+
+    def test_records_round_trip(self):
+        records = [
+            ('zstack_host_connected', json.dumps([['uuid', 'host-1']]), 1.0, 1700000000.0),
+            ('zstack_vm_name', json.dumps([['name', 'café ☕']]), -2.5, 1700000001.0),
+        ]
+        self.assertEqual(snapshot.decode(snapshot.encode(records)), records)
+
+    def test_long_label_sets_fit(self):
+        labels = json.dumps([['description', 'x' * 100000]])
+        [(_, decoded, _, _)] = snapshot.decode(snapshot.encode([('long_labels', labels, 1.0, 0.0)]))
+        self.assertEqual(decoded, labels)
+
+    def test_version_1_files_are_read(self):
+        labels = b'[["uuid","host-1"]]'
+        buffer = (struct.pack('<4sHI', snapshot.MAGIC, 1, 1)
+                  + struct.pack('<H', 4) + b'up_1'
+                  + struct.pack('<H', len(labels)) + labels
+                  + struct.pack('<dd', 3.0, 5.0))
+        self.assertEqual(snapshot.decode(buffer), [('up_1', labels.decode(), 3.0, 5.0)])
+
+    def test_unknown_versions_are_rejected(self):
+        with self.assertRaises(ValueError):
+            snapshot.decode(struct.pack('<4sHI', snapshot.MAGIC, 99, 0))
+
+
+class SaveRestoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'snapshot.bin')
+        snapshot._series.clear()
+
+    def tearDown(self):
+        snapshot._series.clear()
+        shutil.rmtree(self.directory)
+
+    def module(self):
+        registry = CollectorRegistry()
+        module = types.ModuleType('snapshot_test_module')
+        module.gauge = Gauge('snapshot_test_gauge', 'Gauge', ['room'], registry=registry)
+        module.counter = Counter('snapshot_test_requests', 'Counter', ['room'], registry=registry)
+        module.sharded = ShardedCounter('snapshot_test_sharded', 'Sharded counter', ['room'], registry=registry)
+        module.group = AtomicGauges({'snapshot_test_group': ('Group', ['room'])}, registry=registry)
+        return module
+
+    def test_every_type_is_restored(self):
+        module = self.module()
+        module.gauge.labels('a').set(21.5)
+        module.counter.labels('a').inc(3)
+        module.sharded.labels('a').inc(7)
+        module.group.publish({'snapshot_test_group': {('a',): 4}})
+        snapshot.mark_processed('snapshot_test_module')
+        snapshot.save(self.path, {'snapshot_test_module': module})
+
+        snapshot._series.clear()
+        snapshot.load(self.path)
+        restored = self.module()
+        age = snapshot.restore_module('snapshot_test_module', restored)
+        self.assertLess(age, 60)
+        self.assertEqual(restored.gauge.labels('a')._value.get(), 21.5)
+        self.assertEqual(restored.counter.labels('a')._value.get(), 3)
+        self.assertEqual(restored.group.value('snapshot_test_group', 'a'), 4)
+        [total] = [sample.value for family in restored.sharded.collect() for sample in family.samples]
+        self.assertEqual(total, 7)
+
+    def test_removed_series_are_not_saved_again(self):
+        module = self.module()
+        module.gauge.labels('a').set(1)
+        module.gauge.labels('b').set(2)
+        snapshot.save(self.path, {'snapshot_test_module': module})
+        module.gauge.remove('b')
+        snapshot.save(self.path, {'snapshot_test_module': module})
+        with open(self.path, 'rb') as f:
+            rooms = {json.loads(labels)[0][1] for name, labels, _, _ in snapshot.decode(f.read()) if name == 'snapshot_test_gauge'}
+        self.assertEqual(rooms, {'a'})
+
+
+class WarmRestartTest(unittest.TestCase):
+    """A restart with a fresh snapshot serves the saved values without polling the upstream"""
+
+    def setUp(self):
+        self.stub = ZStackStub(hosts=3, vms=0, storage=1)
+        url = self.stub.start()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'snapshot.bin')
+        with open(os.path.join(self.directory, 'restart_hosts.json'), 'w') as f:
+            json.dump({
+                'endpoint': url + '/zstack/available-hosts-metrics',
+                'interval': 3600,
+                'success': 'success',
+                'metrics': [{'name': 'restart_available_hosts', 'help': 'Available hosts', 'path': 'data.availableHostCount'}],
+            }, f)
+        self.patches = [
+            mock.patch.object(main, 'metrics_directory', self.directory),
+            mock.patch.object(main, 'SNAPSHOT_PATH', self.path),
+            mock.patch.dict(main.loaded_metrics, clear=True),
+            mock.patch.dict(main.metric_initial_delays, clear=True),
+        ]
+        for patch in self.patches:
+            patch.start()
+        snapshot._series.clear()
+        upstream.clear()
+
+    def tearDown(self):
+        for module in main.loaded_metrics.values():
+            module.close()
+        for patch in reversed(self.patches):
+            patch.stop()
+        snapshot._series.clear()
+        upstream.clear()
+        self.stub.stop()
+        shutil.rmtree(self.directory)
+
+    def restart(self):
+        """Drop the loaded modules and start again from the snapshot file, as a new process would"""
+        for module in main.loaded_metrics.values():
+            module.close()
+        main.loaded_metrics.clear()
+        main.metric_initial_delays.clear()
+        snapshot._series.clear()
+        upstream.clear()
+        main.load_snapshot()
+        main.start_metric_modules()
+
+    def test_no_fetch_after_restart(self):
+        main.start_metric_modules()
+        self.assertEqual(self.stub.requests, 1)
+        main.save_snapshot()
+
+        self.restart()
+        # Give a wrongly started processing thread the time to poll
+        time.sleep(0.5)
+        self.assertEqual(self.stub.requests, 1)
+        module = main.loaded_metrics['restart_hosts']
+        self.assertEqual(module.metrics.value('restart_available_hosts'), 3)
+        self.assertGreater(main.metric_initial_delays['restart_hosts'], 3500)
+
+    def test_recreated_module_is_processed(self):
+        main.start_metric_modules()
+        main.save_snapshot()
+        self.restart()
+        spec = os.path.join(self.directory, 'restart_hosts.json')
+        moved = spec + '.off'
+        os.rename(spec, moved)
+        main.load_metric_modules()
+        os.rename(moved, spec)
+        main.load_metric_modules()
+        self.assertEqual(self.stub.requests, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
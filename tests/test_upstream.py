@@ -0,0 +1,31 @@
+"""Shared upstream response cache against the ZStack stub in stubs/zstack_api.py"""
+import unittest
+
+from exporter import upstream
+from stubs.zstack_api import ZStackStub
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = ZStackStub(hosts=2, vms=0, storage=1)
+        self.url = self.stub.start() + '/zstack/available-hosts-metrics'
+        upstream.clear()
+
+    def tearDown(self):
+        upstream.clear()
+        self.stub.stop()
+
+    def test_zero_ttl_skips_a_fresh_entry(self):
+        upstream.get(self.url, ttl=3600)
+        upstream.get(self.url, ttl=3600)
+        self.assertEqual(self.stub.requests, 1)
+        upstream.get(self.url, ttl=0)
+        self.assertEqual(self.stub.requests, 2)
+        # The refreshed entry serves everyone else
+        upstream.get(self.url, ttl=3600)
+        self.assertEqual(self.stub.requests, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()